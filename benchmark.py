@@ -0,0 +1,413 @@
+import argparse
+import contextlib
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+# The benchmarks run without a window or sound (this has to be set before Pygame is imported).
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import pygame
+
+import particles
+import physics
+import rules as game_rules
+import simulation
+from physics import BALL_RADIUS, WHITE_COLOR, BLACK_COLOR
+from spatial import SpatialHash
+
+# ------------------------------------------------------------
+# GLOBAL CONSTANTS -------------------------------------------
+# ------------------------------------------------------------
+
+# Particle counts to measure.
+PARTICLE_COUNTS = (16, 100, 500, 1000, 2000, 5000, 10000)
+
+# The pair loop is O(n^2), so larger scenes are only measured with the broad phase.
+MAX_NAIVE_COUNT = 2000
+
+# Number of frames timed for every scene.
+FRAMES = 20
+
+# Part of the arena covered by particles (16 balls on the default 800x600 screen cover about 4%).
+DENSITY = 0.04
+
+# Seed of every random scene, so that all runs measure the same work.
+SEED = 0
+
+# Every benchmark is run this many times and the fastest round is reported (the slower ones were disturbed by something else).
+ROUNDS = 5
+
+# Calls per round for the single function benchmarks.
+CALLS = 10000
+
+# Balls left on the table in the late game scene.
+LATE_GAME_BALLS = (WHITE_COLOR, BLACK_COLOR, physics.RED_COLOR, physics.BLUE_STRIPED_COLOR)
+
+# Particle counts of the particles.py scenes in the suite.
+SUITE_PARTICLE_COUNTS = (15, 1000, 10000)
+
+# Ball counts of the ball drawing benchmark.
+DRAW_COUNTS = (16, 100, 1000, 5000)
+
+# Ball counts of the particles.py drawing benchmark. The balls are drawn at random places on a screen of the default size,
+# so the larger counts cover it many times over.
+PARTICLE_DRAW_COUNTS = (100, 1000, 10000, 50000)
+PARTICLE_DRAW_SCREEN_SIZE = (800, 600)
+
+# Number of particles created by the spawn benchmark.
+SPAWN_COUNT = 100000
+
+# Modules whose cold import is timed, each in a fresh interpreter.
+IMPORT_MODULES = ('physics', 'rules', 'simulation', 'particles', 'pool')
+
+# The suite results are written to this file.
+OUTPUT_FILE = 'benchmark.json'
+
+# ------------------------------------------------------------
+# PARTICLE SCENES --------------------------------------------
+# ------------------------------------------------------------
+
+# The particles.py globals which the scenes change.
+SCENE_GLOBALS = ('SCREEN_WIDTH', 'SCREEN_HEIGHT', 'pockets', 'balls', 'screen')
+
+# Put the particles.py globals back when the with block ends, so that a benchmark doesn't depend on the ones run before it.
+@contextlib.contextmanager
+def saved_particle_globals():
+    saved = dict((name, getattr(particles, name)) for name in SCENE_GLOBALS if hasattr(particles, name))
+    balls = list(particles.balls) # The list itself is changed as well (particles.balls[:] = ...).
+    try:
+        yield
+    finally:
+        for name in SCENE_GLOBALS:
+            if name in saved:
+                setattr(particles, name, saved[name])
+            elif hasattr(particles, name):
+                delattr(particles, name)
+        particles.balls[:] = balls
+
+# Create a particles.py scene with count randomly placed (not overlapping) moving balls.
+# The arena is scaled with the count so that the density stays the same. It changes the particles.py globals, see saved_particle_globals().
+def particle_scene(count, seed=0):
+    rng = random.Random(seed)
+    area = count * math.pi * particles.BALL_RADIUS ** 2 / DENSITY
+    particles.SCREEN_HEIGHT = max(600, int(math.sqrt(area * 3 / 4)))
+    particles.SCREEN_WIDTH = max(800, int(particles.SCREEN_HEIGHT * 4 / 3))
+
+    particles.pockets = []
+    for pos in ((particles.POCKET_RADIUS, particles.POCKET_RADIUS), (particles.SCREEN_WIDTH - particles.POCKET_RADIUS, particles.POCKET_RADIUS), (particles.POCKET_RADIUS, particles.SCREEN_HEIGHT - particles.POCKET_RADIUS), (particles.SCREEN_WIDTH - particles.POCKET_RADIUS, particles.SCREEN_HEIGHT - particles.POCKET_RADIUS), (particles.SCREEN_WIDTH / 2, particles.POCKET_RADIUS), (particles.SCREEN_WIDTH / 2, particles.SCREEN_HEIGHT - particles.POCKET_RADIUS)):
+        particles.pockets.append(particles.Pocket(pos))
+
+    particles.balls = particles.spawn(count, speed=(0, 5), rng=rng)
+    return particles.balls
+
+# Average time of one particles.update_balls() frame in milliseconds.
+def time_particle_frames(count, use_grid, frames=FRAMES, seed=0):
+    with saved_particle_globals():
+        balls = particle_scene(count, seed)
+        grid = SpatialHash(2 * particles.BALL_RADIUS) if use_grid else None
+        start = time.perf_counter()
+        for _ in range(frames):
+            particles.update_balls(balls, grid)
+        return (time.perf_counter() - start) * 1000 / frames
+
+# Print the frame time against the particle count for the pair loop and for the broad phase.
+def broad_phase_benchmark(counts=PARTICLE_COUNTS):
+    print('%10s %14s %14s %10s' % ('particles', 'pairs (ms)', 'grid (ms)', 'speedup'))
+    for count in counts:
+        grid_time = time_particle_frames(count, True)
+        if count <= MAX_NAIVE_COUNT:
+            naive_time = time_particle_frames(count, False)
+            print('%10d %14.3f %14.3f %9.1fx' % (count, naive_time, grid_time, naive_time / grid_time))
+        else:
+            print('%10d %14s %14.3f %10s' % (count, '-', grid_time, '-'))
+
+# ------------------------------------------------------------
+# POOL SCENES ------------------------------------------------
+# ------------------------------------------------------------
+
+# Run function(state) CALLS times for every round, with a fresh state from setup() for every round.
+# Returns the fastest round in microseconds per call.
+def time_calls(setup, function, calls=CALLS, rounds=ROUNDS):
+    best = float('inf')
+    for _ in range(rounds):
+        state = setup()
+        start = time.perf_counter()
+        for _ in range(calls):
+            function(state)
+        best = min(best, time.perf_counter() - start)
+    return best * 1e6 / calls
+
+# Shoot the cue ball and step the physics until all the balls stop. Returns the number of steps.
+# If is_active_set is False, every ball is handled in every step (no sleeping balls).
+def run_shot(balls, angle, speed, is_active_set=True):
+    grid = SpatialHash(2 * BALL_RADIUS)
+    active = physics.ActiveSet() if is_active_set else None
+    (balls_pocketed, hits) = ([], [])
+    (balls[0].angle, balls[0].speed) = (angle, speed)
+    steps = 0
+    while physics.are_balls_moving(balls, active):
+        physics.step(balls, grid, balls_pocketed, hits, active=active)
+        steps += 1
+    return steps
+
+# A late game: a few balls at random (seeded) positions, the cue ball first.
+def late_game_scene(seed=SEED):
+    rng = random.Random(seed)
+    balls = []
+    for color in LATE_GAME_BALLS:
+        ball = physics.Ball(color)
+        while True:
+            ball.pos = [rng.uniform(150, physics.POOL_TABLE_SIZE[0] - 150), rng.uniform(100, physics.POOL_TABLE_SIZE[1] - 100)]
+            if all(math.hypot(ball.pos[0] - other.pos[0], ball.pos[1] - other.pos[1]) > 4 * BALL_RADIUS for other in balls):
+                break
+        balls.append(ball)
+    return balls
+
+# Time a whole shot, from the first step until all the balls stop. Returns a result dictionary.
+def time_shot(scene, angle, speed, rounds=ROUNDS, is_active_set=True):
+    best = float('inf')
+    for _ in range(rounds):
+        balls = scene()
+        start = time.perf_counter()
+        steps = run_shot(balls, angle, speed, is_active_set)
+        best = min(best, time.perf_counter() - start)
+    return {'ms': best * 1000, 'steps': steps, 'us_per_step': best * 1e6 / steps, 'balls_left': len(balls)}
+
+# A ball moving through the middle of the table (it doesn't bounce or get pocketed).
+def moving_ball():
+    ball = physics.Ball(physics.RED_COLOR)
+    ball.pos = [physics.POOL_TABLE_SIZE[0] / 2, physics.POOL_TABLE_SIZE[1] / 2]
+    (ball.angle, ball.speed) = (0.5, 1e-9)
+    return ball
+
+# Two touching balls, one of them moving.
+def colliding_balls():
+    (ball1, ball2) = (moving_ball(), moving_ball())
+    ball2.pos[0] += 2 * BALL_RADIUS - 1
+    (ball1.speed, ball2.speed) = (10, 0)
+    return (ball1, ball2)
+
+# Put two balls back at their touching positions and collide them.
+def collide_again(state):
+    (ball1, ball2) = state
+    ball1.pos = [physics.POOL_TABLE_SIZE[0] / 2, physics.POOL_TABLE_SIZE[1] / 2]
+    ball2.pos = [ball1.pos[0] + 2 * BALL_RADIUS - 1, ball1.pos[1]]
+    (ball1.angle, ball1.speed, ball2.speed) = (0.5, 10, 0)
+    physics.collide(ball1, ball2, [])
+
+# The rules after a legal shot that didn't pocket anything (check_rules changes the state, so it's reset before every call).
+def check_rules_again(state):
+    (rules, balls) = state
+    (rules.player, rules.colors, rules.shots) = (1, ('solid', 'striped'), 1)
+    rules.is_cue_ball_thrown = True
+    rules.hits = [balls[2]]
+    rules.balls_pocketed = []
+    rules.check_rules(balls)
+
+# A shot cache which has simulated a break (the state is (cache, balls)).
+def cached_break():
+    (cache, balls) = (simulation.ShotCache(), physics.rack())
+    cache.shot(balls, 0.0, 30)
+    return (cache, balls)
+
+# Time pool.py's hot functions and whole shots.
+def pool_benchmarks():
+    results = {}
+    results['collide'] = {'us_per_call': time_calls(colliding_balls, collide_again)}
+    results['ball_move'] = {'us_per_call': time_calls(moving_ball, lambda ball: ball.move())}
+    results['ball_bounce'] = {'us_per_call': time_calls(moving_ball, lambda ball: ball.bounce())}
+    results['ball_pocket'] = {'us_per_call': time_calls(moving_ball, lambda ball: ball.is_pocketed())}
+    results['check_rules'] = {'us_per_call': time_calls(lambda: (game_rules.Rules(), physics.rack()), check_rules_again)}
+    results['break_16_balls'] = time_shot(physics.rack, 0.0, 30)
+    results['late_game'] = time_shot(late_game_scene, 0.3, 20)
+    results['late_game_all_awake'] = time_shot(late_game_scene, 0.3, 20, is_active_set=False)
+    results['break_16_balls_all_awake'] = time_shot(physics.rack, 0.0, 30, is_active_set=False)
+    results['break_16_balls_cached'] = {'us_per_call': time_calls(cached_break, lambda state: state[0].shot(state[1], 0.0, 30), calls=CALLS // 10)}
+    return results
+
+# Time one frame of pool.py's drawing (no physics) with dirty rectangles and with full redraws.
+def render_benchmarks(frames=FRAMES * 10, rounds=ROUNDS):
+    import pool
+    pool.init() # Open the (dummy) window.
+    pool.game.balls = physics.rack(pool.Ball)
+    pool.loader.wait() # The bar images are decoded in the background.
+    results = {}
+    for (name, is_dirty_rendering) in (('render_frame_dirty', True), ('render_frame_full', False)):
+        pool.screen.is_dirty_rendering = is_dirty_rendering
+        pool.screen.is_full_update_needed = True
+        best = float('inf')
+        for _ in range(rounds):
+            start = time.perf_counter()
+            for _ in range(frames):
+                pool.screen.fill()
+                pool.screen.draw_pool_table()
+                pool.screen.update_bar()
+                pool.screen.draw_bar()
+                pool.screen.draw_balls(pool.game.balls)
+                pool.screen.update()
+            best = min(best, time.perf_counter() - start)
+        results[name] = {'ms': best * 1000 / frames}
+    return results
+
+# Time drawing count balls at random places on pool.py's screen, with a circle per ball and with the cached sprites
+# (anti-aliased and with hard edges). Returns {count: (circles ms, sprites ms, hard sprites ms)} per frame.
+def draw_benchmarks(counts=DRAW_COUNTS, frames=FRAMES, rounds=ROUNDS):
+    import pool
+    pool.init()
+    rng = random.Random(SEED)
+    import sprites
+    caches = (None, sprites.SpriteCache(BALL_RADIUS, pool.stripe_width), sprites.SpriteCache(BALL_RADIUS, pool.stripe_width, False))
+    game_cache = pool.screen.sprites
+    timings = {}
+    for count in counts:
+        balls = []
+        for i in range(count):
+            ball = pool.Ball(physics.BALL_COLORS[i % len(physics.BALL_COLORS)])
+            ball.pos = [rng.uniform(BALL_RADIUS, physics.POOL_TABLE_SIZE[0] - BALL_RADIUS), rng.uniform(BALL_RADIUS, physics.POOL_TABLE_SIZE[1] - BALL_RADIUS)]
+            balls.append(ball)
+        timing = []
+        for cache in caches:
+            pool.screen.sprites = cache
+            best = float('inf')
+            for _ in range(rounds):
+                start = time.perf_counter()
+                for _ in range(frames):
+                    pool.screen.draw_balls(balls)
+                    pool.screen.ball_rects = []
+                    pool.screen.dirty_rects = []
+                best = min(best, time.perf_counter() - start)
+            timing.append(best * 1000 / frames)
+        timings[count] = tuple(timing)
+    pool.screen.sprites = game_cache
+    return timings
+
+# Time drawing count particles.py balls with every renderer. Returns {count: {renderer: ms}} per frame.
+def particle_draw_benchmarks(counts=PARTICLE_DRAW_COUNTS, frames=FRAMES, rounds=ROUNDS):
+    with saved_particle_globals():
+        particles.init()
+        particles.screen = pygame.display.set_mode(PARTICLE_DRAW_SCREEN_SIZE)
+        rng = random.Random(SEED)
+        timings = {}
+        for count in counts:
+            particles.balls[:] = [particles.Ball((rng.uniform(0, PARTICLE_DRAW_SCREEN_SIZE[0]), rng.uniform(0, PARTICLE_DRAW_SCREEN_SIZE[1])), particles.BALL_COLORS[i % len(particles.BALL_COLORS)]) for i in range(count)]
+            timings[count] = {}
+            for renderer in particles.available_renderers():
+                best = float('inf')
+                for _ in range(rounds):
+                    start = time.perf_counter()
+                    for _ in range(frames):
+                        particles.draw(particles.screen, renderer)
+                    best = min(best, time.perf_counter() - start)
+                timings[count][renderer] = best * 1000 / frames
+        return timings
+
+# Time creating a scene of count particles.
+def time_spawn(count=SPAWN_COUNT, rounds=ROUNDS):
+    best = float('inf')
+    for _ in range(rounds):
+        with saved_particle_globals():
+            start = time.perf_counter()
+            particle_scene(count, SEED)
+            best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+# Time particles.py frames with the broad phase, and the spawner.
+def particle_benchmarks(counts=SUITE_PARTICLE_COUNTS):
+    results = {}
+    for count in counts:
+        results['particles_%d' % count] = {'ms': min(time_particle_frames(count, True, seed=SEED) for _ in range(ROUNDS))}
+    results['particles_spawn_%d' % SPAWN_COUNT] = {'ms': time_spawn()}
+    return results
+
+# ------------------------------------------------------------
+# IMPORT TIMES -----------------------------------------------
+# ------------------------------------------------------------
+
+# Import a module in a fresh interpreter, so that nothing is imported yet. Returns the fastest round in milliseconds.
+def time_import(module, rounds=ROUNDS):
+    code = 'import time; start = time.perf_counter(); import %s; print(time.perf_counter() - start)' % module
+    best = float('inf')
+    for _ in range(rounds):
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        best = min(best, float(output.stdout.split()[-1])) # The last line, after anything the module prints.
+    return best * 1000
+
+# Time the cold import of the game modules.
+def import_benchmarks(modules=IMPORT_MODULES):
+    return dict(('import_%s' % module, {'ms': time_import(module)}) for module in modules)
+
+# Run every benchmark. Returns a dictionary which can be saved as JSON and compared with other runs.
+def run_suite():
+    results = {}
+    results.update(pool_benchmarks())
+    results.update(render_benchmarks())
+    for (count, (circles, sprites, hard_sprites)) in draw_benchmarks().items():
+        results['draw_balls_%d_circles' % count] = {'ms': circles}
+        results['draw_balls_%d_sprites' % count] = {'ms': sprites}
+        results['draw_balls_%d_hard_sprites' % count] = {'ms': hard_sprites}
+    for (count, timings) in particle_draw_benchmarks().items():
+        for (renderer, ms) in timings.items():
+            results['particles_draw_%d_%s' % (count, renderer)] = {'ms': ms}
+    results.update(particle_benchmarks())
+    results.update(import_benchmarks())
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'pygame': pygame.version.ver,
+        'platform': platform.platform(),
+        'seed': SEED,
+        'rounds': ROUNDS,
+        'results': results,
+    }
+
+# ------------------------------------------------------------
+# MAIN FUNCTION ----------------------------------------------
+# ------------------------------------------------------------
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark pool.py and particles.py without a display.')
+    parser.add_argument('-o', '--output', default=OUTPUT_FILE, help='write the results to this JSON file')
+    parser.add_argument('--broad-phase', type=int, nargs='*', metavar='COUNT', help='compare the pair loop with the broad phase for these particle counts instead')
+    parser.add_argument('--imports', action='store_true', help='only time the cold imports of the game modules')
+    parser.add_argument('--draw', type=int, nargs='*', metavar='COUNT', help='compare drawing the balls with circles and with sprites for these ball counts instead')
+    parser.add_argument('--particle-draw', type=int, nargs='*', metavar='COUNT', help="compare particles.py's renderers for these ball counts instead")
+    args = parser.parse_args(argv)
+
+    if args.imports:
+        for (name, result) in sorted(import_benchmarks().items()):
+            print('%-20s %.1f ms' % (name, result['ms']))
+        return
+
+    if args.draw is not None:
+        print('%8s %14s %14s %19s' % ('balls', 'circles (ms)', 'sprites (ms)', 'hard sprites (ms)'))
+        for (count, timings) in sorted(draw_benchmarks(args.draw or DRAW_COUNTS).items()):
+            print('%8d %14.3f %14.3f %19.3f' % ((count,) + timings))
+        return
+
+    if args.particle_draw is not None:
+        timings = particle_draw_benchmarks(args.particle_draw or PARTICLE_DRAW_COUNTS)
+        renderers = particles.available_renderers()
+        print('%8s' % 'balls' + ''.join('%16s' % ('%s (ms)' % renderer) for renderer in renderers))
+        for count in sorted(timings):
+            print('%8d' % count + ''.join('%16.3f' % timings[count][renderer] for renderer in renderers))
+        return
+
+    if args.broad_phase is not None:
+        broad_phase_benchmark(args.broad_phase or PARTICLE_COUNTS)
+        return
+
+    suite = run_suite()
+    with open(args.output, 'w') as file:
+        json.dump(suite, file, indent=2, sort_keys=True)
+    for (name, result) in sorted(suite['results'].items()):
+        print('%-20s %s' % (name, ', '.join('%s=%.4g' % item for item in sorted(result.items()))))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,277 @@
+import heapq
+import math
+
+import physics
+from physics import BALL_RADIUS, WHITE_COLOR, POOL_TABLE_SIZE, POOL_TABLE_POCKET_RADIUS, DRAG, SPEED_THRESHOLD
+from physics import POCKET_CENTERS, POCKET_CAPTURE_RADIUS_SQUARED
+from simulation import ShotResult, copy_balls
+
+# ------------------------------------------------------------
+# GLOBAL CONSTANTS -------------------------------------------
+# ------------------------------------------------------------
+# Instead of moving the balls a little every step, this simulator computes when the next event
+# (two balls touching, a ball hitting a cushion, entering a pocket or stopping) happens and jumps straight to it.
+# DRAG is applied continuously: the speed decays as speed * DRAG ** t, where t is the time in physics steps.
+# Then a ball covers speed * f(t) pixels with f(t) = (1 - DRAG ** t) / DECAY, and all the balls share the same f,
+# so positions are linear in f and the event times can be solved exactly.
+
+# Decay rate of the speed per physics step.
+DECAY = -math.log(DRAG)
+
+# Cushion limits for the ball centers (the same limits as Ball.bounce).
+MIN_X = 2 * POOL_TABLE_POCKET_RADIUS + BALL_RADIUS
+MAX_X = POOL_TABLE_SIZE[0] - 2 * POOL_TABLE_POCKET_RADIUS - BALL_RADIUS
+MIN_Y = 2 * POOL_TABLE_POCKET_RADIUS + BALL_RADIUS
+MAX_Y = POOL_TABLE_SIZE[1] - 2 * POOL_TABLE_POCKET_RADIUS - BALL_RADIUS
+
+# Distance (in pixels) within which a ball counts as touching a cushion or another ball, so that rounding errors don't hide a contact.
+CONTACT_TOLERANCE = 1e-6
+
+# Event types. When two events happen at the same time, the lower number goes first (like move, pocket, bounce, collide in physics.step).
+POCKET_EVENT = 0
+CUSHION_EVENT = 1
+COLLISION_EVENT = 2
+STOP_EVENT = 3
+
+# A shot is stopped after this many events even if some balls are still moving.
+MAX_EVENTS = 100000
+
+# ------------------------------------------------------------
+# TIME FUNCTIONS ---------------------------------------------
+# ------------------------------------------------------------
+
+# Distance factor f after time t: a ball with the given speed covers speed * f pixels.
+def distance_factor(t):
+    return -math.expm1(-DECAY * t) / DECAY
+
+# Time it takes to reach the distance factor f. Returns infinity if the ball stops before.
+def time_for_distance_factor(f):
+    if f * DECAY >= 1:
+        return math.inf
+    return -math.log1p(-f * DECAY) / DECAY
+
+# Time until a ball with the given speed drops below SPEED_THRESHOLD.
+def time_to_stop(speed):
+    if speed < SPEED_THRESHOLD:
+        return 0.0
+    return math.log(speed / SPEED_THRESHOLD) / DECAY
+
+# Smallest f >= 0 at which a point moving from p with velocity v (per unit of f) enters a circle. Returns None if it never does.
+def circle_entry(p, v, center, radius_squared):
+    (dx, dy) = (p[0] - center[0], p[1] - center[1])
+    c = dx * dx + dy * dy - radius_squared
+    if c < 0: # Already inside.
+        return 0.0
+    a = v[0] * v[0] + v[1] * v[1]
+    b = dx * v[0] + dy * v[1]
+    discriminant = b * b - a * c
+    if a == 0 or b >= 0 or discriminant < 0: # Not moving, moving away or passing by.
+        return None
+    return (-b - math.sqrt(discriminant)) / a
+
+# ------------------------------------------------------------
+# CLASS EVENT SIMULATOR --------------------------------------
+# ------------------------------------------------------------
+
+class EventSimulator(object):
+    # Initialize a class instance. The balls are changed in place.
+    def __init__(self, balls):
+        self.balls = list(balls) # Balls on the table.
+        self.balls_pocketed = [] # Balls pocketed during the shot, in the order they were pocketed.
+        self.hits = [] # The ball that was hit first by the cue ball.
+        self.time = 0.0 # Current time in physics steps.
+        self.ball_times = dict((ball, 0.0) for ball in self.balls) # The time each ball's position and speed were last updated.
+        self.versions = dict((ball, 0) for ball in self.balls) # Increased every time a ball changes direction, so that its old events are ignored.
+        self.queue = [] # The events as (time, type, order, ball1, ball2, version1, version2).
+        self.order = 0 # Breaks ties between events at the same time.
+        self.event_count = 0 # How many events have been handled.
+
+    # Move a ball along its path to the given time.
+    def advance(self, ball, time):
+        dt = time - self.ball_times[ball]
+        if ball.speed != 0 and dt > 0:
+            f = distance_factor(dt)
+            ball.pos[0] += math.cos(ball.angle) * ball.speed * f
+            ball.pos[1] += math.sin(ball.angle) * ball.speed * f
+            ball.speed *= math.exp(-DECAY * dt)
+        self.ball_times[ball] = time
+
+    # Position and velocity of a ball at the current time (without changing the ball).
+    def state(self, ball):
+        dt = self.time - self.ball_times[ball]
+        if ball.speed == 0:
+            return (ball.pos, (0.0, 0.0))
+        (vx, vy) = (math.cos(ball.angle) * ball.speed, math.sin(ball.angle) * ball.speed)
+        f = distance_factor(dt)
+        decay = math.exp(-DECAY * dt)
+        return ((ball.pos[0] + vx * f, ball.pos[1] + vy * f), (vx * decay, vy * decay))
+
+    # Add an event at the given distance factor f from now, if it happens before the ball stops.
+    def push(self, f, limit, event_type, ball1, ball2=None):
+        if f is None or f > limit:
+            return
+        time = self.time + time_for_distance_factor(f)
+        if time == math.inf:
+            return
+        self.order += 1
+        version2 = None if ball2 is None else self.versions[ball2]
+        heapq.heappush(self.queue, (time, event_type, self.order, ball1, ball2, self.versions[ball1], version2))
+
+    # Compute the next events of a ball: when it stops, hits a cushion, enters a pocket or touches another ball.
+    def schedule(self, ball):
+        if ball.speed < SPEED_THRESHOLD: # Balls this slow are stopped right away, like in Ball.move.
+            if ball.speed != 0:
+                self.push(0.0, 0.0, STOP_EVENT, ball)
+            for other in self.balls:
+                if other is not ball and other.speed != 0:
+                    self.schedule_collision(other, ball)
+            return
+
+        (p, v) = self.state(ball)
+        limit = distance_factor(time_to_stop(ball.speed))
+        self.order += 1
+        heapq.heappush(self.queue, (self.time + time_to_stop(ball.speed), STOP_EVENT, self.order, ball, None, self.versions[ball], None))
+
+        # Cushions.
+        cushion = math.inf
+        if v[0] > 0:
+            cushion = min(cushion, max(0.0, (MAX_X - p[0]) / v[0]))
+        elif v[0] < 0:
+            cushion = min(cushion, max(0.0, (MIN_X - p[0]) / v[0]))
+        if v[1] > 0:
+            cushion = min(cushion, max(0.0, (MAX_Y - p[1]) / v[1]))
+        elif v[1] < 0:
+            cushion = min(cushion, max(0.0, (MIN_Y - p[1]) / v[1]))
+        if cushion != math.inf:
+            self.push(cushion, limit, CUSHION_EVENT, ball)
+
+        # Pockets.
+        for center in POCKET_CENTERS:
+            self.push(circle_entry(p, v, center, POCKET_CAPTURE_RADIUS_SQUARED), limit, POCKET_EVENT, ball)
+
+        # Other balls.
+        for other in self.balls:
+            if other is not ball:
+                self.schedule_collision(ball, other)
+
+    # Compute when two balls will touch. Both move along straight lines in f, so this is a quadratic equation.
+    def schedule_collision(self, ball1, ball2):
+        (p1, v1) = self.state(ball1)
+        (p2, v2) = self.state(ball2)
+        (rx, ry) = (p1[0] - p2[0], p1[1] - p2[1])
+        (dvx, dvy) = (v1[0] - v2[0], v1[1] - v2[1])
+        b = rx * dvx + ry * dvy
+        if b >= 0: # The balls are not getting closer.
+            return
+        a = dvx * dvx + dvy * dvy
+        c = rx * rx + ry * ry - (2 * BALL_RADIUS) ** 2
+        if c <= 0: # The balls already touch.
+            f = 0.0
+        else:
+            discriminant = b * b - a * c
+            if discriminant < 0:
+                return
+            f = c / (-b + math.sqrt(discriminant)) # The smaller root, written so that it doesn't lose precision.
+
+        limit = math.inf
+        for ball in (ball1, ball2):
+            if ball.speed != 0:
+                limit = min(limit, distance_factor(time_to_stop(abs(ball.speed)) - (self.time - self.ball_times[ball])))
+        self.push(f, limit, COLLISION_EVENT, ball1, ball2)
+
+    # Check if an event is still valid (none of its balls has changed since it was computed).
+    def is_valid(self, ball1, ball2, version1, version2):
+        if ball1 not in self.versions or self.versions[ball1] != version1:
+            return False
+        if ball2 is not None and (ball2 not in self.versions or self.versions[ball2] != version2):
+            return False
+        return True
+
+    # Mark a ball as changed and compute its new events.
+    def changed(self, ball):
+        self.versions[ball] += 1
+        self.schedule(ball)
+
+    # Handle a single event.
+    def handle(self, event_type, ball1, ball2):
+        self.advance(ball1, self.time)
+        if ball2 is not None:
+            self.advance(ball2, self.time)
+
+        if event_type == POCKET_EVENT:
+            self.balls.remove(ball1)
+            self.balls_pocketed.append(ball1)
+            del self.versions[ball1]
+            ball1.speed = 0
+
+        elif event_type == CUSHION_EVENT:
+            # Put the ball exactly on the cushion it reached, then bounce it like Ball.bounce does.
+            (vx, vy) = (math.cos(ball1.angle) * ball1.speed, math.sin(ball1.angle) * ball1.speed)
+            if vx > 0 and ball1.pos[0] >= MAX_X - CONTACT_TOLERANCE:
+                ball1.pos[0] = max(ball1.pos[0], MAX_X)
+            elif vx < 0 and ball1.pos[0] <= MIN_X + CONTACT_TOLERANCE:
+                ball1.pos[0] = min(ball1.pos[0], MIN_X)
+            if vy > 0 and ball1.pos[1] >= MAX_Y - CONTACT_TOLERANCE:
+                ball1.pos[1] = max(ball1.pos[1], MAX_Y)
+            elif vy < 0 and ball1.pos[1] <= MIN_Y + CONTACT_TOLERANCE:
+                ball1.pos[1] = min(ball1.pos[1], MIN_Y)
+            ball1.bounce()
+            self.changed(ball1)
+
+        elif event_type == COLLISION_EVENT:
+            # Rounding can leave the balls a hair apart, so move them just into contact for collide().
+            (dx, dy) = (ball1.pos[0] - ball2.pos[0], ball1.pos[1] - ball2.pos[1])
+            dist = math.hypot(dx, dy)
+            if dist > 2 * BALL_RADIUS - CONTACT_TOLERANCE:
+                ball1.pos[0] = ball2.pos[0] + dx * (2 * BALL_RADIUS - CONTACT_TOLERANCE) / dist
+                ball1.pos[1] = ball2.pos[1] + dy * (2 * BALL_RADIUS - CONTACT_TOLERANCE) / dist
+            physics.collide(ball1, ball2, self.hits)
+            self.changed(ball1)
+            self.changed(ball2)
+
+        elif event_type == STOP_EVENT:
+            ball1.speed = 0
+            self.changed(ball1)
+
+    # Run the simulation until all the balls stop. Returns the number of events handled.
+    def run(self, max_events=MAX_EVENTS):
+        # Balls that start inside a pocket are pocketed right away (like the first Ball.is_pocketed call in physics.step).
+        for ball in list(self.balls):
+            if ball.is_pocketed():
+                self.balls.remove(ball)
+                self.balls_pocketed.append(ball)
+                del self.versions[ball]
+        for ball in self.balls:
+            if ball.speed != 0:
+                self.schedule(ball)
+
+        while self.queue and self.event_count < max_events:
+            (time, event_type, _, ball1, ball2, version1, version2) = heapq.heappop(self.queue)
+            if not self.is_valid(ball1, ball2, version1, version2):
+                continue
+            self.time = time
+            self.handle(event_type, ball1, ball2)
+            self.event_count += 1
+
+        # Move every ball to where it is at the end.
+        for ball in self.balls:
+            self.advance(ball, self.time)
+            if self.event_count >= max_events:
+                ball.speed = 0
+        return self.event_count
+
+# ------------------------------------------------------------
+# SIMULATION FUNCTION ----------------------------------------
+# ------------------------------------------------------------
+
+# Same as simulation.simulate_shot, but jumps from event to event. ShotResult.steps is the time (in physics steps) the balls took to stop.
+def simulate_shot(balls, angle, speed, max_events=MAX_EVENTS):
+    balls = copy_balls(balls)
+    cue_balls = [ball for ball in balls if ball.color == WHITE_COLOR]
+    if len(cue_balls) != 1:
+        raise ValueError('the table must have exactly one cue ball')
+    (cue_balls[0].angle, cue_balls[0].speed) = (angle, speed)
+
+    simulator = EventSimulator(balls)
+    simulator.run(max_events)
+    return ShotResult(simulator.balls, simulator.balls_pocketed, simulator.hits[0] if simulator.hits else None, int(math.ceil(simulator.time)))
@@ -0,0 +1,67 @@
+import queue
+import threading
+
+# ------------------------------------------------------------
+# CLASS LOADER -----------------------------------------------
+# ------------------------------------------------------------
+# A background loader: images are decoded and songs are read into memory on a separate thread, so the game loop
+# never waits for the disk. The game asks for a result every frame and uses a placeholder (or waits a frame) until it's there.
+
+class Loader(object):
+    # Initialize a class instance and start the loading thread.
+    def __init__(self):
+        self.requests = queue.Queue() # (key, function, args) waiting to be loaded, None stops the thread.
+        self.pending = set() # Keys which have been requested but not taken yet.
+        self.results = {} # Loaded values (or the exceptions raised while loading them) by key.
+        self.thread = threading.Thread(target=self.load_requests, daemon=True)
+        self.thread.start()
+
+    # Ask for function(*args) to be run on the loading thread. Nothing happens if the key has already been requested.
+    def request(self, key, function, *args):
+        if key in self.pending:
+            return
+        self.pending.add(key)
+        self.requests.put((key, function, args))
+
+    # Check if a requested key has been loaded.
+    def is_loaded(self, key):
+        return key in self.results
+
+    # Get a loaded value and forget it. Returns None if it isn't loaded yet (it never waits).
+    # If the load failed, its exception is raised here, on the thread which needs the value.
+    def take(self, key):
+        if key not in self.results:
+            return None
+        self.pending.discard(key)
+        result = self.results.pop(key)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    # Wait until every requested load is finished (for tools and benchmarks, the game loop never waits).
+    def wait(self):
+        self.requests.join()
+
+    # Run the requests (runs on the loading thread).
+    def load_requests(self):
+        while True:
+            item = self.requests.get()
+            if item is None:
+                self.requests.task_done()
+                return
+            (key, function, args) = item
+            try:
+                self.results[key] = function(*args)
+            except Exception as error:
+                self.results[key] = error
+            self.requests.task_done()
+
+    # Stop the loading thread (the load that is running is finished first).
+    def close(self):
+        self.requests.put(None)
+        self.thread.join()
+
+# Read a whole file into memory (used to prefetch songs, which are then streamed from memory).
+def read_file(path):
+    with open(path, 'rb') as file:
+        return file.read()
@@ -0,0 +1,223 @@
+import argparse
+import concurrent.futures
+import hashlib
+import math
+import os
+import random
+import time
+
+import event_driven
+import physics
+import rules as game_rules
+import simulation
+from physics import WHITE_COLOR
+
+# ------------------------------------------------------------
+# GLOBAL CONSTANTS -------------------------------------------
+# ------------------------------------------------------------
+# A computer player: it tries candidate shots on copies of the table, in worker processes, and plays the best one.
+
+# Difficulty levels: (time budget per decision in seconds, aim error in radians).
+DIFFICULTIES = {
+    'easy': (0.1, 0.05),
+    'medium': (0.3, 0.02),
+    'hard': (0.8, 0.0),
+}
+
+# Candidate shots sent to a worker at once. Small chunks keep the workers busy until the time budget is over without overshooting it by much.
+CHUNK_SIZE = 8
+
+# Part of the candidates that are aimed at an object ball, the others are shot in a random direction.
+AIMED_SHOTS = 0.75
+
+# Random error added to the angle of an aimed candidate (so that cut shots are tried as well).
+AIM_SPREAD = 0.15
+
+# Shot scores.
+WIN_SCORE = 1000
+LOSS_SCORE = -1000
+FOUL_SCORE = -100
+BALL_POCKETED_SCORE = 10
+
+# Simulation functions the computer player can use.
+ENGINES = {
+    'event': event_driven.simulate_shot,
+    'step': simulation.simulate_shot,
+}
+
+# Shot results kept by every worker process (see simulation.ShotCache). The candidates of a table are always drawn in the same
+# order, so a player who thinks again about the same table gets the shots it has already tried from the cache and goes further
+# (with several workers, only the chunks which go to the same worker as the first time).
+CACHE_SIZE = simulation.CACHE_SIZE
+
+# ------------------------------------------------------------
+# WORKER FUNCTIONS -------------------------------------------
+# ------------------------------------------------------------
+# These run in the worker processes. The table is sent as (color, pos) pairs instead of the game's Ball objects,
+# so that the workers don't have to import pool.py (and Pygame).
+
+# Copy the balls and the state of the rules into something that can be sent to a worker.
+def table_state(balls, rules):
+    table = [(tuple(ball.color), (ball.pos[0], ball.pos[1])) for ball in balls]
+    return (table, (rules.player, rules.colors, rules.shots))
+
+# Create physics balls from a table made by table_state().
+def balls_from_table(table):
+    balls = []
+    for (color, pos) in table:
+        ball = physics.Ball(color)
+        ball.pos = [pos[0], pos[1]]
+        balls.append(ball)
+    return balls
+
+# A seed for the candidates of a table, the same in every process (hash() of strings isn't: it's randomized per process).
+def table_seed(seed, balls, state):
+    key = (seed, simulation.shot_key(balls, 0.0, 0.0), state[0], tuple(state[1]), state[2])
+    return int.from_bytes(hashlib.blake2b(repr(key).encode()).digest()[:8], 'little')
+
+# Score a finished shot with the game rules: the rules are applied to a copy exactly as the game would apply them.
+# Returns (score, foul).
+def score_shot(result, state):
+    (player, colors, shots) = state
+    rules = game_rules.Rules()
+    (rules.player, rules.colors, rules.shots) = (player, colors, shots)
+    rules.count_balls([ball.color for ball in result.balls + result.balls_pocketed]) # The balls on the table before the shot.
+    rules.balls_pocketed = list(result.balls_pocketed)
+    rules.hits = [] if result.first_hit is None else [result.first_hit]
+    rules.is_cue_ball_thrown = True
+    foul = rules.check_rules(list(result.balls)) # A copy: check_rules puts a pocketed cue ball back, and the result may be cached.
+
+    if rules.who_won == player:
+        return (WIN_SCORE, foul)
+    if rules.who_won is not None:
+        return (LOSS_SCORE, foul)
+    if foul is not None:
+        return (FOUL_SCORE, foul)
+    if rules.player != player: # The turn is over.
+        return (0, foul)
+    return (BALL_POCKETED_SCORE * len(result.balls_pocketed), foul)
+
+# Simulate and score a shot. Returns (score, foul, result).
+def evaluate_shot(balls, angle, speed, state, engine):
+    result = ENGINES[engine](balls, angle, speed)
+    return score_shot(result, state) + (result,)
+
+# The shot cache of this worker process, created by its first chunk.
+shot_cache = None
+
+# Simulate and score a chunk of candidate shots. Returns a list of (score, angle, speed) and the number of shots found in the cache.
+# The shots are looked up in the worker's cache, so the ones scored are quantized (see simulation.cached_shot) and returned that way.
+def evaluate_shots(table, state, shots, engine='event', cache_size=CACHE_SIZE):
+    global shot_cache
+    if shot_cache is None or shot_cache.size != cache_size:
+        shot_cache = simulation.ShotCache(cache_size, evaluate_shot)
+    balls = balls_from_table(table)
+    state = (state[0], tuple(state[1]), state[2]) # Part of the key.
+    (scores, hits) = ([], shot_cache.hits)
+    for (angle, speed) in shots:
+        (score, foul, result) = shot_cache.shot(balls, angle, speed, state, engine)
+        scores.append((score,) + simulation.cached_shot(angle, speed))
+    return (scores, shot_cache.hits - hits)
+
+# ------------------------------------------------------------
+# CLASS COMPUTER PLAYER --------------------------------------
+# ------------------------------------------------------------
+
+class ComputerPlayer(object):
+    # Initialize a class instance. The worker processes are started once and reused for every decision.
+    def __init__(self, difficulty='hard', workers=None, engine='event', seed=None, cache_size=CACHE_SIZE):
+        (self.time_budget, self.aim_error) = DIFFICULTIES[difficulty] # Seconds per decision and random error of the chosen shot.
+        self.engine = engine # Name of the simulation function (see ENGINES).
+        self.cache_size = cache_size # Shot results kept by every worker.
+        self.workers = workers or os.cpu_count() or 1 # Number of worker processes.
+        self.pool = concurrent.futures.ProcessPoolExecutor(self.workers)
+        self.seed = seed # Seed of the candidates, mixed with the table.
+        self.random = random.Random(seed) # Random numbers for the aim error.
+        self.shots_evaluated = 0 # How many candidates were scored for the last decision.
+        self.cache_hits = 0 # How many of them were found in a worker's shot cache instead of being simulated.
+
+    # Stop the worker processes.
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+    # Create a chunk of candidate shots with the random numbers rng: most of them are aimed at an object ball, the rest are random.
+    # They are quantized like the shot cache's keys, so the shot that is scored is the shot that is played.
+    def candidates(self, balls, rng, count=CHUNK_SIZE):
+        cue_ball = next(ball for ball in balls if ball.color == WHITE_COLOR)
+        targets = [ball for ball in balls if ball.color != WHITE_COLOR]
+        shots = []
+        for _ in range(count):
+            if targets and rng.random() < AIMED_SHOTS:
+                target = rng.choice(targets)
+                angle = math.atan2(target.pos[1] - cue_ball.pos[1], target.pos[0] - cue_ball.pos[0]) + rng.gauss(0, AIM_SPREAD)
+            else:
+                angle = rng.uniform(-math.pi, math.pi)
+            shots.append(simulation.cached_shot(angle, rng.uniform(1, simulation.MAX_SHOT_SPEED)))
+        return shots
+
+    # Choose a shot for the current player. Returns (angle, speed).
+    # The candidates are simulated in parallel until the time budget is over, then the best one is played.
+    # If no chunk is done by then, the first one is waited for: there's always a simulated shot to play.
+    def choose_shot(self, balls, rules, time_budget=None):
+        deadline = time.perf_counter() + (self.time_budget if time_budget is None else time_budget)
+        (table, state) = table_state(balls, rules)
+        rng = random.Random(table_seed(self.seed, balls, state)) # The same candidates for the same table.
+        best = (-math.inf, 0.0, 0.0)
+        (self.shots_evaluated, self.cache_hits) = (0, 0)
+
+        # Keep two chunks per worker in the queue, so that no worker waits for the next chunk.
+        futures = set(self.pool.submit(evaluate_shots, table, state, self.candidates(balls, rng), self.engine, self.cache_size) for _ in range(2 * self.workers))
+        while futures:
+            timeout = max(deadline - time.perf_counter(), 0) if self.shots_evaluated else None
+            (done, futures) = concurrent.futures.wait(futures, timeout, concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                (scores, hits) = future.result()
+                for scored in scores:
+                    best = max(best, scored)
+                    self.shots_evaluated += 1
+                self.cache_hits += hits
+                if time.perf_counter() < deadline:
+                    futures.add(self.pool.submit(evaluate_shots, table, state, self.candidates(balls, rng), self.engine, self.cache_size))
+            if time.perf_counter() >= deadline and self.shots_evaluated:
+                for future in futures:
+                    future.cancel() # The chunks that are already running are finished in the background and ignored.
+                break
+
+        (score, angle, speed) = best
+        if self.aim_error:
+            angle += self.random.gauss(0, self.aim_error)
+        return (angle, speed)
+
+# ------------------------------------------------------------
+# MAIN FUNCTION ----------------------------------------------
+# ------------------------------------------------------------
+
+# Measure how many candidate shots are evaluated per decision with 1, 2, ... all cores,
+# and per decision about the same table again (the shots tried the first time come from the workers' caches).
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure how the computer player scales with the number of cores.')
+    parser.add_argument('--difficulty', choices=sorted(DIFFICULTIES), default='hard')
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='event')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    cores = os.cpu_count() or 1
+    counts = sorted(set([1, 2, 4, 8, 16, 32, cores]))
+    base = None
+    print('%8s %12s %12s %10s %12s %12s' % ('workers', 'time (s)', 'shots', 'speedup', 'shots again', 'cache hits'))
+    for workers in [count for count in counts if count <= cores]:
+        player = ComputerPlayer(args.difficulty, workers, args.engine, args.seed)
+        player.choose_shot(physics.rack(), game_rules.Rules(), 0.05) # Start the worker processes.
+        rules = game_rules.Rules()
+        rules.player = 2
+        start = time.perf_counter()
+        player.choose_shot(physics.rack(), rules)
+        elapsed = time.perf_counter() - start
+        shots = player.shots_evaluated
+        player.choose_shot(physics.rack(), rules)
+        player.close()
+        base = base or shots
+        print('%8d %12.3f %12d %9.1fx %12d %12d' % (workers, elapsed, shots, shots / float(base), player.shots_evaluated, player.cache_hits))
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,14 @@
-import pygame
+import gc
+import itertools
 import random
 import math
 
-pygame.init()
+from spatial import SpatialHash
+
+pygame = None # Imported by init() when the game starts, so that importing this module doesn't load Pygame.
+ball_sprites = None # The ball and pocket images, created by init().
+pocket_sprites = None
+pixel_renderer = None # Draws the balls into the screen's pixels, created by init() if NumPy is installed.
 
 BG_COLOR = (102, 140, 93)
 WHITE = (255, 255, 255)
@@ -12,6 +18,21 @@ BALL_RADIUS = 20
 POCKET_RADIUS = 23
 DRAG = 0.999
 ELASTICITY = 0.9
+POCKET_CAPTURE_RADIUS_SQUARED = (BALL_RADIUS / 2) ** 2 # A ball is destroyed when its center is this close to a pocket's center (squared).
+POCKET_REGIONS = ((0, 4, 1), (2, 5, 3)) # Index in pockets of the pocket in each region of the screen (2 rows, 3 columns).
+
+BALL_COLORS = (WHITE, BLACK, (227, 205, 170), (170, 192, 227), (170, 227, 201), (227, 170, 196), (143, 50, 92), (106, 50, 143), (59, 47, 194), (182, 194, 47), (194, 113, 47), (47, 128, 194), (56, 92, 102), (102, 56, 56), (66, 242, 17), (193, 17, 242))
+
+PARTICLE_COUNT = len(BALL_COLORS) # Number of balls created when the game starts.
+PARTICLE_SPEED = (0, 0) # The balls start with a random direction and a speed in this range.
+SPAWN_ATTEMPTS = 30 # spawn() gives up after this many random positions per ball.
+# How the balls are drawn: 'circles' (a pygame.draw.circle call per ball), 'sprites' (cached images drawn with one blit call, see sprites.py)
+# or 'pixels' (stamped into the screen's pixels with NumPy, see pixels.py). R switches between them while the game runs.
+RENDERER = 'sprites'
+RENDERERS = ('circles', 'sprites', 'pixels')
+ANTIALIASING = True # If it's False, the sprites have hard edges, which are blitted about twice as fast.
+
+TRAJECTORY_DIR = None # If it's set, the balls' positions, angles and speeds are saved to this directory every frame (needs NumPy).
 
 def collide(b1, b2):
     dx = b1.x - b2.x
@@ -51,14 +72,48 @@ def collide(b1, b2):
         b2.x -= math.cos(angle) * 0.5 * overlap
         b2.y -= math.sin(angle) * 0.5 * overlap
 
-def find_ball((mouse_x, mouse_y)):
-    for ball in balls:
+def find_ball(mouse_pos):
+    (mouse_x, mouse_y) = mouse_pos
+    for ball in grid.nearby(mouse_pos, BALL_RADIUS):
         if math.hypot(ball.x - mouse_x, ball.y - mouse_y) <= BALL_RADIUS:
-            i = balls.index(ball)
-            return balls[i]
+            return ball
+
+def find_pocket(pos):
+    (x, y) = pos
+    column = 0 if x < SCREEN_WIDTH / 4 else (2 if x > SCREEN_WIDTH * 3 / 4 else 1)
+    row = 0 if y < SCREEN_HEIGHT / 2 else 1
+    return pockets[POCKET_REGIONS[row][column]]
+
+def update_balls(balls, grid=None):
+    if grid is not None:
+        grid.build([(ball, (ball.x, ball.y)) for ball in balls])
+
+    destroyed = []
+
+    for i, ball1 in enumerate(balls):
+        ball1.move()
+        ball1.bounce()
+        if grid is None:
+            for ball2 in balls[i + 1:]:
+                collide(ball1, ball2)
+        else:
+            for ball2 in grid.nearby((ball1.x, ball1.y), 2 * BALL_RADIUS, ball1):
+                collide(ball1, ball2)
+                grid.update(ball2, (ball2.x, ball2.y))
+            grid.update(ball1, (ball1.x, ball1.y))
+        if ball1.is_destroyed():
+            destroyed.append(ball1)
+            if grid is not None:
+                grid.remove(ball1)
+
+    # Remove the destroyed balls only now, so that the loop above doesn't skip any ball.
+    if destroyed:
+        destroyed = set(destroyed)
+        balls[:] = [ball for ball in balls if ball not in destroyed]
 
 class Ball():
-    def __init__(self, (x, y), color):
+    def __init__(self, pos, color):
+        (x, y) = pos
         self.x = x
         self.y = y
         self.color = color
@@ -90,16 +145,15 @@ class Ball():
             self.speed *= ELASTICITY
 
     def is_destroyed(self):
-        for pocket in pockets:
-            if self.x > pocket .x - BALL_RADIUS / 2 and self.x < pocket .x + BALL_RADIUS / 2 and self.y > pocket .y - BALL_RADIUS / 2 and self.y < pocket .y + BALL_RADIUS / 2:
-                i = balls.index(self)
-                del balls[i]
+        pocket = find_pocket((self.x, self.y))
+        return (self.x - pocket.x) ** 2 + (self.y - pocket.y) ** 2 < POCKET_CAPTURE_RADIUS_SQUARED
 
     def display(self):
         pygame.draw.circle(screen, self.color, (int(self.x), int(self.y)), BALL_RADIUS)
 
 class Pocket():
-    def __init__(self, (x, y)):
+    def __init__(self, pos):
+        (x, y) = pos
         self.x = x
         self.y = y
         self.color = BLACK
@@ -107,58 +161,7 @@ class Pocket():
     def display(self):
         pygame.draw.circle(screen, self.color, (int(self.x), int(self.y)), POCKET_RADIUS)
 
-screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-pygame.display.set_caption('Pool table particle system')
-
-balls = []
-x = random.randint(2 * POCKET_RADIUS + BALL_RADIUS, SCREEN_WIDTH - 2 * POCKET_RADIUS - BALL_RADIUS)
-y = random.randint(2 * BALL_RADIUS + BALL_RADIUS, SCREEN_HEIGHT - 2 * POCKET_RADIUS - BALL_RADIUS)
-balls.append(Ball((x, y), WHITE))
-x = random.randint(2 * POCKET_RADIUS + BALL_RADIUS, SCREEN_WIDTH - 2 * POCKET_RADIUS - BALL_RADIUS)
-y = random.randint(2 * BALL_RADIUS + BALL_RADIUS, SCREEN_HEIGHT - 2 * POCKET_RADIUS - BALL_RADIUS)
-balls.append(Ball((x, y), BLACK))
-x = random.randint(2 * POCKET_RADIUS + BALL_RADIUS, SCREEN_WIDTH - 2 * POCKET_RADIUS - BALL_RADIUS)
-y = random.randint(2 * BALL_RADIUS + BALL_RADIUS, SCREEN_HEIGHT - 2 * POCKET_RADIUS - BALL_RADIUS)
-balls.append(Ball((x, y), (227, 205, 170)))
-x = random.randint(2 * POCKET_RADIUS + BALL_RADIUS, SCREEN_WIDTH - 2 * POCKET_RADIUS - BALL_RADIUS)
-y = random.randint(2 * BALL_RADIUS + BALL_RADIUS, SCREEN_HEIGHT - 2 * POCKET_RADIUS - BALL_RADIUS)
-balls.append(Ball((x, y), (170, 192, 227)))
-x = random.randint(2 * POCKET_RADIUS + BALL_RADIUS, SCREEN_WIDTH - 2 * POCKET_RADIUS - BALL_RADIUS)
-y = random.randint(2 * BALL_RADIUS + BALL_RADIUS, SCREEN_HEIGHT - 2 * POCKET_RADIUS - BALL_RADIUS)
-balls.append(Ball((x, y), (170, 227, 201)))
-x = random.randint(2 * POCKET_RADIUS + BALL_RADIUS, SCREEN_WIDTH - 2 * POCKET_RADIUS - BALL_RADIUS)
-y = random.randint(2 * BALL_RADIUS + BALL_RADIUS, SCREEN_HEIGHT - 2 * POCKET_RADIUS - BALL_RADIUS)
-balls.append(Ball((x, y), (227, 170, 196)))
-x = random.randint(2 * POCKET_RADIUS + BALL_RADIUS, SCREEN_WIDTH - 2 * POCKET_RADIUS - BALL_RADIUS)
-y = random.randint(2 * BALL_RADIUS + BALL_RADIUS, SCREEN_HEIGHT - 2 * POCKET_RADIUS - BALL_RADIUS)
-balls.append(Ball((x, y), (143, 50, 92)))
-x = random.randint(2 * POCKET_RADIUS + BALL_RADIUS, SCREEN_WIDTH - 2 * POCKET_RADIUS - BALL_RADIUS)
-y = random.randint(2 * BALL_RADIUS + BALL_RADIUS, SCREEN_HEIGHT - 2 * POCKET_RADIUS - BALL_RADIUS)
-balls.append(Ball((x, y), (106, 50, 143)))
-x = random.randint(2 * POCKET_RADIUS + BALL_RADIUS, SCREEN_WIDTH - 2 * POCKET_RADIUS - BALL_RADIUS)
-y = random.randint(2 * BALL_RADIUS + BALL_RADIUS, SCREEN_HEIGHT - 2 * POCKET_RADIUS - BALL_RADIUS)
-balls.append(Ball((x, y), (59, 47, 194)))
-x = random.randint(2 * POCKET_RADIUS + BALL_RADIUS, SCREEN_WIDTH - 2 * POCKET_RADIUS - BALL_RADIUS)
-y = random.randint(2 * BALL_RADIUS + BALL_RADIUS, SCREEN_HEIGHT - 2 * POCKET_RADIUS - BALL_RADIUS)
-balls.append(Ball((x, y), (182, 194, 47)))
-x = random.randint(2 * POCKET_RADIUS + BALL_RADIUS, SCREEN_WIDTH - 2 * POCKET_RADIUS - BALL_RADIUS)
-y = random.randint(2 * BALL_RADIUS + BALL_RADIUS, SCREEN_HEIGHT - 2 * POCKET_RADIUS - BALL_RADIUS)
-balls.append(Ball((x, y), (194, 113, 47)))
-x = random.randint(2 * POCKET_RADIUS + BALL_RADIUS, SCREEN_WIDTH - 2 * POCKET_RADIUS - BALL_RADIUS)
-y = random.randint(2 * BALL_RADIUS + BALL_RADIUS, SCREEN_HEIGHT - 2 * POCKET_RADIUS - BALL_RADIUS)
-balls.append(Ball((x, y), (47, 128, 194)))
-x = random.randint(2 * POCKET_RADIUS + BALL_RADIUS, SCREEN_WIDTH - 2 * POCKET_RADIUS - BALL_RADIUS)
-y = random.randint(2 * BALL_RADIUS + BALL_RADIUS, SCREEN_HEIGHT - 2 * POCKET_RADIUS - BALL_RADIUS)
-balls.append(Ball((x, y), (56, 92, 102)))
-x = random.randint(2 * POCKET_RADIUS + BALL_RADIUS, SCREEN_WIDTH - 2 * POCKET_RADIUS - BALL_RADIUS)
-y = random.randint(2 * BALL_RADIUS + BALL_RADIUS, SCREEN_HEIGHT - 2 * POCKET_RADIUS - BALL_RADIUS)
-balls.append(Ball((x, y), (102, 56, 56)))
-x = random.randint(2 * POCKET_RADIUS + BALL_RADIUS, SCREEN_WIDTH - 2 * POCKET_RADIUS - BALL_RADIUS)
-y = random.randint(2 * BALL_RADIUS + BALL_RADIUS, SCREEN_HEIGHT - 2 * POCKET_RADIUS - BALL_RADIUS)
-balls.append(Ball((x, y), (66, 242, 17)))
-x = random.randint(2 * POCKET_RADIUS + BALL_RADIUS, SCREEN_WIDTH - 2 * POCKET_RADIUS - BALL_RADIUS)
-y = random.randint(2 * BALL_RADIUS + BALL_RADIUS, SCREEN_HEIGHT - 2 * POCKET_RADIUS - BALL_RADIUS)
-balls.append(Ball((x, y), (193, 17, 242)))
+balls = [] # Created by create_balls() when the game starts.
 
 pockets = []
 pockets.append(Pocket((POCKET_RADIUS, POCKET_RADIUS)))
@@ -168,40 +171,158 @@ pockets.append(Pocket((SCREEN_WIDTH - POCKET_RADIUS, SCREEN_HEIGHT - POCKET_RADI
 pockets.append(Pocket((SCREEN_WIDTH / 2, POCKET_RADIUS)))
 pockets.append(Pocket((SCREEN_WIDTH / 2, SCREEN_HEIGHT - POCKET_RADIUS)))
 
-selected_ball = None
-mouse_coords = (0, 0)
-running = True
+grid = SpatialHash(2 * BALL_RADIUS)
 
-while running:
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            running = False
-        elif event.type == pygame.MOUSEBUTTONDOWN:
-            (mouse_x, mouse_y) = pygame.mouse.get_pos()
-            selected_ball = find_ball((mouse_x, mouse_y))
-        elif event.type == pygame.MOUSEBUTTONUP:
-            selected_ball = None
+# Create count balls at random positions inside area (left, top, width, height), no two of them closer than min_distance (Poisson-disk sampling).
+# Random positions are tried one after another (dart throwing) and checked against a grid with cells as wide as min_distance,
+# so a position is only compared with the balls in the 9 cells around it. The colors are taken from palette in turn,
+# the speeds are random between speed[0] and speed[1]. Raises ValueError if the balls don't fit.
+def spawn(count, area=None, palette=BALL_COLORS, speed=(0, 0), min_distance=2 * BALL_RADIUS, rng=random, attempts=SPAWN_ATTEMPTS):
+    # Nothing here creates reference cycles, but the garbage collector would scan the new objects again and again while they are created.
+    is_gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return spawn_balls(count, area, palette, speed, min_distance, rng, attempts)
+    finally:
+        if is_gc_enabled:
+            gc.enable()
+
+# The work of spawn(), done while the garbage collector is paused.
+def spawn_balls(count, area, palette, speed, min_distance, rng, attempts):
+    if area is None: # Everywhere the balls can't fall into a pocket right away.
+        margin = 2 * POCKET_RADIUS + BALL_RADIUS
+        area = (margin, margin, SCREEN_WIDTH - 2 * margin, SCREEN_HEIGHT - 2 * margin)
+    (left, top, width, height) = area
+    scale = 1.0 / min_distance
+    stride = int(width * scale) + 3 # An empty cell on every side, so the neighbours of a cell are never out of the grid.
+    cells = [()] * (stride * (int(height * scale) + 3)) # The positions (relative to the area) in every cell.
+    neighbours = [row * stride + column for row in (-1, 0, 1) for column in (-1, 0, 1)]
+    min_distance_squared = min_distance ** 2
+    random_value = rng.random
+
+    positions = []
+    for _ in range(count * attempts):
+        if len(positions) == count:
+            break
+        x = random_value() * width
+        y = random_value() * height
+        cell = (int(y * scale) + 1) * stride + int(x * scale) + 1
+        for neighbour in neighbours:
+            for (other_x, other_y) in cells[cell + neighbour]:
+                if (other_x - x) ** 2 + (other_y - y) ** 2 < min_distance_squared:
+                    break
+            else:
+                continue
+            break # Too close to another ball.
+        else:
+            cells[cell] += ((x, y),)
+            positions.append((left + x, top + y))
+    if len(positions) < count:
+        raise ValueError('only %d of %d balls fit into the area' % (len(positions), count))
 
-    if selected_ball:
-        (mouse_x, mouse_y) = pygame.mouse.get_pos()
-        dx = mouse_x - selected_ball.x
-        dy = mouse_y - selected_ball.y
-        selected_ball.angle = math.atan2(dy, dx)
-        selected_ball.speed = math.hypot(dx, dy) * 0.1
+    balls = []
+    (min_speed, speed_range) = (speed[0], speed[1] - speed[0])
+    for (pos, color) in zip(positions, itertools.cycle(palette)):
+        ball = Ball(pos, color)
+        ball.angle = (2 * random_value() - 1) * math.pi
+        ball.speed = min_speed + speed_range * random_value()
+        balls.append(ball)
+    return balls
 
-    screen.fill(BG_COLOR)
+# Draw the pockets and the balls with one blit call.
+def draw_sprites(surface):
+    blits = [(pocket_sprites[pocket.color], (int(pocket.x) - POCKET_RADIUS, int(pocket.y) - POCKET_RADIUS)) for pocket in pockets]
+    blits.extend([(ball_sprites[ball.color], (int(ball.x) - BALL_RADIUS, int(ball.y) - BALL_RADIUS)) for ball in balls])
+    surface.blits(blits, False)
 
+# Draw the pockets with circles and stamp the balls into the surface's pixels.
+def draw_pixels(surface):
     for pocket in pockets:
         pocket.display()
+    pixel_renderer.draw(surface, [ball.x for ball in balls], [ball.y for ball in balls], [ball.color for ball in balls])
 
-    for i, ball1 in enumerate(balls):
-        ball1.move()
-        ball1.bounce()
-        for ball2 in balls[i + 1:]:
-            collide(ball1, ball2)
-        ball1.is_destroyed()
-        ball1.display()
+# Draw the pockets and the balls with a renderer (see RENDERER).
+def draw(surface, renderer):
+    if renderer == 'sprites':
+        draw_sprites(surface)
+    elif renderer == 'pixels':
+        draw_pixels(surface)
+    else:
+        for pocket in pockets:
+            pocket.display()
+        for ball in balls:
+            ball.display()
+
+# The renderers that can be used (the pixel renderer needs NumPy).
+def available_renderers():
+    return [renderer for renderer in RENDERERS if renderer != 'pixels' or pixel_renderer is not None]
+
+# Import and initialize Pygame and create the balls.
+def init():
+    global pygame, ball_sprites, pocket_sprites, pixel_renderer
+
+    import pygame
+    pygame.init()
+    import pixels # Both import Pygame as well.
+    import sprites
+    ball_sprites = sprites.SpriteCache(BALL_RADIUS, is_antialiased=ANTIALIASING) # The images are only drawn when they're used.
+    pocket_sprites = sprites.SpriteCache(POCKET_RADIUS, is_antialiased=ANTIALIASING)
+    if RENDERER == 'pixels' or pixels.np is not None:
+        pixel_renderer = pixels.PixelRenderer(BALL_RADIUS) # Raises ImportError without NumPy.
+    balls[:] = spawn(PARTICLE_COUNT, speed=PARTICLE_SPEED)
+    grid.build([(ball, (ball.x, ball.y)) for ball in balls])
+
+def main():
+    global screen
+
+    init()
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    renderer = RENDERER
+    pygame.display.set_caption('Pool table particle system (%s)' % renderer)
+
+    selected_ball = None
+    mouse_coords = (0, 0)
+    running = True
+
+    trajectories = None
+    if TRAJECTORY_DIR:
+        import trajectory
+        trajectories = trajectory.TrajectoryRecorder(TRAJECTORY_DIR, len(balls))
+
+    while running:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type == pygame.MOUSEBUTTONDOWN:
+                (mouse_x, mouse_y) = pygame.mouse.get_pos()
+                selected_ball = find_ball((mouse_x, mouse_y))
+            elif event.type == pygame.MOUSEBUTTONUP:
+                selected_ball = None
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_r: # Switch to the next renderer.
+                renderers = available_renderers()
+                renderer = renderers[(renderers.index(renderer) + 1) % len(renderers)]
+                pygame.display.set_caption('Pool table particle system (%s)' % renderer)
+
+        if selected_ball:
+            (mouse_x, mouse_y) = pygame.mouse.get_pos()
+            dx = mouse_x - selected_ball.x
+            dy = mouse_y - selected_ball.y
+            selected_ball.angle = math.atan2(dy, dx)
+            selected_ball.speed = math.hypot(dx, dy) * 0.1
+
+        screen.fill(BG_COLOR)
+
+        update_balls(balls, grid)
+        if trajectories:
+            trajectories.record(balls)
+
+        draw(screen, renderer)
+
+        pygame.display.flip()
 
-    pygame.display.flip()
+    if trajectories:
+        trajectories.close()
 
-pygame.quit()
+if __name__ == '__main__':
+    main()
+    pygame.quit()
@@ -0,0 +1,319 @@
+import math
+
+# ------------------------------------------------------------
+# GLOBAL CONSTANTS -------------------------------------------
+# ------------------------------------------------------------
+# The physics of the pool table. This module doesn't use Pygame, so it can run without a display.
+
+# Ball parameters.
+BALL_RADIUS = 11
+
+# Ball colors.
+WHITE_COLOR = (255, 255, 255)
+BLACK_COLOR = (0, 0, 0)
+PURPLE_COLOR = (69, 52, 130)
+GREEN_COLOR = (45, 133, 70)
+BLUE_COLOR = (48, 89, 179)
+ORANGE_COLOR = (252, 76, 18)
+YELLOW_COLOR = (240, 187, 12)
+RED_COLOR = (209, 23, 29)
+BROWN_COLOR = (115, 32, 32)
+PURPLE_STRIPED_COLOR = (69, 52, 130, 255)
+GREEN_STRIPED_COLOR = (45, 133, 70, 255)
+BLUE_STRIPED_COLOR = (48, 89, 179, 255)
+ORANGE_STRIPED_COLOR = (252, 76, 18, 255)
+YELLOW_STRIPED_COLOR = (240, 187, 12, 255)
+RED_STRIPED_COLOR = (209, 23, 29, 255)
+BROWN_STRIPED_COLOR = (115, 32, 32, 255)
+
+# All the balls in the order they are created (the cue ball is always first).
+BALL_COLORS = (WHITE_COLOR, BLACK_COLOR, PURPLE_COLOR, GREEN_COLOR, BLUE_COLOR, ORANGE_COLOR, YELLOW_COLOR, RED_COLOR, BROWN_COLOR, PURPLE_STRIPED_COLOR, GREEN_STRIPED_COLOR, BLUE_STRIPED_COLOR, ORANGE_STRIPED_COLOR, YELLOW_STRIPED_COLOR, RED_STRIPED_COLOR, BROWN_STRIPED_COLOR)
+
+# Pool table parameters.
+POOL_TABLE_SIZE = (1050, 550)
+POOL_TABLE_POCKET_RADIUS = 23
+
+# Pocket parameters. A ball falls into a pocket when its center is inside the pocket's circular capture zone.
+# The table is split into 2 rows and 3 columns with one pocket each, so a ball is only tested against the pocket of its region.
+POCKET_CENTERS = ((2 * POOL_TABLE_POCKET_RADIUS, 2 * POOL_TABLE_POCKET_RADIUS), (POOL_TABLE_SIZE[0] / 2, 2 * POOL_TABLE_POCKET_RADIUS), (POOL_TABLE_SIZE[0] - 2 * POOL_TABLE_POCKET_RADIUS, 2 * POOL_TABLE_POCKET_RADIUS),
+                  (2 * POOL_TABLE_POCKET_RADIUS, POOL_TABLE_SIZE[1] - 2 * POOL_TABLE_POCKET_RADIUS), (POOL_TABLE_SIZE[0] / 2, POOL_TABLE_SIZE[1] - 2 * POOL_TABLE_POCKET_RADIUS), (POOL_TABLE_SIZE[0] - 2 * POOL_TABLE_POCKET_RADIUS, POOL_TABLE_SIZE[1] - 2 * POOL_TABLE_POCKET_RADIUS))
+POCKET_CAPTURE_RADIUS = POOL_TABLE_POCKET_RADIUS + BALL_RADIUS / 2 # About as far from the cushions as the old rectangular pocket areas reached.
+POCKET_CAPTURE_RADIUS_SQUARED = POCKET_CAPTURE_RADIUS ** 2
+POCKET_REGION_LEFT = POOL_TABLE_SIZE[0] / 4 # Balls left of this line are in the left column.
+POCKET_REGION_RIGHT = POOL_TABLE_SIZE[0] * 3 / 4 # Balls right of this line are in the right column.
+POCKET_REGION_TOP = POOL_TABLE_SIZE[1] / 2 # Balls above this line are in the top row.
+
+# Physics parameters. Speeds are in pixels per step.
+PHYSICS_RATE = 60 # Physics steps per second.
+MAX_SUBSTEP_DISTANCE = BALL_RADIUS # A step is split into substeps so that no ball moves further than this at once (otherwise it could pass through another ball).
+DRAG = 0.995
+ELASTICITY = 0.775
+SPEED_THRESHOLD = 0.01
+WAKE_DISTANCE = 6 * BALL_RADIUS # A sleeping ball this close to an awake ball is handled in a substep: touching distance plus how far both balls can get in a substep (a move and a push apart by a collision each).
+
+# ------------------------------------------------------------
+# CLASS BALL -------------------------------------------------
+# ------------------------------------------------------------
+
+class Ball(object):
+    # Initialize a class instance.
+    def __init__(self, color):
+        self.color = color # Ball's color.
+        self.pos = [0, 0] # Ball's position.
+        self.angle = 0 # Ball's movement angle.
+        self.speed = 0 # Ball's movement speed.
+
+    # Place the ball at its starting position (depending on its color).
+    def place(self):
+        if self.color == WHITE_COLOR:
+            self.pos = [POOL_TABLE_SIZE[0] / 4, POOL_TABLE_SIZE[1] / 2]
+        elif self.color == BLACK_COLOR:
+            self.pos = [POOL_TABLE_SIZE[0] * 3 / 4 + 4 * BALL_RADIUS, POOL_TABLE_SIZE[1] / 2]
+        elif self.color == PURPLE_COLOR:
+            self.pos = [POOL_TABLE_SIZE[0] * 3 / 4, POOL_TABLE_SIZE[1] / 2]
+        elif self.color == GREEN_COLOR:
+            self.pos = [POOL_TABLE_SIZE[0] * 3 / 4 + 6 * BALL_RADIUS, POOL_TABLE_SIZE[1] / 2 + 3 * BALL_RADIUS]
+        elif self.color == BLUE_COLOR:
+            self.pos = [POOL_TABLE_SIZE[0] * 3 / 4 + 8 * BALL_RADIUS, POOL_TABLE_SIZE[1] / 2 + 4 * BALL_RADIUS]
+        elif self.color == ORANGE_COLOR:
+            self.pos = [POOL_TABLE_SIZE[0] * 3 / 4 + 8 * BALL_RADIUS, POOL_TABLE_SIZE[1] / 2 - 2 * BALL_RADIUS]
+        elif self.color == YELLOW_COLOR:
+            self.pos = [POOL_TABLE_SIZE[0] * 3 / 4 + 4 * BALL_RADIUS, POOL_TABLE_SIZE[1] / 2 - 2 * BALL_RADIUS]
+        elif self.color == RED_COLOR:
+            self.pos = [POOL_TABLE_SIZE[0] * 3 / 4 + 4 * BALL_RADIUS, POOL_TABLE_SIZE[1] / 2 + 2 * BALL_RADIUS]
+        elif self.color == BROWN_COLOR:
+            self.pos = [POOL_TABLE_SIZE[0] * 3 / 4 + 8 * BALL_RADIUS, POOL_TABLE_SIZE[1] / 2]
+        elif self.color == PURPLE_STRIPED_COLOR:
+            self.pos = [POOL_TABLE_SIZE[0] * 3 / 4 + 8 * BALL_RADIUS, POOL_TABLE_SIZE[1] / 2 - 4 * BALL_RADIUS]
+        elif self.color == GREEN_STRIPED_COLOR:
+            self.pos = [POOL_TABLE_SIZE[0] * 3 / 4 + 2 * BALL_RADIUS, POOL_TABLE_SIZE[1] / 2 + BALL_RADIUS]
+        elif self.color == BLUE_STRIPED_COLOR:
+            self.pos = [POOL_TABLE_SIZE[0] * 3 / 4 + 2 * BALL_RADIUS, POOL_TABLE_SIZE[1] / 2 - BALL_RADIUS]
+        elif self.color == ORANGE_STRIPED_COLOR:
+            self.pos = [POOL_TABLE_SIZE[0] * 3 / 4 + 6 * BALL_RADIUS, POOL_TABLE_SIZE[1] / 2 - BALL_RADIUS]
+        elif self.color == YELLOW_STRIPED_COLOR:
+            self.pos = [POOL_TABLE_SIZE[0] * 3 / 4 + 8 * BALL_RADIUS, POOL_TABLE_SIZE[1] / 2 + 2 * BALL_RADIUS]
+        elif self.color == RED_STRIPED_COLOR:
+            self.pos = [POOL_TABLE_SIZE[0] * 3 / 4 + 6 * BALL_RADIUS, POOL_TABLE_SIZE[1] / 2 + BALL_RADIUS]
+        elif self.color == BROWN_STRIPED_COLOR:
+            self.pos = [POOL_TABLE_SIZE[0] * 3 / 4 + 6 * BALL_RADIUS, POOL_TABLE_SIZE[1] / 2 - 3 * BALL_RADIUS]
+
+    # Move the ball. A fraction smaller than 1 moves it by a part of a step (see substep()).
+    def move(self, fraction=1):
+        if self.speed < SPEED_THRESHOLD: # If the speed is low enough, set it to 0.
+            self.speed = 0
+        
+        self.pos[0] += math.cos(self.angle) * self.speed * fraction
+        self.pos[1] += math.sin(self.angle) * self.speed * fraction
+        self.speed *= DRAG ** fraction # Apply air resistance.
+
+    # Check if the ball has collided with a border. Returns True if it was reflected (the moved cue ball is only stopped at the border).
+    def bounce(self, is_cue_ball_moveable=False):
+        is_reflected = False
+        if self.pos[0] >= POOL_TABLE_SIZE[0] - 2 * POOL_TABLE_POCKET_RADIUS - BALL_RADIUS:
+            if self.color == WHITE_COLOR and is_cue_ball_moveable: # Special case for the cue ball when it's being moved by the mouse.
+                self.pos[0] = POOL_TABLE_SIZE[0] - 2 * POOL_TABLE_POCKET_RADIUS - BALL_RADIUS
+            else:
+                self.pos[0] = 2 * (POOL_TABLE_SIZE[0] - 2 * POOL_TABLE_POCKET_RADIUS - BALL_RADIUS) - self.pos[0]
+                self.angle = math.pi - self.angle
+                self.speed *= ELASTICITY # Apply friction.
+                is_reflected = True
+        elif self.pos[0] <= 2 * POOL_TABLE_POCKET_RADIUS + BALL_RADIUS:
+            if self.color == WHITE_COLOR and is_cue_ball_moveable:
+                self.pos[0] = 2 * POOL_TABLE_POCKET_RADIUS + BALL_RADIUS
+            else:
+                self.pos[0] = 2 * (2 * POOL_TABLE_POCKET_RADIUS + BALL_RADIUS) - self.pos[0]
+                self.angle = math.pi - self.angle
+                self.speed *= ELASTICITY
+                is_reflected = True
+            
+        if self.pos[1] >= POOL_TABLE_SIZE[1] - 2 * POOL_TABLE_POCKET_RADIUS - BALL_RADIUS:
+            if self.color == WHITE_COLOR and is_cue_ball_moveable:
+                self.pos[1] = POOL_TABLE_SIZE[1] - 2 * POOL_TABLE_POCKET_RADIUS - BALL_RADIUS
+            else:
+                self.pos[1] = 2 * (POOL_TABLE_SIZE[1] - 2 * POOL_TABLE_POCKET_RADIUS - BALL_RADIUS) - self.pos[1]
+                self.angle = -self.angle
+                self.speed *= ELASTICITY
+                is_reflected = True
+        elif self.pos[1] <= 2 * POOL_TABLE_POCKET_RADIUS + BALL_RADIUS:
+            if self.color == WHITE_COLOR and is_cue_ball_moveable:
+                self.pos[1] = 2 * POOL_TABLE_POCKET_RADIUS + BALL_RADIUS
+            else:
+                self.pos[1] = 2 * (2 * POOL_TABLE_POCKET_RADIUS + BALL_RADIUS) - self.pos[1]
+                self.angle = -self.angle
+                self.speed *= ELASTICITY
+                is_reflected = True
+        return is_reflected
+
+    # Select the cue ball if the mouse is over it.
+    def select_cue_ball(self, mouse_pos):
+        if math.hypot(self.pos[0] - mouse_pos[0], self.pos[1] - mouse_pos[1]) <= BALL_RADIUS:
+            return True
+        return False
+
+    # Move the cue ball towards the mouse.
+    def move_cue_ball(self, mouse_pos):
+        (dx, dy) = (mouse_pos[0] - self.pos[0], mouse_pos[1] - self.pos[1])
+        self.angle = math.atan2(dy, dx)
+        self.speed = math.hypot(dx, dy) * 0.1
+
+    # Check if the ball is inside the capture zone of the pocket in its region of the table.
+    def is_pocketed(self):
+        (x, y) = self.pos
+        column = 0 if x < POCKET_REGION_LEFT else (2 if x > POCKET_REGION_RIGHT else 1)
+        (pocket_x, pocket_y) = POCKET_CENTERS[column if y < POCKET_REGION_TOP else column + 3]
+        return (x - pocket_x) ** 2 + (y - pocket_y) ** 2 < POCKET_CAPTURE_RADIUS_SQUARED
+
+# ------------------------------------------------------------
+# COLLISION DETECTION FUNCTION--------------------------------
+# ------------------------------------------------------------
+
+def collide(b1, b2, hits):
+    # Calculate the distance between the centers of two balls. If it's less or equal than 2 * BALL_RADIUS, the balls have collided.
+    (dx, dy) = (b1.pos[0] - b2.pos[0], b1.pos[1] - b2.pos[1])
+    dist = math.hypot(dx, dy)
+    
+    if dist <= 2 * BALL_RADIUS:
+        if b1.color == WHITE_COLOR and len(hits) == 0: # Record which ball was hit first by the cue ball.
+            hits.append(b2)
+        elif b2.color == WHITE_COLOR and len(hits) == 0:
+            hits.append(b1)
+        
+        tangent = math.atan2(dy, dx) + math.pi / 2 # The angle tangent to the balls.
+        angle = tangent - math.pi / 2 # The angle between two balls which is perpendicular to the tangent angle.
+
+        # Apply these rules if one ball if moving and another ball is stationary. Source: http://en.wikipedia.org/wiki/Elastic_collision#Two-_and_three-dimensional
+        if b1.speed == 0:
+            angle2 = math.atan2(math.sin(angle), 1 + math.cos(angle))
+            angle1 = (math.pi - angle) / 2
+            speed2 = (b2.speed * math.sqrt((1 + math.cos(angle)) / 2)) * ELASTICITY # Apply the friction.
+            speed1 = (b2.speed * math.sin(angle / 2)) * ELASTICITY
+        elif b2.speed == 0:
+            angle1 = math.atan2(math.sin(angle), 1 + math.cos(angle))
+            angle2 = (math.pi - angle) / 2
+            speed1 = (b1.speed * math.sqrt((1 + math.cos(angle)) / 2)) * ELASTICITY
+            speed2 = (b1.speed * math.sin(angle / 2)) * ELASTICITY
+
+        # Apply these rules if both balls are moving. Source: http://en.wikipedia.org/wiki/Elastic_collision#Two-_and_three-dimensional
+        else:
+            vx1_after = b2.speed * math.cos(b2.angle - angle) * math.cos(angle) + b1.speed * math.sin(b1.angle - angle) * math.cos(angle + math.pi / 2)
+            vy1_after = b2.speed * math.cos(b2.angle - angle) * math.sin(angle) + b1.speed * math.sin(b1.angle - angle) * math.sin(angle + math.pi / 2)
+            vx2_after = b1.speed * math.cos(b1.angle - angle) * math.cos(angle) + b2.speed * math.sin(b2.angle - angle) * math.cos(angle + math.pi / 2)
+            vy2_after = b1.speed * math.cos(b1.angle - angle) * math.sin(angle) + b2.speed * math.sin(b2.angle - angle) * math.sin(angle + math.pi / 2)
+            angle1 = math.atan2(vy1_after, vx1_after)
+            angle2 = math.atan2(vy2_after, vx2_after)
+            speed1 = (vx1_after / math.cos(angle1)) * ELASTICITY
+            speed2 = (vx2_after / math.cos(angle2)) * ELASTICITY
+
+        # Set the new angle/speed for both balls.
+        (b1.angle, b1.speed) = (angle1, speed1)
+        (b2.angle, b2.speed) = (angle2, speed2)
+
+        # Since time is discrete (i.e. the screen cannot be updated every microsecond), by the time the screen is updated the balls have already overlapped.
+        # We need to set them apart so that they won't "stick" together.
+        overlap = 2 * BALL_RADIUS - dist + 1
+        b1.pos[0] += math.cos(angle) * 0.5 * overlap
+        b1.pos[1] += math.sin(angle) * 0.5 * overlap
+        b2.pos[0] -= math.cos(angle) * 0.5 * overlap
+        b2.pos[1] -= math.sin(angle) * 0.5 * overlap
+
+# ------------------------------------------------------------
+# CLASS ACTIVE SET -------------------------------------------
+# ------------------------------------------------------------
+
+# Keeps track of the sleeping balls. A ball falls asleep after a substep in which it stood still (speed 0 and the same position),
+# and from then on it isn't moved, pocketed, bounced or collided. A substep only handles the awake balls and the sleeping balls they could reach
+# (within WAKE_DISTANCE of an awake ball or of another handled ball), so the balls move exactly as if all of them were handled,
+# but a late game with one rolling ball costs one ball instead of all of them, and a table where every ball sleeps costs nothing.
+# A ball the set hasn't seen (like a new cue ball) is awake. A ball whose speed is set outside the physics (a shot) has to be woken with wake().
+class ActiveSet(object):
+    # Initialize a class instance. Every ball starts awake.
+    def __init__(self):
+        self.sleeping = set() # The balls that are asleep (they are always on the table).
+
+    # Wake a ball up.
+    def wake(self, ball):
+        self.sleeping.discard(ball)
+
+    # Check if any ball of the table is awake. Only the sizes are compared, so it takes constant time.
+    def is_moving(self, balls):
+        return len(self.sleeping) < len(balls)
+
+    # Wake the sleeping balls within reach of the awake ones. Returns the balls to handle in this substep, in the order of balls.
+    def wake_nearby(self, balls, removed):
+        sleeping = [ball for ball in balls if ball in self.sleeping]
+        reach = [ball for ball in balls if ball not in self.sleeping and ball not in removed]
+        while reach and sleeping: # The balls woken in a round wake their own neighbours in the next one.
+            woken = [ball for ball in sleeping if any((ball.pos[0] - other.pos[0]) ** 2 + (ball.pos[1] - other.pos[1]) ** 2 <= WAKE_DISTANCE ** 2 for other in reach)]
+            self.sleeping.difference_update(woken)
+            sleeping = [ball for ball in sleeping if ball in self.sleeping]
+            reach = woken
+        return [ball for ball in balls if ball not in self.sleeping and ball not in removed]
+
+    # Put the handled balls which stood still during the substep to sleep. starts are their positions before the substep.
+    def fall_asleep(self, handled, starts, removed):
+        for (ball, (x, y)) in zip(handled, starts):
+            if ball.speed == 0 and ball.pos[0] == x and ball.pos[1] == y and ball not in removed:
+                self.sleeping.add(ball)
+
+# ------------------------------------------------------------
+# STEP FUNCTION ----------------------------------------------
+# ------------------------------------------------------------
+
+# Create the balls and place them at their starting positions.
+def rack(ball_class=Ball):
+    balls = [ball_class(color) for color in BALL_COLORS]
+    for ball in balls:
+        ball.place()
+    return balls
+
+# Check if any ball is moving. With the table's ActiveSet it's a constant-time check (a ball counts as moving until it falls asleep).
+def are_balls_moving(balls, active=None):
+    if active is not None:
+        return active.is_moving(balls)
+    return not all(ball.speed == 0 for ball in balls)
+
+# Find how many substeps are needed so that no ball moves further than MAX_SUBSTEP_DISTANCE in one substep.
+def count_substeps(balls):
+    fastest = max([abs(ball.speed) for ball in balls] + [0])
+    return max(1, int(math.ceil(fastest / MAX_SUBSTEP_DISTANCE)))
+
+# Move all the balls by one physics step, split into substeps if some ball is fast.
+# The pocketed balls are appended to balls_pocketed, the ball hit first by the cue ball is appended to hits.
+# The pocketed balls are only removed from balls at the end of the step, so the loops over balls don't skip any ball.
+# If active (an ActiveSet) is given, the sleeping balls out of reach of the moving ones are skipped, and nothing is done when every ball sleeps.
+def step(balls, grid, balls_pocketed, hits, is_cue_ball_moveable=False, active=None):
+    if active is not None and not active.is_moving(balls):
+        return
+    removed = set() # The balls pocketed during this step.
+    substeps = count_substeps(balls)
+    for _ in range(substeps):
+        substep(balls, grid, balls_pocketed, hits, is_cue_ball_moveable, 1.0 / substeps, removed, active)
+    if removed:
+        balls[:] = [ball for ball in balls if ball not in removed]
+
+# Move all the balls by a fraction of a step: move, pocket, bounce (check for collision with borders) and check for collision with the nearby balls.
+# A pocketed ball is added to removed and skipped from then on.
+def substep(balls, grid, balls_pocketed, hits, is_cue_ball_moveable=False, fraction=1, removed=None, active=None):
+    if removed is None:
+        removed = set()
+    handled = balls
+    if active is not None:
+        handled = active.wake_nearby(balls, removed) # The other balls are out of reach, so they aren't even put in the grid.
+        starts = [(ball.pos[0], ball.pos[1]) for ball in handled]
+    grid.build([(ball, ball.pos) for ball in handled if ball not in removed])
+    for ball1 in handled:
+        if ball1 in removed:
+            continue
+        ball1.move(fraction)
+        if ball1.is_pocketed():
+            balls_pocketed.append(ball1)
+            removed.add(ball1)
+            grid.remove(ball1)
+            continue
+        ball1.bounce(is_cue_ball_moveable)
+        for ball2 in grid.nearby(ball1.pos, 2 * BALL_RADIUS, ball1):
+            collide(ball1, ball2, hits)
+            grid.update(ball2, ball2.pos) # The collision sets the balls apart, so ball2 could move to another cell.
+    if active is not None:
+        active.fall_asleep(handled, starts, removed)
@@ -0,0 +1,106 @@
+try:
+    import numpy as np
+except ImportError: # NumPy is optional, the particles are drawn with circles or sprites without it.
+    np = None
+
+import pygame
+
+# ------------------------------------------------------------
+# CLASS PIXEL RENDERER ---------------------------------------
+# ------------------------------------------------------------
+# A renderer for many particles of one radius: every particle is stamped into the screen's pixels at once with NumPy,
+# instead of one pygame.draw.circle call per particle. The time depends on the number of pixels covered, not on the
+# number of Python calls. With a radius of 0 the particles are single points (point splatting).
+
+class PixelRenderer(object):
+    # Initialize a class instance and find the pixels of a disc of the given radius: pygame.draw.circle draws one on a small
+    # surface and the pixels it covers are used, so the particles look exactly the same with every renderer.
+    def __init__(self, radius):
+        if np is None:
+            raise ImportError('PixelRenderer requires NumPy')
+        self.radius = radius # Radius of the particles.
+        if radius == 0:
+            (self.dx, self.dy) = (np.zeros(1, np.intp), np.zeros(1, np.intp))
+        else:
+            center = radius + 1
+            surface = pygame.Surface((2 * center + 1, 2 * center + 1), 0, 32)
+            pygame.draw.circle(surface, (255, 255, 255), (center, center), radius)
+            (dx, dy) = np.nonzero(pygame.surfarray.array2d(surface))
+            (self.dx, self.dy) = (dx.astype(np.intp) - center, dy.astype(np.intp) - center) # The offsets of the disc's pixels.
+        self.margin = int(max(self.dx.max() - self.dx.min(), self.dy.max() - self.dy.min())) + 1 # Margin of the buffer around the surface (a disc fits into it).
+        self.owner = np.empty((0, 0), np.int32) # The number of the particle on top of every pixel, by row and column (with the margin).
+        self.rows = [] # The disc's rows as (offset of the row's first pixel in the buffer, number of pixels).
+        self.colors = {} # The colors mapped to the screen's pixel format, by RGB tuple.
+        self.format = None # The surface the colors were mapped for (a different one maps them again).
+
+    # Draw particles centered at (x[i], y[i]) (sequences of numbers) with colors[i]. Later particles are drawn on top.
+    def draw(self, surface, x, y, colors):
+        count = len(colors)
+        if count == 0:
+            return
+        if self.format is not surface:
+            (self.colors, self.format) = ({}, surface)
+        mapped = self.colors
+        for color in set(colors).difference(mapped):
+            mapped[color] = surface.map_rgb(color)
+        values = np.array([mapped[color] for color in colors], np.uint32)
+        x = np.asarray(x).astype(np.intp)
+        y = np.asarray(y).astype(np.intp)
+
+        # Every pixel first gets the number of the last particle covering it (-1 if there's none), in a buffer with a margin
+        # around the surface so that the particles across the edge don't have to be clipped. The ones off the surface are skipped.
+        (width, height) = surface.get_size()
+        margin = self.margin
+        dtype = np.int16 if count <= np.iinfo(np.int16).max else np.int32 # Half the memory to go through for up to 32767 particles.
+        if self.owner.shape != (height + 2 * margin, width + 2 * margin) or self.owner.dtype != dtype:
+            self.owner = np.empty((height + 2 * margin, width + 2 * margin), dtype)
+            pitch = self.owner.shape[1]
+            self.rows = [(row * pitch + self.dx[self.dy == row].min(), (self.dy == row).sum()) for row in np.unique(self.dy)]
+        owner = self.owner
+        owner.fill(-1)
+        (left, top, right, bottom) = (self.dx.min(), self.dy.min(), self.dx.max(), self.dy.max())
+        drawn = np.flatnonzero((x + right >= 0) & (x + left < width) & (y + bottom >= 0) & (y + top < height))
+
+        # The particles are written a row of the disc at a time: the row is at the same place in every particle, so its pixels
+        # are a run of the same length after every particle's first pixel. A sliding window view of the buffer has every run
+        # at once, indexed by its first pixel, so there's an index per run instead of per pixel. The rows are written one after
+        # another, so a pixel keeps the largest number instead of the last one written.
+        buffer = owner.reshape(-1)
+        start = (y[drawn] + margin) * owner.shape[1] + x[drawn] + margin
+        number = drawn.astype(dtype)[:, None]
+        for (offset, length) in self.rows:
+            runs = np.lib.stride_tricks.as_strided(buffer, (len(buffer) - length + 1, length), (buffer.itemsize, buffer.itemsize))
+            index = start + offset
+            row = runs[index]
+            runs[index] = np.maximum(row, number, out=row)
+
+        # Then the colors are written at once.
+        numbers = owner[margin:margin + height, margin:margin + width].T # Indexed by column and row, like the pixels.
+        pixels = pygame.surfarray.pixels2d(surface) # A view of the screen's pixels: writing to it draws (the surface is locked while it exists).
+        np.copyto(pixels, values[numbers], where=numbers >= 0)
+        del pixels
+
+# ------------------------------------------------------------
+# REFERENCE CHECK --------------------------------------------
+# ------------------------------------------------------------
+
+# Draw the same particles with pygame.draw.circle and with a PixelRenderer on two surfaces of the given size.
+# Returns the number of pixels that are different.
+def compare_with_circles(radius, count=200, size=(160, 120), seed=0):
+    rng = np.random.RandomState(seed)
+    x = rng.randint(-radius - 2, size[0] + radius + 2, count)
+    y = rng.randint(-radius - 2, size[1] + radius + 2, count)
+    colors = [tuple(int(c) for c in rng.randint(0, 256, 3)) for _ in range(count)]
+    (circles, stamped) = (pygame.Surface(size, 0, 32), pygame.Surface(size, 0, 32))
+    for i in range(count):
+        if radius == 0:
+            if 0 <= x[i] < size[0] and 0 <= y[i] < size[1]:
+                circles.set_at((int(x[i]), int(y[i])), colors[i])
+        else:
+            pygame.draw.circle(circles, colors[i], (int(x[i]), int(y[i])), radius)
+    PixelRenderer(radius).draw(stamped, x, y, colors)
+    return int(np.count_nonzero(pygame.surfarray.array2d(circles) != pygame.surfarray.array2d(stamped)))
+
+if __name__ == '__main__':
+    for radius in (0, 1, 2, 3, 5, 11, 20):
+        print('radius %2d: %d pixels different from pygame.draw.circle' % (radius, compare_with_circles(radius)))
@@ -1,44 +1,39 @@
-import pygame
-import math
+import io
+import os
 import random
+import time
 
-# Initialize the Pygame engine.
-pygame.init()
+import loader as loader_module
+import physics
+import profiler as profiler_module
+import recording
+import rules as game_rules
+from physics import BALL_RADIUS, BALL_COLORS, POOL_TABLE_SIZE, POOL_TABLE_POCKET_RADIUS, PHYSICS_RATE
+from physics import WHITE_COLOR, BLACK_COLOR
+from spatial import SpatialHash
 
 # ------------------------------------------------------------
 # GLOBAL CONSTANTS -------------------------------------------
 # ------------------------------------------------------------
 # Colors, sizes, other parameters: a variable that doesn't change over the course of the game is considered a constant.
 # All constants are spelled LIKE THIS.
+# The ball, pool table and physics constants are in physics.py.
 
 # Screen parameters.
 SCREEN_CAPTION = '8-Ball Pool'
 SCREEN_SIZE = (1050, 600)
-
-# Ball parameters.
-BALL_RADIUS = 11
-
-# Ball colors.
-WHITE_COLOR = (255, 255, 255)
-BLACK_COLOR = (0, 0, 0)
-PURPLE_COLOR = (69, 52, 130)
-GREEN_COLOR = (45, 133, 70)
-BLUE_COLOR = (48, 89, 179)
-ORANGE_COLOR = (252, 76, 18)
-YELLOW_COLOR = (240, 187, 12)
-RED_COLOR = (209, 23, 29)
-BROWN_COLOR = (115, 32, 32)
-PURPLE_STRIPED_COLOR = (69, 52, 130, 255)
-GREEN_STRIPED_COLOR = (45, 133, 70, 255)
-BLUE_STRIPED_COLOR = (48, 89, 179, 255)
-ORANGE_STRIPED_COLOR = (252, 76, 18, 255)
-YELLOW_STRIPED_COLOR = (240, 187, 12, 255)
-RED_STRIPED_COLOR = (209, 23, 29, 255)
-BROWN_STRIPED_COLOR = (115, 32, 32, 255)
-
-# Pool table parameters.
-POOL_TABLE_SIZE = (1050, 550)
-POOL_TABLE_POCKET_RADIUS = 23
+DIRTY_RECT_RENDERING = True # If it's True, only the parts of the screen that have changed are updated every frame.
+FPS = 60 # Maximum number of frames per second.
+MAX_STEPS_PER_FRAME = 5 # If a frame takes longer than this many physics steps, the game slows down instead of falling further behind.
+IDLE_MODE = True # If it's True, the game sleeps until something happens while the table is at rest, instead of drawing FPS frames per second.
+IDLE_TIMEOUT = 250 # Longest sleep in idle mode (in milliseconds), so that a song which is still being read starts soon after it's there.
+BALL_SPRITES = True # If it's True, the balls are drawn from cached anti-aliased images with one blit call (see sprites.py), otherwise with a circle each.
+BALL_ANTIALIASING = True # If it's False, the ball images have hard edges, which are blitted about twice as fast.
+STRIPE_WIDTH = 5 # Width of the ring of a striped ball.
+
+# Computer player parameters (see opponent.py).
+COMPUTER_PLAYER = None # Set it to 1 or 2 to play against the computer.
+COMPUTER_DIFFICULTY = 'hard' # 'easy', 'medium' or 'hard'.
 
 # Pool table colors.
 POOL_TABLE_MAIN_COLOR = (99, 166, 112)
@@ -53,10 +48,68 @@ RULES_BOX_SIZE = (203, 38)
 COLOR_BOX_SIZE = (83, 38)
 BAR_MARGIN = 10
 
-# Physics parameters.
-DRAG = 0.995
-ELASTICITY = 0.775
-SPEED_THRESHOLD = 0.01
+# Message parameters. The messages are shown while the game keeps running.
+RULES_BOX_TIME = 3000 # How long a foul is shown in the rules box (in milliseconds).
+GAME_OVER_TIME = 5000 # How long the winner is shown before the window closes (in milliseconds).
+
+# Profiler parameters (see profiler.py).
+PROFILER = False # If it's True, every frame is timed and F3 shows the timings on the screen.
+PROFILER_FILE = 'profile.csv' # The frame records are written to this file when the game ends (.csv or .json, None to skip).
+PROFILER_OVERLAY_RECT = (60, 60, 230, 190) # Where the timings are shown.
+PROFILER_OVERLAY_COLOR = (0, 0, 0, 180)
+PROFILER_HISTOGRAM_FRAMES = 120 # The histogram shows the last this many frames.
+
+# Recording parameters (see recording.py).
+RECORDING_FILE = None # If it's set, the game is recorded (appended) to this file.
+REPLAY_FILE = None # If it's set, the game in this file is replayed instead of being played with the mouse.
+REPLAY_INDEX = 0 # Which game of the replay file is replayed.
+TRAJECTORY_DIR = None # If it's set, the balls' positions, angles and speeds are saved to this directory every frame (needs NumPy).
+
+# Startup.
+FIRST_FRAME_REPORT = False # If it's True, the time from the start of the game to the first frame on the screen is printed.
+CPU_REPORT = False # If it's True, the CPU usage while the table is at rest (idle) and while it isn't (active) is printed when the game ends.
+
+# Bottom bar images (loaded from the images folder).
+HUD_IMAGES = ('music_off', 'music_on', 'player1_turn', 'player2_turn', 'player1_won', 'player2_won', 'blank', 'blank2', 'shots_1', 'shots_2', 'solid', 'striped', 'no_balls_hit', 'illegal_ball_hit_first', 'illegal_ball_pocketed')
+
+# ------------------------------------------------------------
+# CLASS ASSETS -----------------------------------------------
+# ------------------------------------------------------------
+
+# The images are decoded by the background loader. Until an image is there, an empty placeholder is returned instead.
+class Assets(object):
+    # Initialize a class instance and start loading the given images in the background.
+    def __init__(self, names, loader):
+        self.loader = loader # The background loader which decodes the images.
+        self.images = {} # Converted surfaces by image name.
+        self.placeholder = pygame.Surface((0, 0)) # Drawn instead of an image which is still loading.
+        self.disk_loads = 0 # How many times an image has been loaded from the disk.
+        self.loads_avoided = 0 # How many times a cached surface was returned instead of loading the image again.
+        for name in names:
+            self.request(name)
+
+    # Ask the loader to decode an image (converting it needs the display, so that's done by load()).
+    def request(self, name):
+        path = 'images/' + name + '.png'
+        self.loader.request(path, pygame.image.load, path)
+
+    # Convert a decoded image for fast blitting. Returns False if it hasn't been decoded yet.
+    def load(self, name):
+        self.request(name) # Nothing happens if it has already been requested.
+        image = self.loader.take('images/' + name + '.png')
+        if image is None:
+            return False
+        self.images[name] = image.convert_alpha()
+        self.disk_loads += 1
+        return True
+
+    # Get an image by its name. It's only loaded from the disk the first time, the placeholder is returned while it's loading.
+    def get(self, name):
+        if name in self.images:
+            self.loads_avoided += 1
+        elif not self.load(name):
+            return self.placeholder
+        return self.images[name]
 
 # ------------------------------------------------------------
 # CLASS SCREEN -----------------------------------------------
@@ -68,542 +121,329 @@ class Screen(object):
         self.screen = pygame.display.set_mode(SCREEN_SIZE) # Create a screen and set its size.
         pygame.display.set_caption(SCREEN_CAPTION) # Set the screen caption.
         self.mouse_pos = (0, 0) # Mouse position.
-        self.music_box = pygame.image.load('images/music_off.png').convert_alpha() # Shows whether the music is on or off.
-        self.player_box = pygame.image.load('images/player1_turn.png').convert_alpha() # Shows whose turn it is or whether the player has won.
-        self.rules_box = pygame.image.load('images/blank.png').convert_alpha() # Shows whether an illegal ball has been pocketed.
-        self.shots_box = pygame.image.load('images/shots_1.png').convert_alpha() # Shows how many shots the player has left.
-        self.color_box = pygame.image.load('images/blank2.png').convert_alpha() # Shows players' colors.
+        self.assets = Assets(HUD_IMAGES, loader) # Start loading all the bottom bar images.
+        # The boxes hold image names: the images are looked up when the bar is drawn, so a box shows up as soon as its image is loaded.
+        self.music_box = 'music_off' # Shows whether the music is on or off.
+        self.player_box = 'player1_turn' # Shows whose turn it is or whether the player has won.
+        self.rules_box = 'blank' # Shows whether an illegal ball has been pocketed.
+        self.rules_box_time = None # When the foul in the rules box is cleared (pygame.time.get_ticks() time).
+        self.shots_box = 'shots_1' # Shows how many shots the player has left.
+        self.color_box = 'blank2' # Shows players' colors.
+        self.bar = None # The box images that are currently drawn on the bottom bar.
+        self.table = self.render_pool_table() # The pool table without the balls.
+        self.is_dirty_rendering = DIRTY_RECT_RENDERING # If it's True, only the changed parts of the screen are updated.
+        self.is_full_update_needed = True # If it's True, the whole screen is redrawn on the next frame.
+        self.ball_rects = [] # Areas covered by the balls drawn on the screen.
+        self.dirty_rects = [] # Areas of the screen that have changed since the last update.
+        self.is_profiler_shown = False # If it's True, the profiler timings are drawn over the table.
+        self.font = None # Font of the profiler timings (created when they're shown for the first time).
+        self.sprites = None # The ball images (see BALL_SPRITES).
+        if BALL_SPRITES:
+            import sprites # Imports Pygame, so it's only imported when the window is opened.
+            self.sprites = sprites.SpriteCache(BALL_RADIUS, stripe_width, BALL_ANTIALIASING)
+
+    # Draw the pool table once on a separate surface, which is then copied to the screen every frame.
+    def render_pool_table(self):
+        table = pygame.Surface((SCREEN_SIZE[0], SCREEN_SIZE[1] - BAR_SIZE[1])).convert()
 
-    # Fill the screen with a color.
-    def fill(self):
-        self.screen.fill(BLACK_COLOR)
-
-    # Draw a pool table.
-    def draw_pool_table(self):
         # Draw sides.
-        pygame.draw.rect(self.screen, POOL_TABLE_SIDE_COLOR, (0, 0, SCREEN_SIZE[0], SCREEN_SIZE[1] - BAR_SIZE[1]))
+        pygame.draw.rect(table, POOL_TABLE_SIDE_COLOR, (0, 0, SCREEN_SIZE[0], SCREEN_SIZE[1] - BAR_SIZE[1]))
         
         # Draw a playable area.
-        pygame.draw.rect(self.screen, POOL_TABLE_MAIN_COLOR, (2 * POOL_TABLE_POCKET_RADIUS, 2 * POOL_TABLE_POCKET_RADIUS, POOL_TABLE_SIZE[0] - 4 * POOL_TABLE_POCKET_RADIUS, POOL_TABLE_SIZE[1] - 4 * POOL_TABLE_POCKET_RADIUS))
+        pygame.draw.rect(table, POOL_TABLE_MAIN_COLOR, (2 * POOL_TABLE_POCKET_RADIUS, 2 * POOL_TABLE_POCKET_RADIUS, POOL_TABLE_SIZE[0] - 4 * POOL_TABLE_POCKET_RADIUS, POOL_TABLE_SIZE[1] - 4 * POOL_TABLE_POCKET_RADIUS))
 
         # Draw top pockets.
-        pygame.draw.circle(self.screen, BLACK_COLOR, (2 * POOL_TABLE_POCKET_RADIUS, 2 * POOL_TABLE_POCKET_RADIUS), POOL_TABLE_POCKET_RADIUS)
-        pygame.draw.circle(self.screen, BLACK_COLOR, (POOL_TABLE_SIZE[0] / 2, 2 * POOL_TABLE_POCKET_RADIUS), POOL_TABLE_POCKET_RADIUS)
-        pygame.draw.circle(self.screen, BLACK_COLOR, (POOL_TABLE_SIZE[0] - 2 * POOL_TABLE_POCKET_RADIUS, 2 * POOL_TABLE_POCKET_RADIUS), POOL_TABLE_POCKET_RADIUS)
+        pygame.draw.circle(table, BLACK_COLOR, (2 * POOL_TABLE_POCKET_RADIUS, 2 * POOL_TABLE_POCKET_RADIUS), POOL_TABLE_POCKET_RADIUS)
+        pygame.draw.circle(table, BLACK_COLOR, (POOL_TABLE_SIZE[0] / 2, 2 * POOL_TABLE_POCKET_RADIUS), POOL_TABLE_POCKET_RADIUS)
+        pygame.draw.circle(table, BLACK_COLOR, (POOL_TABLE_SIZE[0] - 2 * POOL_TABLE_POCKET_RADIUS, 2 * POOL_TABLE_POCKET_RADIUS), POOL_TABLE_POCKET_RADIUS)
 
         # Draw bottom pockets.
-        pygame.draw.circle(self.screen, BLACK_COLOR, (2 * POOL_TABLE_POCKET_RADIUS, POOL_TABLE_SIZE[1] - 2 * POOL_TABLE_POCKET_RADIUS), POOL_TABLE_POCKET_RADIUS)
-        pygame.draw.circle(self.screen, BLACK_COLOR, (POOL_TABLE_SIZE[0] / 2, POOL_TABLE_SIZE[1] - 2 * POOL_TABLE_POCKET_RADIUS), POOL_TABLE_POCKET_RADIUS)
-        pygame.draw.circle(self.screen, BLACK_COLOR, (POOL_TABLE_SIZE[0] - 2 * POOL_TABLE_POCKET_RADIUS, POOL_TABLE_SIZE[1] - 2 * POOL_TABLE_POCKET_RADIUS), POOL_TABLE_POCKET_RADIUS)
+        pygame.draw.circle(table, BLACK_COLOR, (2 * POOL_TABLE_POCKET_RADIUS, POOL_TABLE_SIZE[1] - 2 * POOL_TABLE_POCKET_RADIUS), POOL_TABLE_POCKET_RADIUS)
+        pygame.draw.circle(table, BLACK_COLOR, (POOL_TABLE_SIZE[0] / 2, POOL_TABLE_SIZE[1] - 2 * POOL_TABLE_POCKET_RADIUS), POOL_TABLE_POCKET_RADIUS)
+        pygame.draw.circle(table, BLACK_COLOR, (POOL_TABLE_SIZE[0] - 2 * POOL_TABLE_POCKET_RADIUS, POOL_TABLE_SIZE[1] - 2 * POOL_TABLE_POCKET_RADIUS), POOL_TABLE_POCKET_RADIUS)
 
         # Draw a head string.
-        pygame.draw.line(self.screen, WHITE_COLOR, (POOL_TABLE_SIZE[0] / 4, 2 * POOL_TABLE_POCKET_RADIUS), (POOL_TABLE_SIZE[0] / 4, POOL_TABLE_SIZE[1] - 2 * POOL_TABLE_POCKET_RADIUS))
+        pygame.draw.line(table, WHITE_COLOR, (POOL_TABLE_SIZE[0] / 4, 2 * POOL_TABLE_POCKET_RADIUS), (POOL_TABLE_SIZE[0] / 4, POOL_TABLE_SIZE[1] - 2 * POOL_TABLE_POCKET_RADIUS))
 
-    # Draw the bottom bar.
+        return table
+
+    # Check if only the changed parts of the screen should be redrawn this frame.
+    def is_partial_update(self):
+        return self.is_dirty_rendering and not self.is_full_update_needed
+
+    # Fill the screen with a color. The bottom bar is left alone, it's only redrawn when it changes.
+    def fill(self):
+        if not self.is_partial_update():
+            self.screen.fill(BLACK_COLOR, (0, 0, SCREEN_SIZE[0], SCREEN_SIZE[1] - BAR_SIZE[1]))
+
+    # Draw a pool table. For a partial update only the areas covered by the balls in the last frame are restored.
+    def draw_pool_table(self):
+        if self.is_partial_update():
+            for rect in self.ball_rects:
+                self.screen.blit(self.table, rect, rect)
+            self.dirty_rects.extend(self.ball_rects)
+        else:
+            self.screen.blit(self.table, (0, 0))
+        self.ball_rects = []
+
+    # Draw a ball and remember the area it covers.
+    def draw_ball(self, ball):
+        rect = ball.draw()
+        self.ball_rects.append(rect)
+        self.dirty_rects.append(rect)
+
+    # Draw all the balls and remember the areas they cover.
+    def draw_balls(self, balls):
+        if self.sprites is None:
+            for ball in balls:
+                self.draw_ball(ball)
+            return
+        sprites = self.sprites
+        rects = self.screen.blits([(sprites[ball.color], (int(ball.pos[0]) - BALL_RADIUS, int(ball.pos[1]) - BALL_RADIUS)) for ball in balls])
+        self.ball_rects.extend(rects)
+        self.dirty_rects.extend(rects)
+
+    # Check if every box of the bottom bar shows its image (none of them is still loading).
+    def is_bar_complete(self):
+        return self.bar is not None and all(image is not self.assets.placeholder for image in self.bar)
+
+    # Draw the bottom bar if any of its boxes has changed.
     def draw_bar(self):
-        self.screen.blit(self.music_box, (BAR_MARGIN, SCREEN_SIZE[1] - BAR_SIZE[1] / 2 - MUSIC_BOX_SIZE[1] / 2))
-        self.screen.blit(self.shots_box, (SCREEN_SIZE[0] - BAR_MARGIN - SHOTS_BOX_SIZE[0], SCREEN_SIZE[1] - BAR_SIZE[1] / 2 - SHOTS_BOX_SIZE[1] / 2))
-        self.screen.blit(self.player_box, (SCREEN_SIZE[0] - 2 * BAR_MARGIN - SHOTS_BOX_SIZE[0] - PLAYER_BOX_SIZE[0], SCREEN_SIZE[1] - BAR_SIZE[1] / 2 + MUSIC_BOX_SIZE[1] / 2 - PLAYER_BOX_SIZE[1] + BAR_MARGIN / 1.6))
-        self.screen.blit(self.rules_box, (SCREEN_SIZE[0] - 3 * BAR_MARGIN - SHOTS_BOX_SIZE[0] - PLAYER_BOX_SIZE[0] - RULES_BOX_SIZE[0], SCREEN_SIZE[1] - BAR_SIZE[1] / 2 + MUSIC_BOX_SIZE[1] / 2 - PLAYER_BOX_SIZE[1] + BAR_MARGIN / 1.6))
-        self.screen.blit(self.color_box, (SCREEN_SIZE[0] - 4 * BAR_MARGIN - SHOTS_BOX_SIZE[0] - PLAYER_BOX_SIZE[0] - RULES_BOX_SIZE[0] - COLOR_BOX_SIZE[0], SCREEN_SIZE[1] - BAR_SIZE[1] / 2 + MUSIC_BOX_SIZE[1] / 2 - PLAYER_BOX_SIZE[1] + BAR_MARGIN / 1.6))
+        bar = tuple(self.assets.get(name) for name in (self.music_box, self.shots_box, self.player_box, self.rules_box, self.color_box))
+        if bar == self.bar:
+            return
+        self.bar = bar
+        (music_box, shots_box, player_box, rules_box, color_box) = bar
+        self.screen.fill(BLACK_COLOR, (0, SCREEN_SIZE[1] - BAR_SIZE[1], BAR_SIZE[0], BAR_SIZE[1]))
+        self.dirty_rects.append(pygame.Rect(0, SCREEN_SIZE[1] - BAR_SIZE[1], BAR_SIZE[0], BAR_SIZE[1]))
+        self.screen.blit(music_box, (BAR_MARGIN, SCREEN_SIZE[1] - BAR_SIZE[1] / 2 - MUSIC_BOX_SIZE[1] / 2))
+        self.screen.blit(shots_box, (SCREEN_SIZE[0] - BAR_MARGIN - SHOTS_BOX_SIZE[0], SCREEN_SIZE[1] - BAR_SIZE[1] / 2 - SHOTS_BOX_SIZE[1] / 2))
+        self.screen.blit(player_box, (SCREEN_SIZE[0] - 2 * BAR_MARGIN - SHOTS_BOX_SIZE[0] - PLAYER_BOX_SIZE[0], SCREEN_SIZE[1] - BAR_SIZE[1] / 2 + MUSIC_BOX_SIZE[1] / 2 - PLAYER_BOX_SIZE[1] + BAR_MARGIN / 1.6))
+        self.screen.blit(rules_box, (SCREEN_SIZE[0] - 3 * BAR_MARGIN - SHOTS_BOX_SIZE[0] - PLAYER_BOX_SIZE[0] - RULES_BOX_SIZE[0], SCREEN_SIZE[1] - BAR_SIZE[1] / 2 + MUSIC_BOX_SIZE[1] / 2 - PLAYER_BOX_SIZE[1] + BAR_MARGIN / 1.6))
+        self.screen.blit(color_box, (SCREEN_SIZE[0] - 4 * BAR_MARGIN - SHOTS_BOX_SIZE[0] - PLAYER_BOX_SIZE[0] - RULES_BOX_SIZE[0] - COLOR_BOX_SIZE[0], SCREEN_SIZE[1] - BAR_SIZE[1] / 2 + MUSIC_BOX_SIZE[1] / 2 - PLAYER_BOX_SIZE[1] + BAR_MARGIN / 1.6))
 
     # Update the bottom bar.
     def update_bar(self):
         if rules.who_won == 1:
-            self.player_box = pygame.image.load('images/player1_won.png').convert_alpha()
+            self.player_box = 'player1_won'
         elif rules.who_won == 2:
-            self.player_box = pygame.image.load('images/player2_won.png').convert_alpha()
+            self.player_box = 'player2_won'
         else:
             if rules.player == 1:
-                self.player_box = pygame.image.load('images/player1_turn.png').convert_alpha()
+                self.player_box = 'player1_turn'
             else:
-                self.player_box = pygame.image.load('images/player2_turn.png').convert_alpha()
+                self.player_box = 'player2_turn'
 
         if rules.shots == 1:
-            self.shots_box = pygame.image.load('images/shots_1.png').convert_alpha()
+            self.shots_box = 'shots_1'
         else:
-            self.shots_box = pygame.image.load('images/shots_2.png').convert_alpha()
+            self.shots_box = 'shots_2'
 
         if rules.player == 1 and rules.colors == ('solid', 'striped'):
-            self.color_box = pygame.image.load('images/solid.png').convert_alpha()
+            self.color_box = 'solid'
         elif rules.player == 1 and rules.colors == ('striped', 'solid'):
-            self.color_box = pygame.image.load('images/striped.png').convert_alpha()
+            self.color_box = 'striped'
         elif rules.player == 2 and rules.colors == ('solid', 'striped'):
-            self.color_box = pygame.image.load('images/striped.png').convert_alpha()
+            self.color_box = 'striped'
         elif rules.player == 2 and rules.colors == ('striped', 'solid'):
-            self.color_box = pygame.image.load('images/solid.png').convert_alpha()
-
-    # Update the rules box.
-    def update_rules_box(self, hits, is_illegal_ball_pocketed):
-        if hits == None:
-            self.rules_box = pygame.image.load('images/no_balls_hit.png').convert_alpha()
-        elif hits == 'illegal':
-            self.rules_box = pygame.image.load('images/illegal_ball_hit_first.png').convert_alpha()  
-        elif is_illegal_ball_pocketed:
-            self.rules_box = pygame.image.load('images/illegal_ball_pocketed.png').convert_alpha()  
-        self.draw_bar()
-        self.update()
-        pygame.time.wait(3000)
-        self.rules_box = pygame.image.load('images/blank.png').convert_alpha()
+            self.color_box = 'solid'
+
+        if self.rules_box_time is not None and pygame.time.get_ticks() >= self.rules_box_time: # The foul has been shown long enough.
+            self.rules_box = 'blank'
+            self.rules_box_time = None
+
+    # Show a foul in the rules box for RULES_BOX_TIME. It's cleared by update_bar().
+    def update_rules_box(self, foul):
+        self.rules_box = foul # The images have the same names as the fouls.
+        self.rules_box_time = pygame.time.get_ticks() + RULES_BOX_TIME
         self.draw_bar()
 
-    # Game over.
+    # Game over: show the winner. The window is closed by the main loop after GAME_OVER_TIME.
     def game_over(self):
-        self.fill()
-        self.draw_pool_table()
         self.update_bar()
         self.draw_bar()
-        for ball in game.balls:
-            ball.draw()
-        self.update()
-        pygame.time.wait(5000) 
+        game.game_over_time = pygame.time.get_ticks() + GAME_OVER_TIME
+
+    # Draw the profiler timings of the last frame and a histogram of the frame times over the table.
+    # The area is restored like a ball's area on the next frame.
+    def draw_profiler(self, profiler):
+        record = profiler.last()
+        if record is None:
+            return
+        if self.font is None:
+            self.font = pygame.font.Font(None, 18)
+        rect = pygame.Rect(PROFILER_OVERLAY_RECT)
+        panel = pygame.Surface(rect.size, pygame.SRCALPHA)
+        panel.fill(PROFILER_OVERLAY_COLOR)
+
+        # Timings and counters.
+        lines = ['frame %d: %.2f ms' % (record['frame'], record['frame_ms'])]
+        lines += ['%s: %.2f ms' % (phase, record[phase + '_ms']) for phase in profiler_module.PHASES]
+        lines += ['pairs %d, collisions %d' % (record['pair_checks'], record['collisions'])]
+        lines += ['bounces %d, pocket tests %d' % (record['bounces'], record['pocket_tests'])]
+        for (i, line) in enumerate(lines):
+            panel.blit(self.font.render(line, True, WHITE_COLOR), (5, 5 + 13 * i))
+
+        # Frame time histogram.
+        bins = profiler.histogram(PROFILER_HISTOGRAM_FRAMES)
+        bar_width = (rect.width - 10) / len(bins)
+        for (i, count) in enumerate(bins):
+            height = 40 * count / max(max(bins), 1)
+            pygame.draw.rect(panel, WHITE_COLOR, (5 + i * bar_width, rect.height - 5 - height, bar_width - 2, height))
+
+        self.screen.blit(panel, rect)
+        self.ball_rects.append(rect)
+        self.dirty_rects.append(rect)
 
     # Update the screen.
     def update(self):
-        pygame.display.flip()
+        if self.is_partial_update():
+            pygame.display.update(self.dirty_rects)
+        else:
+            pygame.display.flip()
+            self.is_full_update_needed = False
+        self.dirty_rects = []
 
 # ------------------------------------------------------------
 # CLASS GAME -------------------------------------------------
 # ------------------------------------------------------------
 
 class Game(object):
-    # Initialize a class instance.
+    # Initialize a class instance and start prefetching the first song.
     def __init__(self):
         self.running = True # If it's False, the program window closes.
         self.balls = [] # An array for the balls.
         self.music_list = ('music/dub_eastern.ogg', 'music/easy_jam.ogg', 'music/firmament.ogg', 'music/niles_blues.ogg') # Music list.
-        self.currently_playing = None # Current song.
-        self.next_song = None # Next song.
+        self.is_music_on = False # If it's True, the music is on.
+        self.currently_playing_song = None # Current song.
+        self.next_song = None # Next song. It's read into memory in the background while the current one plays.
+        self.song_file = None # The current song in memory (the mixer streams it from there).
+        self.is_song_waiting = False # If it's True, the next song starts as soon as it's in memory.
+        self.game_over_time = None # When the window closes after the game is over (pygame.time.get_ticks() time).
+        self.prefetch_song()
+
+    # Check if nothing can change until the user does something: no ball moves, the cue ball isn't held or thrown,
+    # the computer player isn't about to shoot, no game is being replayed and the bottom bar is complete.
+    def is_idle(self, computer, replay):
+        if replay is not None or rules.is_cue_ball_selected or rules.is_cue_ball_thrown or not screen.is_bar_complete():
+            return False
+        if computer is not None and rules.player == COMPUTER_PLAYER and rules.who_won is None:
+            return False
+        return not rules.are_balls_moving(self.balls)
+
+    # Sleep until something happens while the game is idle. Mouse motion only moves the mouse position, and a song that
+    # was waiting is started while sleeping, so neither of them wakes the game up. Returns the events that do,
+    # or nothing if a message has been shown long enough (the game has to redraw the bar or close the window).
+    def wait_while_idle(self):
+        while True:
+            timeout = IDLE_TIMEOUT
+            for deadline in (screen.rules_box_time, self.game_over_time):
+                if deadline is not None:
+                    timeout = min(timeout, deadline - pygame.time.get_ticks())
+            if timeout <= 0:
+                return []
+            event = pygame.event.wait(timeout)
+            self.update_music()
+            if event.type == pygame.MOUSEMOTION:
+                screen.mouse_pos = pygame.mouse.get_pos()
+            elif event.type != pygame.NOEVENT:
+                return [event] + pygame.event.get()
 
     # Create balls as instances of the Ball class and append them to the balls array.
     def create_balls(self):
-        self.balls.append(Ball(WHITE_COLOR))
-        self.balls.append(Ball(BLACK_COLOR))
-        self.balls.append(Ball(PURPLE_COLOR))
-        self.balls.append(Ball(GREEN_COLOR))
-        self.balls.append(Ball(BLUE_COLOR))
-        self.balls.append(Ball(ORANGE_COLOR))
-        self.balls.append(Ball(YELLOW_COLOR))
-        self.balls.append(Ball(RED_COLOR))
-        self.balls.append(Ball(BROWN_COLOR))
-        self.balls.append(Ball(PURPLE_STRIPED_COLOR))
-        self.balls.append(Ball(GREEN_STRIPED_COLOR))
-        self.balls.append(Ball(BLUE_STRIPED_COLOR))
-        self.balls.append(Ball(ORANGE_STRIPED_COLOR))
-        self.balls.append(Ball(YELLOW_STRIPED_COLOR))
-        self.balls.append(Ball(RED_STRIPED_COLOR))
-        self.balls.append(Ball(BROWN_STRIPED_COLOR))
+        for color in BALL_COLORS:
+            self.balls.append(Ball(color))
 
     # Turn the music on/off.
     def music_player(self):
-        if screen.mouse_pos[0] >= BAR_MARGIN and screen.mouse_pos[0] <= BAR_MARGIN + screen.music_box.get_width() and screen.mouse_pos[1] >= SCREEN_SIZE[1] - BAR_SIZE[1] / 2 - MUSIC_BOX_SIZE[1] / 2 and screen.mouse_pos[1] <= SCREEN_SIZE[1] - BAR_SIZE[1] / 2 - MUSIC_BOX_SIZE[1] / 2 + screen.music_box.get_height():
-            if screen.music_box.get_width() == 109:
-                screen.music_box = pygame.image.load('images/music_off.png').convert_alpha()
-                game.currently_playing = None
-                game.next_song = None
+        music_box = screen.assets.get(screen.music_box)
+        if screen.mouse_pos[0] >= BAR_MARGIN and screen.mouse_pos[0] <= BAR_MARGIN + music_box.get_width() and screen.mouse_pos[1] >= SCREEN_SIZE[1] - BAR_SIZE[1] / 2 - MUSIC_BOX_SIZE[1] / 2 and screen.mouse_pos[1] <= SCREEN_SIZE[1] - BAR_SIZE[1] / 2 - MUSIC_BOX_SIZE[1] / 2 + music_box.get_height():
+            if self.is_music_on:
+                screen.music_box = 'music_off'
+                self.is_music_on = False
+                self.is_song_waiting = False
                 pygame.mixer.music.stop()
             else:
-                screen.music_box = pygame.image.load('images/music_on.png').convert_alpha()
-                game.next_song = random.choice(game.music_list)
-                game.currently_playing_song = game.next_song
-                pygame.mixer.music.load(game.currently_playing_song)
-                pygame.mixer.music.play()
-
-    # Set random song from the music list to play next.
-    def music_queue(self):
+                screen.music_box = 'music_on'
+                self.is_music_on = True
+                self.is_song_waiting = True
+                self.update_music()
+
+    # Choose a random song from the music list (not the current one) to play next and start reading it in the background.
+    def prefetch_song(self):
+        self.next_song = random.choice(self.music_list)
         while self.next_song == self.currently_playing_song:
             self.next_song = random.choice(self.music_list)
-        self.currently_playing_song = self.next_song
-        pygame.mixer.music.load(self.next_song)
-        pygame.mixer.music.play()
-
-# ------------------------------------------------------------
-# CLASS RULES ------------------------------------------------
-# ------------------------------------------------------------
+        loader.request(self.next_song, loader_module.read_file, self.next_song)
 
-class Rules(object):
-    # Initialize a class instance.
-    def __init__(self):
-        self.is_cue_ball_selected = False # If it's True, the cue ball is selected.
-        self.is_cue_ball_moveable = True # If it's True, the cue ball can be moved.
-        self.is_cue_ball_moved = False # If it's True, the cue ball has been moved.
-        self.is_cue_ball_thrown = False # If it's True, the cue ball has been thrown.
-        self.player = random.choice([1, 2]) # Randomly choose which player goes first.
-        self.balls_pocketed = [] # Record which balls were pocketed this turn.
-        self.colors = (None, None) # Set the colors for both players.
-        self.shots = 1 # Record how many shots the player has left.
-        self.hits = [] # Detect which ball was hit first by the cue ball.
-        self.who_won = None # Shows who won the game.
-
-    # Check the game rules after the player made a move.
-    def check_rules(self):
-        if not self.are_balls_moving() and self.is_cue_ball_thrown: # No balls are moving and the cue ball has been thrown.
-            self.is_cue_ball_thrown = False
-            
-            if self.is_illegal_ball_pocketed() and self.who_won == None: # An illegal ball has been pocketed.
-                screen.update_rules_box(1, True)
-                self.shots = 2 # The next player has 2 shots because the rules were broken.
-                self.change_player() # Change the player.
-
-            elif len(self.hits) == 0 and self.who_won == None: # No balls were hit.
-                screen.update_rules_box(None, False)
-                self.shots = 2
-                self.change_player()
-                
-            elif self.is_illegal_ball_hit_first() and self.who_won == None: # An illegal ball has been hit first.
-                screen.update_rules_box('illegal', False)
-                self.shots = 2
-                self.change_player()
-
-            elif self.who_won == None: # No rules were broken.
-                if len(self.balls_pocketed) == 0: # No balls were pocketed.
-                    if self.shots == 1:
-                        self.change_player()
-                    else:
-                        self.shots -= 1
-
-                else: # Some balls were pocketed.
-                    if not self.are_balls_left():
-                        self.end_game(True) # The player won.
-                    else:
-                        if self.colors == (None, None):
-                            self.set_colors() # Set the colors if no colors are set yet.
-
-            self.is_cue_ball_moveable = True
-            self.balls_pocketed = []
-            self.hits = []
-                                  
-    def are_balls_moving(self):
-        if all(ball.speed == 0 for ball in game.balls): # If all speeds are 0.
-            return False
-        return True
-
-    def is_illegal_ball_pocketed(self):
-        if any(ball.color == BLACK_COLOR for ball in self.balls_pocketed): # The eight ball was pocketed.
-            if len(self.balls_pocketed) > 1: # Some other ball was pocketed as well.
-                self.end_game(False) # The player lost.
-            elif self.player == 1 and self.colors == ('solid', 'striped'):
-                for ball in game.balls:
-                    if len(ball.color) == 3 and ball.color != WHITE_COLOR:
-                        self.end_game(False)
-            elif self.player == 1 and self.colors == ('striped', 'solid') and any(len(ball.color) == 4 for ball in game.balls):
-                self.end_game(False)
-            elif self.player == 2 and self.colors == ('striped', 'solid'):
-                for ball in game.balls:
-                    if len(ball.color) == 3 and ball.color != WHITE_COLOR:
-                        self.end_game(False)
-            elif self.player == 2 and self.colors == ('solid', 'striped') and any(len(ball.color) == 4 for ball in game.balls):
-                self.end_game(False)
-            elif self.colors == (None, None):
-                self.end_game(False)
-            elif self.is_illegal_ball_hit_first():
-                self.end_game(False)
-            else:
-                self.end_game(True) # The player won.
-
-        elif any(ball.color == WHITE_COLOR for ball in self.balls_pocketed): # The cue ball was pocketed.
-            game.balls.insert(0, Ball(WHITE_COLOR)) # "Get" the cue ball out of the pocket.
-            game.balls[0].place() # Place it at its starting position.
-            return True
-
-        elif self.player == 1 and self.colors == ('striped', 'solid') and any(len(ball.color) == 3 for ball in self.balls_pocketed): # Wrong color was pocketed.
-            return True
-
-        elif self.player == 1 and self.colors == ('solid', 'striped') and any(len(ball.color) == 4 for ball in self.balls_pocketed):
-            return True
-
-        elif self.player == 2 and self.colors == ('striped', 'solid') and any(len(ball.color) == 4 for ball in self.balls_pocketed):
-            return True
-
-        elif self.player == 2 and self.colors == ('solid', 'striped') and any(len(ball.color) == 3 for ball in self.balls_pocketed):
-            return True
-
-        return False
-
-    def is_illegal_ball_hit_first(self):
-        if self.hits[0].color == BLACK_COLOR:
-            if self.player == 1 and self.colors == ('solid', 'striped'):
-                for ball in game.balls:
-                    if len(ball.color) == 3 and ball.color != WHITE_COLOR:
-                        return True
-            elif self.player == 1 and self.colors == ('striped', 'solid') and any(len(ball.color) == 4 for ball in game.balls):
-                return True
-            if self.player == 2 and self.colors == ('striped', 'solid'):
-                for ball in game.balls:
-                    if len(ball.color) == 3 and ball.color != WHITE_COLOR:
-                        return True
-            elif self.player == 2 and self.colors == ('solid', 'striped') and any(len(ball.color) == 4 for ball in game.balls):
-                return True
-            elif self.colors == (None, None):
-                return True
-            
-        else:
-            if self.player == 1 and self.colors == ('solid', 'striped') and len(self.hits[0].color) == 4:
-                return True
-            elif self.player == 1 and self.colors == ('striped', 'solid') and len(self.hits[0].color) == 3:
-                return True
-            elif self.player == 2 and self.colors == ('solid', 'striped') and len(self.hits[0].color) == 3:
-                return True
-            elif self.player == 2 and self.colors == ('striped', 'solid') and len(self.hits[0].color) == 4:
-                return True
-
-        return False
-            
-    def change_player(self):
-        if self.player == 1:
-            self.player = 2
-        else:
-            self.player = 1
-
-    def are_balls_left(self):
-        if any(ball.color == BLACK_COLOR for ball in self.balls_pocketed):
-            return False
-        return True
-
-    def set_colors(self):
-        if len(self.balls_pocketed[0].color) == 3:
-            if self.player == 1:
-                self.colors = ('solid', 'striped')
-            else:
-                self.colors = ('striped', 'solid')
-        else:
-            if self.player == 1:
-                self.colors = ('striped', 'solid')
-            else:
-                self.colors = ('solid', 'striped')
-
-    def end_game(self, is_won):
-        if is_won:
-            if self.player == 1:
-                self.who_won = 1
-            else:
-                self.who_won = 2
-        else:
-            if self.player == 1:
-                self.who_won = 2
-            else:
-                self.who_won = 1
-        screen.game_over()
-        game.running = False
+    # The current song ended: play the next one.
+    def music_queue(self):
+        if self.is_music_on: # The mixer also sends SONG_END when the music is turned off.
+            self.is_song_waiting = True
+            self.update_music()
+
+    # Start the next song if it's waiting and already in memory. Called every frame, so a song that is still being read starts a frame later.
+    def update_music(self):
+        if not self.is_song_waiting or not loader.is_loaded(self.next_song):
+            return
+        self.song_file = io.BytesIO(loader.take(self.next_song))
+        pygame.mixer.music.load(self.song_file, os.path.splitext(self.next_song)[1][1:]) # The extension tells the mixer the format.
+        pygame.mixer.music.play()
+        self.currently_playing_song = self.next_song
+        self.is_song_waiting = False
+        self.prefetch_song() # Read the song after this one while this one plays.
 
 # ------------------------------------------------------------
 # CLASS BALL -------------------------------------------------
 # ------------------------------------------------------------
 
-class Ball(object):
-    # Initialize a class instance.
-    def __init__(self, color):
-        self.color = color # Ball's color.
-        self.pos = [0, 0] # Ball's position.
-        self.angle = 0 # Ball's movement angle.
-        self.speed = 0 # Ball's movement speed.
-
-    # Place the ball at its starting position (depending on its color).
-    def place(self):
-        if self.color == WHITE_COLOR:
-            self.pos = [POOL_TABLE_SIZE[0] / 4, POOL_TABLE_SIZE[1] / 2]
-        elif self.color == BLACK_COLOR:
-            self.pos = [POOL_TABLE_SIZE[0] * 3 / 4 + 4 * BALL_RADIUS, POOL_TABLE_SIZE[1] / 2]
-        elif self.color == PURPLE_COLOR:
-            self.pos = [POOL_TABLE_SIZE[0] * 3 / 4, POOL_TABLE_SIZE[1] / 2]
-        elif self.color == GREEN_COLOR:
-            self.pos = [POOL_TABLE_SIZE[0] * 3 / 4 + 6 * BALL_RADIUS, POOL_TABLE_SIZE[1] / 2 + 3 * BALL_RADIUS]
-        elif self.color == BLUE_COLOR:
-            self.pos = [POOL_TABLE_SIZE[0] * 3 / 4 + 8 * BALL_RADIUS, POOL_TABLE_SIZE[1] / 2 + 4 * BALL_RADIUS]
-        elif self.color == ORANGE_COLOR:
-            self.pos = [POOL_TABLE_SIZE[0] * 3 / 4 + 8 * BALL_RADIUS, POOL_TABLE_SIZE[1] / 2 - 2 * BALL_RADIUS]
-        elif self.color == YELLOW_COLOR:
-            self.pos = [POOL_TABLE_SIZE[0] * 3 / 4 + 4 * BALL_RADIUS, POOL_TABLE_SIZE[1] / 2 - 2 * BALL_RADIUS]
-        elif self.color == RED_COLOR:
-            self.pos = [POOL_TABLE_SIZE[0] * 3 / 4 + 4 * BALL_RADIUS, POOL_TABLE_SIZE[1] / 2 + 2 * BALL_RADIUS]
-        elif self.color == BROWN_COLOR:
-            self.pos = [POOL_TABLE_SIZE[0] * 3 / 4 + 8 * BALL_RADIUS, POOL_TABLE_SIZE[1] / 2]
-        elif self.color == PURPLE_STRIPED_COLOR:
-            self.pos = [POOL_TABLE_SIZE[0] * 3 / 4 + 8 * BALL_RADIUS, POOL_TABLE_SIZE[1] / 2 - 4 * BALL_RADIUS]
-        elif self.color == GREEN_STRIPED_COLOR:
-            self.pos = [POOL_TABLE_SIZE[0] * 3 / 4 + 2 * BALL_RADIUS, POOL_TABLE_SIZE[1] / 2 + BALL_RADIUS]
-        elif self.color == BLUE_STRIPED_COLOR:
-            self.pos = [POOL_TABLE_SIZE[0] * 3 / 4 + 2 * BALL_RADIUS, POOL_TABLE_SIZE[1] / 2 - BALL_RADIUS]
-        elif self.color == ORANGE_STRIPED_COLOR:
-            self.pos = [POOL_TABLE_SIZE[0] * 3 / 4 + 6 * BALL_RADIUS, POOL_TABLE_SIZE[1] / 2 - BALL_RADIUS]
-        elif self.color == YELLOW_STRIPED_COLOR:
-            self.pos = [POOL_TABLE_SIZE[0] * 3 / 4 + 8 * BALL_RADIUS, POOL_TABLE_SIZE[1] / 2 + 2 * BALL_RADIUS]
-        elif self.color == RED_STRIPED_COLOR:
-            self.pos = [POOL_TABLE_SIZE[0] * 3 / 4 + 6 * BALL_RADIUS, POOL_TABLE_SIZE[1] / 2 + BALL_RADIUS]
-        elif self.color == BROWN_STRIPED_COLOR:
-            self.pos = [POOL_TABLE_SIZE[0] * 3 / 4 + 6 * BALL_RADIUS, POOL_TABLE_SIZE[1] / 2 - 3 * BALL_RADIUS]
-
-    # Move the ball.
-    def move(self):
-        if self.speed < SPEED_THRESHOLD: # If the speed is low enough, set it to 0.
-            self.speed = 0
-        
-        self.pos[0] += math.cos(self.angle) * self.speed
-        self.pos[1] += math.sin(self.angle) * self.speed
-        self.speed *= DRAG # Apply air resistance.
-
-    # Check if the ball has collided with a border.
-    def bounce(self):
-        if self.pos[0] >= POOL_TABLE_SIZE[0] - 2 * POOL_TABLE_POCKET_RADIUS - BALL_RADIUS:
-            if self.color == WHITE_COLOR and rules.is_cue_ball_moveable: # Special case for the cue ball when it's being moved by the mouse.
-                self.pos[0] = POOL_TABLE_SIZE[0] - 2 * POOL_TABLE_POCKET_RADIUS - BALL_RADIUS
-            else:
-                self.pos[0] = 2 * (POOL_TABLE_SIZE[0] - 2 * POOL_TABLE_POCKET_RADIUS - BALL_RADIUS) - self.pos[0]
-                self.angle = math.pi - self.angle
-                self.speed *= ELASTICITY # Apply friction.
-        elif self.pos[0] <= 2 * POOL_TABLE_POCKET_RADIUS + BALL_RADIUS:
-            if self.color == WHITE_COLOR and rules.is_cue_ball_moveable:
-                self.pos[0] = 2 * POOL_TABLE_POCKET_RADIUS + BALL_RADIUS
-            else:
-                self.pos[0] = 2 * (2 * POOL_TABLE_POCKET_RADIUS + BALL_RADIUS) - self.pos[0]
-                self.angle = math.pi - self.angle
-                self.speed *= ELASTICITY
-            
-        if self.pos[1] >= POOL_TABLE_SIZE[1] - 2 * POOL_TABLE_POCKET_RADIUS - BALL_RADIUS:
-            if self.color == WHITE_COLOR and rules.is_cue_ball_moveable:
-                self.pos[1] = POOL_TABLE_SIZE[1] - 2 * POOL_TABLE_POCKET_RADIUS - BALL_RADIUS
-            else:
-                self.pos[1] = 2 * (POOL_TABLE_SIZE[1] - 2 * POOL_TABLE_POCKET_RADIUS - BALL_RADIUS) - self.pos[1]
-                self.angle = -self.angle
-                self.speed *= ELASTICITY
-        elif self.pos[1] <= 2 * POOL_TABLE_POCKET_RADIUS + BALL_RADIUS:
-            if self.color == WHITE_COLOR and rules.is_cue_ball_moveable:
-                self.pos[1] = 2 * POOL_TABLE_POCKET_RADIUS + BALL_RADIUS
-            else:
-                self.pos[1] = 2 * (2 * POOL_TABLE_POCKET_RADIUS + BALL_RADIUS) - self.pos[1]
-                self.angle = -self.angle
-                self.speed *= ELASTICITY
-
-    # Select the cue ball.
-    def select_cue_ball(self):
-        if math.hypot(self.pos[0] - screen.mouse_pos[0], self.pos[1] - screen.mouse_pos[1]) <= BALL_RADIUS:
-            return True
-        return False
-
-    # Move the cue ball.
-    def move_cue_ball(self):
-        (dx, dy) = (screen.mouse_pos[0] - self.pos[0], screen.mouse_pos[1] - self.pos[1])
-        self.angle = math.atan2(dy, dx)
-        self.speed = math.hypot(dx, dy) * 0.1
-
-    # Pocket the ball.
-    def pocket(self):
-        if self.pos[0] < 3 * POOL_TABLE_POCKET_RADIUS and self.pos[1] < 3 * POOL_TABLE_POCKET_RADIUS:
-            i = game.balls.index(self)
-            rules.balls_pocketed.append(game.balls[i]) # Append the pocketed ball to the pocketed balls array.
-            if self.color == WHITE_COLOR: # If the cue ball is pocketed while being held with the mouse, this condition prevents a major bug.
-                rules.is_cue_ball_selected = False
-            del game.balls[i] # Remove the pocketed ball from the balls array (and from the screen).
-            
-        elif self.pos[0] > POOL_TABLE_SIZE[0] / 2 - POOL_TABLE_POCKET_RADIUS and self.pos[0] < POOL_TABLE_SIZE[0] / 2 + POOL_TABLE_POCKET_RADIUS and self.pos[1] < 3 * POOL_TABLE_POCKET_RADIUS:
-            i = game.balls.index(self)
-            rules.balls_pocketed.append(game.balls[i])
-            if self.color == WHITE_COLOR:
-                rules.is_cue_ball_selected = False
-            del game.balls[i]
-            
-        elif self.pos[0] > POOL_TABLE_SIZE[0] - 3 * POOL_TABLE_POCKET_RADIUS and self.pos[1] < 3 * POOL_TABLE_POCKET_RADIUS:
-            i = game.balls.index(self)
-            rules.balls_pocketed.append(game.balls[i])
-            if self.color == WHITE_COLOR:
-                rules.is_cue_ball_selected = False
-            del game.balls[i]
-            
-        elif self.pos[0] < 3 * POOL_TABLE_POCKET_RADIUS and self.pos[1] > POOL_TABLE_SIZE[1] - 3 * POOL_TABLE_POCKET_RADIUS:
-            i = game.balls.index(self)
-            rules.balls_pocketed.append(game.balls[i])
-            if self.color == WHITE_COLOR:
-                rules.is_cue_ball_selected = False
-            del game.balls[i]
-            
-        
-        elif self.pos[0] > POOL_TABLE_SIZE[0] / 2 - POOL_TABLE_POCKET_RADIUS and self.pos[0] < POOL_TABLE_SIZE[0] / 2 + POOL_TABLE_POCKET_RADIUS and self.pos[1] > POOL_TABLE_SIZE[1] - 3 * POOL_TABLE_POCKET_RADIUS:
-            i = game.balls.index(self)
-            rules.balls_pocketed.append(game.balls[i])
-            if self.color == WHITE_COLOR:
-                rules.is_cue_ball_selected = False
-            del game.balls[i]
-            
-        elif self.pos[0] > POOL_TABLE_SIZE[0] - 3 * POOL_TABLE_POCKET_RADIUS and self.pos[1] > POOL_TABLE_SIZE[1] - 3 * POOL_TABLE_POCKET_RADIUS:
-            i = game.balls.index(self)
-            rules.balls_pocketed.append(game.balls[i])
-            if self.color == WHITE_COLOR:
-                rules.is_cue_ball_selected = False
-            del game.balls[i]
-
-    # Draw the ball at its current position.
+# Width of the ring a ball is drawn with (0 for a solid ball).
+def stripe_width(color):
+    return STRIPE_WIDTH if len(color) == 4 else 0
+
+# The physics of the ball is in physics.py, this class only adds drawing.
+class Ball(physics.Ball):
+    # Draw the ball at its current position. Returns the area it covers.
     def draw(self):
         if len(self.color) == 4: # Draw a striped ball.
-            pygame.draw.circle(screen.screen, self.color, (int(self.pos[0]), int(self.pos[1])), BALL_RADIUS, 5)
+            return pygame.draw.circle(screen.screen, self.color, (int(self.pos[0]), int(self.pos[1])), BALL_RADIUS, STRIPE_WIDTH)
         else: # Draw a solid ball.
-            pygame.draw.circle(screen.screen, self.color, (int(self.pos[0]), int(self.pos[1])), BALL_RADIUS)
+            return pygame.draw.circle(screen.screen, self.color, (int(self.pos[0]), int(self.pos[1])), BALL_RADIUS)
 
 # ------------------------------------------------------------
 # GLOBAL VARIABLES -------------------------------------------
 # ------------------------------------------------------------
 
-screen = Screen()
-game = Game()
-rules = Rules()
+# They are created by init() when a game is started, so importing this module doesn't open a window, start the mixer or load any image.
+# Pygame itself is imported by init() as well: importing it takes longer than everything else.
+
+pygame = None
+start_time = None # The time to the first frame is measured from here.
+loader = None # Decodes the images and reads the songs in the background.
+screen = None
+game = None
+rules = None
+
+# Initialize the Pygame engine, open the window and start loading the assets. Nothing happens if it's already done.
+def init():
+    global pygame, start_time, loader, screen, game, rules
+    if screen is not None:
+        return
+    start_time = time.perf_counter()
+    import pygame
+    pygame.init()
+    loader = loader_module.Loader()
+    screen = Screen()
+    game = Game()
+    rules = game_rules.Rules(Ball)
 
-# ------------------------------------------------------------
-# COLLISION DETECTION FUNCTION--------------------------------
-# ------------------------------------------------------------
-
-def collide(b1, b2):
-    # Calculate the distance between the centers of two balls. If it's less or equal than 2 * BALL_RADIUS, the balls have collided.
-    (dx, dy) = (b1.pos[0] - b2.pos[0], b1.pos[1] - b2.pos[1])
-    dist = math.hypot(dx, dy)
-    
-    if dist <= 2 * BALL_RADIUS:
-        if b1.color == WHITE_COLOR and len(rules.hits) == 0: # Record which ball was hit first by the cue ball.
-            rules.hits.append(b2)
-        elif b2.color == WHITE_COLOR and len(rules.hits) == 0:
-            rules.hits.append(b1)
-        
-        tangent = math.atan2(dy, dx) + math.pi / 2 # The angle tangent to the balls.
-        angle = tangent - math.pi / 2 # The angle between two balls which is perpendicular to the tangent angle.
-
-        # Apply these rules if one ball if moving and another ball is stationary. Source: http://en.wikipedia.org/wiki/Elastic_collision#Two-_and_three-dimensional
-        if b1.speed == 0:
-            angle2 = math.atan2(math.sin(angle), 1 + math.cos(angle))
-            angle1 = (math.pi - angle) / 2
-            speed2 = (b2.speed * math.sqrt((1 + math.cos(angle)) / 2)) * ELASTICITY # Apply the friction.
-            speed1 = (b2.speed * math.sin(angle / 2)) * ELASTICITY
-        elif b2.speed == 0:
-            angle1 = math.atan2(math.sin(angle), 1 + math.cos(angle))
-            angle2 = (math.pi - angle) / 2
-            speed1 = (b1.speed * math.sqrt((1 + math.cos(angle)) / 2)) * ELASTICITY
-            speed2 = (b1.speed * math.sin(angle / 2)) * ELASTICITY
-
-        # Apply these rules if both balls are moving. Source: http://en.wikipedia.org/wiki/Elastic_collision#Two-_and_three-dimensional
-        else:
-            vx1_after = b2.speed * math.cos(b2.angle - angle) * math.cos(angle) + b1.speed * math.sin(b1.angle - angle) * math.cos(angle + math.pi / 2)
-            vy1_after = b2.speed * math.cos(b2.angle - angle) * math.sin(angle) + b1.speed * math.sin(b1.angle - angle) * math.sin(angle + math.pi / 2)
-            vx2_after = b1.speed * math.cos(b1.angle - angle) * math.cos(angle) + b2.speed * math.sin(b2.angle - angle) * math.cos(angle + math.pi / 2)
-            vy2_after = b1.speed * math.cos(b1.angle - angle) * math.sin(angle) + b2.speed * math.sin(b2.angle - angle) * math.sin(angle + math.pi / 2)
-            angle1 = math.atan2(vy1_after, vx1_after)
-            angle2 = math.atan2(vy2_after, vx2_after)
-            speed1 = (vx1_after / math.cos(angle1)) * ELASTICITY
-            speed2 = (vx2_after / math.cos(angle2)) * ELASTICITY
-
-        # Set the new angle/speed for both balls.
-        (b1.angle, b1.speed) = (angle1, speed1)
-        (b2.angle, b2.speed) = (angle2, speed2)
-
-        # Since time is discrete (i.e. the screen cannot be updated every microsecond), by the time the screen is updated the balls have already overlapped.
-        # We need to set them apart so that they won't "stick" together.
-        overlap = 2 * BALL_RADIUS - dist + 1
-        b1.pos[0] += math.cos(angle) * 0.5 * overlap
-        b1.pos[1] += math.sin(angle) * 0.5 * overlap
-        b2.pos[0] -= math.cos(angle) * 0.5 * overlap
-        b2.pos[1] -= math.sin(angle) * 0.5 * overlap
-    
 # ------------------------------------------------------------
 # MAIN FUNCTION ----------------------------------------------
 # ------------------------------------------------------------
 
 def main():
+    init()
+
     # Create a custom event which will detect when the song ends.
     SONG_END = pygame.USEREVENT + 1
     pygame.mixer.music.set_endevent(SONG_END)
@@ -613,23 +453,86 @@ def main():
     for ball in game.balls:
         ball.place()
 
+    # Broad phase for the collision detection: only the balls in neighbouring cells are checked.
+    grid = SpatialHash(2 * BALL_RADIUS)
+
+    # Only the moving balls (and the ones they could hit) are simulated, the others sleep.
+    rules.active = physics.ActiveSet()
+
+    # Start the game from a random seed (or from the seed of the replayed game), so that it can be recorded and replayed.
+    replay = None
+    if REPLAY_FILE:
+        replay = recording.Replay(recording.read(REPLAY_FILE, REPLAY_INDEX))
+        seed = replay.recording.seed
+    else:
+        seed = random.randrange(2 ** 32)
+    recording.start_game(seed, rules)
+    recorder = None
+    if RECORDING_FILE:
+        recorder = recording.Recorder(RECORDING_FILE, seed)
+    step = 0 # Number of physics steps run so far (the inputs are recorded with it).
+
+    # Record the trajectories.
+    trajectories = None
+    if TRAJECTORY_DIR:
+        import trajectory # Imported here because it imports NumPy.
+        trajectories = trajectory.TrajectoryRecorder(TRAJECTORY_DIR, len(BALL_COLORS), trajectory.color_slots(BALL_COLORS))
+
+    # Start the computer player's worker processes.
+    computer = None
+    if COMPUTER_PLAYER is not None and replay is None:
+        import opponent # Imported here so that the worker processes are only started when needed.
+        computer = opponent.ComputerPlayer(COMPUTER_DIFFICULTY)
+
+    # Time the frames.
+    profiler = None
+    if PROFILER:
+        profiler = profiler_module.FrameProfiler()
+
+    # Measure the CPU usage.
+    cpu = None
+    if CPU_REPORT:
+        cpu = profiler_module.CpuUsage()
+
+    # The physics runs at a fixed rate, independent of the frame rate: lag is the time (in seconds) that hasn't been simulated yet.
+    clock = pygame.time.Clock()
+    lag = 0.0
+    is_first_frame = True # If it's True, the first frame hasn't been shown yet.
+
     # The game loop.
     while game.running:
+        # While the table is at rest, sleep until something happens. Nothing moves while sleeping, so that time isn't simulated.
+        if IDLE_MODE and not is_first_frame and game.is_idle(computer, replay):
+            if cpu:
+                cpu.switch('idle')
+            events = game.wait_while_idle()
+            clock.tick()
+        else:
+            if cpu:
+                cpu.switch('active')
+            lag += clock.tick(FPS) / 1000.0 # Wait so that the game doesn't run faster than FPS.
+            events = pygame.event.get()
+        if profiler:
+            profiler.start_frame()
+
         # The event loop.
-        for event in pygame.event.get():
+        for event in events:
             if event.type == pygame.QUIT: # The user closes the window.
                 game.running = False
                 
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_ESCAPE: # The user presses the ESC key.
                     game.running = False
+                if event.key == pygame.K_F3 and profiler: # The user presses the F3 key.
+                    screen.is_profiler_shown = not screen.is_profiler_shown # Show/hide the profiler timings.
                     
             if event.type == pygame.MOUSEMOTION: # The user moves the mouse.
                 screen.mouse_pos = pygame.mouse.get_pos() # Record the mouse position.
                 
             if event.type == pygame.MOUSEBUTTONDOWN and pygame.mouse.get_pressed()[0] == 1: # The user presses the left mouse button.
                 game.music_player() # Turn the music on/off.
-                rules.is_cue_ball_selected = game.balls[0].select_cue_ball() # Select the cue ball.
+                if rules.player != COMPUTER_PLAYER and rules.who_won is None and replay is None:
+                    rules.is_cue_ball_selected = game.balls[0].select_cue_ball(screen.mouse_pos) # Select the cue ball.
                 
             if event.type == pygame.MOUSEBUTTONUP: # The user releases a mouse button.
                 rules.is_cue_ball_selected = False # Release the cue ball.
@@ -637,38 +540,115 @@ def main():
                     rules.is_cue_ball_moveable = False
                     rules.is_cue_ball_moved = False
                     rules.is_cue_ball_thrown = True
+                    if recorder:
+                        recorder.write(step, recording.CUE_RELEASE)
                 
             if event.type == SONG_END: # Check if the current music theme ended.
-                game.music_queue() # Select the next song to play.
+                game.music_queue() # Play the next song.
+        game.update_music() # Start a song that was waiting for the loader.
+
+        if profiler:
+            profiler.mark('events')
 
         # Clear the screen and draw graphics.
         screen.fill()
         screen.draw_pool_table()
+        if profiler:
+            profiler.mark('draw')
         screen.update_bar()
         screen.draw_bar()
+        if profiler:
+            profiler.mark('bar')
 
         # Move the cue ball if it's selected.
         if rules.is_cue_ball_selected and rules.is_cue_ball_moveable:
-            game.balls[0].move_cue_ball()
+            game.balls[0].move_cue_ball(screen.mouse_pos)
             rules.is_cue_ball_moved = True
-
-        # For each ball do this: move, bounce (check for collision with borders), check for collision with other balls, and draw.
-        for i, ball1 in enumerate(game.balls):
-            ball1.move()
-            ball1.pocket()
-            ball1.bounce()
-            for ball2 in game.balls[i + 1:]:
-                collide(ball1, ball2)
-            ball1.draw()
+            if recorder:
+                recorder.write(step, recording.CUE_MOVE, screen.mouse_pos[0], screen.mouse_pos[1])
+
+        # Let the computer play its shot.
+        if computer is not None and rules.player == COMPUTER_PLAYER and rules.who_won is None and not rules.is_cue_ball_thrown and not rules.are_balls_moving(game.balls):
+            (game.balls[0].angle, game.balls[0].speed) = computer.choose_shot(game.balls, rules)
+            rules.is_cue_ball_moveable = False
+            rules.is_cue_ball_thrown = True
+            if recorder:
+                recorder.write(step, recording.SHOT, game.balls[0].angle, game.balls[0].speed)
+
+        # The cue ball is woken up as soon as it's moved or shot: if no physics step runs this frame, the rules must still see it move.
+        if game.balls[0].speed:
+            rules.active.wake(game.balls[0])
+
+        # Run as many physics steps as fit into the time that has passed.
+        steps = 0
+        while lag >= 1.0 / PHYSICS_RATE and steps < MAX_STEPS_PER_FRAME:
+            if replay:
+                replay.apply(step, game.balls, rules) # Apply the recorded inputs.
+            if game.balls[0].speed:
+                rules.active.wake(game.balls[0]) # A replayed input may have moved or shot the cue ball.
+            physics.step(game.balls, grid, rules.balls_pocketed, rules.hits, rules.is_cue_ball_moveable, rules.active)
+            lag -= 1.0 / PHYSICS_RATE
+            steps += 1
+            step += 1
+        if lag >= 1.0 / PHYSICS_RATE: # The computer is too slow, drop the time that couldn't be simulated.
+            lag = 0.0
+        if any(ball.color == WHITE_COLOR for ball in rules.balls_pocketed): # If the cue ball is pocketed while being held with the mouse, this prevents a major bug.
+            rules.is_cue_ball_selected = False
+        if recorder:
+            recorder.flush() # The inputs of this frame are on the disk even if the game crashes.
+        if trajectories:
+            trajectories.record(game.balls)
+        if profiler:
+            profiler.mark('physics')
+
+        # Draw the balls.
+        screen.draw_balls(game.balls)
+        if profiler:
+            profiler.mark('draw')
 
         # Update the screen.
         screen.update()  
+        if profiler:
+            profiler.mark('update')
 
         # Check the game rules.
-        rules.check_rules()
+        foul = rules.check_rules(game.balls)
+        if foul is not None:
+            screen.update_rules_box(foul)
+        if rules.who_won is not None and game.game_over_time is None:
+            screen.game_over()
+        if game.game_over_time is not None and pygame.time.get_ticks() >= game.game_over_time: # The winner has been shown long enough.
+            game.running = False
+        if profiler:
+            profiler.mark('rules')
+            if screen.is_profiler_shown:
+                screen.draw_profiler(profiler)
+                profiler.mark('draw')
 
         # Update the screen again.
         screen.update()  
+        if profiler:
+            profiler.mark('update')
+            profiler.end_frame()
+        if FIRST_FRAME_REPORT and is_first_frame:
+            print('Time to first frame: %.1f ms (%d of %d bar images shown)' % ((time.perf_counter() - start_time) * 1000, len(screen.assets.images), len(HUD_IMAGES)))
+        is_first_frame = False
+
+    if cpu:
+        cpu.switch(None)
+        for line in cpu.report():
+            print('CPU usage, ' + line)
+    if computer is not None:
+        computer.close() # Stop the worker processes.
+    if trajectories:
+        trajectories.close() # Save the last frames.
+    if recorder:
+        recorder.close()
+    if profiler:
+        profiler.close()
+        if PROFILER_FILE:
+            profiler.write(PROFILER_FILE) # Save the frame records.
+    loader.close()
 
 if __name__ == '__main__':
     main()
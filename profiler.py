@@ -0,0 +1,165 @@
+import collections
+import csv
+import itertools
+import json
+import math
+import time
+
+import physics
+from physics import BALL_RADIUS
+
+# ------------------------------------------------------------
+# GLOBAL CONSTANTS -------------------------------------------
+# ------------------------------------------------------------
+# A frame profiler: times the phases of the game loop and counts the physics work done every frame.
+# Nothing here runs unless a FrameProfiler is created, so the game isn't slowed down when it's off.
+
+# Phases of a frame, in the order they run in pool.py's main loop.
+PHASES = ('events', 'bar', 'physics', 'draw', 'rules', 'update')
+
+# Physics counters.
+COUNTERS = ('pair_checks', 'collisions', 'bounces', 'pocket_tests', 'pockets')
+
+# Upper edges of the frame time histogram bins in milliseconds (the last bin holds everything slower).
+HISTOGRAM_BINS = (4, 8, 12, 16.7, 20, 25, 33.3, 50, math.inf)
+
+# Number of frames kept in memory.
+HISTORY = 100000
+
+# ------------------------------------------------------------
+# CLASS FRAME PROFILER ---------------------------------------
+# ------------------------------------------------------------
+
+class FrameProfiler(object):
+    # Initialize a class instance and start counting the physics calls.
+    def __init__(self, history=HISTORY):
+        self.history = history # Maximum number of frame records.
+        self.records = collections.deque(maxlen=history) # One dictionary per frame: the frame number, the time of every phase and of the whole frame (in milliseconds) and the counters.
+        self.frame = 0 # Number of the current frame.
+        self.counters = dict.fromkeys(COUNTERS, 0) # Physics counters of the current frame.
+        self.phases = {} # Phase times of the current frame.
+        self.frame_start = None # When the current frame started.
+        self.phase_start = None # When the current phase started.
+        self.originals = None # The physics functions replaced by instrument().
+        self.instrument()
+
+    # Replace the physics functions with versions that count their calls.
+    def instrument(self):
+        self.originals = (physics.collide, physics.Ball.bounce, physics.Ball.is_pocketed)
+        (collide, bounce, pocket) = self.originals
+        counters = self.counters
+
+        def counted_collide(b1, b2, hits):
+            counters['pair_checks'] += 1
+            if math.hypot(b1.pos[0] - b2.pos[0], b1.pos[1] - b2.pos[1]) <= 2 * BALL_RADIUS:
+                counters['collisions'] += 1
+            collide(b1, b2, hits)
+
+        def counted_bounce(ball, is_cue_ball_moveable=False):
+            is_reflected = bounce(ball, is_cue_ball_moveable)
+            if is_reflected:
+                counters['bounces'] += 1
+            return is_reflected
+
+        def counted_pocket(ball):
+            counters['pocket_tests'] += 1
+            is_pocketed = pocket(ball)
+            if is_pocketed:
+                counters['pockets'] += 1
+            return is_pocketed
+
+        physics.collide = counted_collide
+        physics.Ball.bounce = counted_bounce
+        physics.Ball.is_pocketed = counted_pocket
+
+    # Put the original physics functions back.
+    def close(self):
+        if self.originals is not None:
+            (physics.collide, physics.Ball.bounce, physics.Ball.is_pocketed) = self.originals
+            self.originals = None
+
+    # Start timing a new frame.
+    def start_frame(self):
+        self.frame_start = self.phase_start = time.perf_counter()
+        self.phases = {}
+
+    # End the current phase: the time since the last mark is added to the named phase.
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0) + (now - self.phase_start) * 1000
+        self.phase_start = now
+
+    # Finish the frame and store its record.
+    def end_frame(self):
+        record = {'frame': self.frame, 'frame_ms': (time.perf_counter() - self.frame_start) * 1000}
+        for phase in PHASES:
+            record[phase + '_ms'] = self.phases.get(phase, 0)
+        record.update(self.counters)
+        self.records.append(record)
+        for counter in COUNTERS:
+            self.counters[counter] = 0
+        self.frame += 1
+
+    # The last frame's record (None before the first frame).
+    def last(self):
+        return self.records[-1] if self.records else None
+
+    # Count the last count frames (all of them if count is None) in every HISTOGRAM_BINS bin.
+    def histogram(self, count=None):
+        bins = [0] * len(HISTOGRAM_BINS)
+        for record in itertools.islice(reversed(self.records), count):
+            for (i, edge) in enumerate(HISTOGRAM_BINS):
+                if record['frame_ms'] <= edge:
+                    bins[i] += 1
+                    break
+        return bins
+
+    # Write the frame records to a CSV file (one row per frame).
+    def write_csv(self, path):
+        with open(path, 'w', newline='') as file:
+            writer = csv.DictWriter(file, ['frame', 'frame_ms'] + [phase + '_ms' for phase in PHASES] + list(COUNTERS))
+            writer.writeheader()
+            writer.writerows(self.records)
+
+    # Write the frame records and the histogram to a JSON file.
+    def write_json(self, path):
+        with open(path, 'w') as file:
+            json.dump({'histogram_bins_ms': [edge if edge != math.inf else None for edge in HISTOGRAM_BINS], 'histogram': self.histogram(), 'frames': list(self.records)}, file)
+
+    # Write the frame records to a file, as JSON if the name ends with .json, otherwise as CSV.
+    def write(self, path):
+        if path.endswith('.json'):
+            self.write_json(path)
+        else:
+            self.write_csv(path)
+
+# ------------------------------------------------------------
+# CLASS CPU USAGE --------------------------------------------
+# ------------------------------------------------------------
+
+# The CPU time the process uses in every phase of the game (e.g. 'idle' and 'active'), as a part of the wall time spent in it.
+# The CPU time is the whole process's (the loading thread's as well), but not the computer player's worker processes'.
+class CpuUsage(object):
+    # Initialize a class instance.
+    def __init__(self):
+        self.totals = {} # [CPU seconds, wall seconds] by phase.
+        self.phase = None # The current phase.
+        self.start = None # (CPU time, wall time) when the current phase started.
+
+    # Start timing a phase: the time since the last call is added to the previous phase. None stops timing.
+    def switch(self, phase):
+        now = (time.process_time(), time.perf_counter())
+        if self.phase is not None:
+            totals = self.totals.setdefault(self.phase, [0.0, 0.0])
+            totals[0] += now[0] - self.start[0]
+            totals[1] += now[1] - self.start[1]
+        (self.phase, self.start) = (phase, now)
+
+    # The CPU usage of a phase in percent of one core (None if no time was spent in it).
+    def usage(self, phase):
+        (cpu, wall) = self.totals.get(phase, (0.0, 0.0))
+        return 100 * cpu / wall if wall else None
+
+    # Lines like "idle: 0.4% CPU over 12.3 s".
+    def report(self):
+        return ['%s: %.1f%% CPU over %.1f s' % (phase, self.usage(phase), self.totals[phase][1]) for phase in sorted(self.totals) if self.totals[phase][1]]
@@ -0,0 +1,211 @@
+import argparse
+import mmap
+import os
+import random
+import struct
+import time
+
+import physics
+import rules as game_rules
+from physics import BALL_RADIUS
+from spatial import SpatialHash
+
+# ------------------------------------------------------------
+# GLOBAL CONSTANTS -------------------------------------------
+# ------------------------------------------------------------
+# Game recordings: the random seed and every input that changes the balls, so that a game can be played again exactly.
+# The inputs are stamped with the number of physics steps run before them (not with the frame, because a frame runs
+# a different number of steps depending on the computer's speed).
+#
+# File format (little-endian): a header (magic, seed, number of inputs) followed by the inputs (step, kind, x, y).
+# An archive is just recordings written one after another.
+
+MAGIC = b'POOLREC1'
+HEADER = struct.Struct('<8sQQ')
+INPUT = struct.Struct('<IBdd')
+
+# Input kinds.
+CUE_MOVE = 0 # The cue ball is pulled towards the mouse (x, y).
+CUE_RELEASE = 1 # The player releases the cue ball.
+SHOT = 2 # The cue ball is shot with angle x and speed y (the computer player's shots).
+
+# A replay stops after this many physics steps without any input and with balls still moving.
+MAX_IDLE_STEPS = 100000
+
+# ------------------------------------------------------------
+# CLASS RECORDER ---------------------------------------------
+# ------------------------------------------------------------
+
+class Recorder(object):
+    # Initialize a class instance and start a new recording at the end of the file.
+    def __init__(self, path, seed):
+        self.file = open(path, 'r+b' if os.path.exists(path) else 'w+b') # Not 'ab': the header is rewritten in place.
+        self.start = self.file.seek(0, os.SEEK_END) # Where the header of this recording is.
+        self.seed = seed # Random seed of the game.
+        self.count = 0 # Number of inputs written.
+        self.flushed = 0 # Number of inputs in the header on the disk.
+        self.file.write(HEADER.pack(MAGIC, seed, 0))
+
+    # Write an input.
+    def write(self, step, kind, x=0.0, y=0.0):
+        self.file.write(INPUT.pack(step, kind, x, y))
+        self.count += 1
+
+    # Write the number of inputs into the header and write everything to the disk, so that a game which crashes
+    # leaves a complete recording (the game calls this once per frame, it does nothing if there are no new inputs).
+    def flush(self):
+        if self.count != self.flushed:
+            end = self.file.tell()
+            self.file.seek(self.start)
+            self.file.write(HEADER.pack(MAGIC, self.seed, self.count))
+            self.file.seek(end)
+            self.file.flush()
+            self.flushed = self.count
+
+    # Write the number of inputs into the header and close the file.
+    def close(self):
+        self.flush()
+        self.file.close()
+
+# ------------------------------------------------------------
+# CLASS RECORDING --------------------------------------------
+# ------------------------------------------------------------
+
+class Recording(object):
+    # Initialize a class instance. The inputs are read lazily from buffer (a memory map) starting at offset.
+    def __init__(self, buffer, offset):
+        (magic, self.seed, self.count) = HEADER.unpack_from(buffer, offset)
+        if magic != MAGIC:
+            raise ValueError('not a recording at offset %d' % offset)
+        self.buffer = buffer # The memory map the recording is in.
+        self.offset = offset # Where the header is.
+        self.size = HEADER.size + self.count * INPUT.size # Size of the recording in bytes.
+
+    # Iterate over the inputs as (step, kind, x, y).
+    def inputs(self):
+        start = self.offset + HEADER.size
+        return INPUT.iter_unpack(memoryview(self.buffer)[start:start + self.count * INPUT.size])
+
+# Open a recording or an archive with a memory map (only the pages that are used are read from the disk).
+def open_map(path):
+    with open(path, 'rb') as file:
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+# Iterate over the recordings in a file. Only the headers are read, so even a huge archive is scanned quickly.
+def scan(buffer):
+    offset = 0
+    while offset + HEADER.size <= len(buffer):
+        recording = Recording(buffer, offset)
+        end = offset + recording.size
+        if end > len(buffer) or (end + HEADER.size <= len(buffer) and buffer[end:end + len(MAGIC)] != MAGIC):
+            # The count in the header is wrong (a game stopped before its last inputs were flushed): the inputs go on
+            # until the next recording or the end of the file, an input cut in half is left out.
+            end = buffer.find(MAGIC, offset + HEADER.size)
+            end = len(buffer) if end < 0 else end
+            recording.count = (end - offset - HEADER.size) // INPUT.size
+            recording.size = HEADER.size + recording.count * INPUT.size
+        yield recording
+        offset = end
+
+# Read the recording with the given index from a file.
+def read(path, index=0):
+    for (i, recording) in enumerate(scan(open_map(path))):
+        if i == index:
+            return recording
+    raise IndexError('recording %d is not in %s' % (index, path))
+
+# ------------------------------------------------------------
+# REPLAY -----------------------------------------------------
+# ------------------------------------------------------------
+
+# Start a game from a seed: the seed decides which player goes first (and everything else picked with the random module).
+def start_game(seed, rules):
+    random.seed(seed)
+    rules.choose_first_player()
+
+# Apply an input to the cue ball (balls[0]).
+def apply_input(kind, x, y, balls, rules):
+    if kind == CUE_MOVE:
+        balls[0].move_cue_ball((x, y))
+    elif kind == CUE_RELEASE:
+        rules.is_cue_ball_moveable = False
+        rules.is_cue_ball_thrown = True
+    elif kind == SHOT:
+        (balls[0].angle, balls[0].speed) = (x, y)
+        rules.is_cue_ball_moveable = False
+        rules.is_cue_ball_thrown = True
+
+class Replay(object):
+    # Initialize a class instance.
+    def __init__(self, recording):
+        self.recording = recording # The recording being played.
+        self.inputs = recording.inputs() # The inputs that haven't been applied yet.
+        self.next = next(self.inputs, None) # The next input.
+
+    # Apply the inputs that were made before the given physics step.
+    def apply(self, step, balls, rules):
+        while self.next is not None and self.next[0] <= step:
+            apply_input(self.next[1], self.next[2], self.next[3], balls, rules)
+            self.next = next(self.inputs, None)
+
+    # Check if all the inputs have been applied.
+    def is_finished(self):
+        return self.next is None
+
+# Play a recording without a display, as fast as possible. Returns (balls, rules, number of physics steps).
+def replay(recording, max_idle_steps=MAX_IDLE_STEPS):
+    balls = physics.rack()
+    rules = game_rules.Rules()
+    start_game(recording.seed, rules)
+    grid = SpatialHash(2 * BALL_RADIUS)
+    rules.active = physics.ActiveSet() # The same as in the game, so the rules are checked at the same steps.
+    player = Replay(recording)
+    steps = 0
+    idle_steps = 0
+    while not player.is_finished() or (rules.are_balls_moving(balls) and idle_steps < max_idle_steps):
+        player.apply(steps, balls, rules)
+        if balls[0].speed:
+            rules.active.wake(balls[0]) # The input may have moved or shot the cue ball.
+        physics.step(balls, grid, rules.balls_pocketed, rules.hits, rules.is_cue_ball_moveable, rules.active)
+        rules.check_rules(balls)
+        steps += 1
+        idle_steps = idle_steps + 1 if player.is_finished() else 0
+    return (balls, rules, steps)
+
+# ------------------------------------------------------------
+# MAIN FUNCTION ----------------------------------------------
+# ------------------------------------------------------------
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay recorded games.')
+    parser.add_argument('file', help='recording or archive of recordings')
+    parser.add_argument('--index', type=int, help='replay only this recording of the archive')
+    parser.add_argument('--realtime', action='store_true', help='show the replay in the game window at normal speed')
+    parser.add_argument('--scan', action='store_true', help='only list the recordings')
+    args = parser.parse_args(argv)
+
+    if args.realtime:
+        import pool # Imported here because only the realtime replay needs the game.
+        pool.REPLAY_FILE = args.file
+        pool.REPLAY_INDEX = args.index or 0
+        pool.main()
+        return
+
+    recordings = list(scan(open_map(args.file)))
+    if args.index is not None:
+        recordings = [recordings[args.index]]
+    total_steps = 0
+    start = time.perf_counter()
+    for recording in recordings:
+        if args.scan:
+            print('offset %d: seed %d, %d inputs' % (recording.offset, recording.seed, recording.count))
+            continue
+        (balls, rules, steps) = replay(recording)
+        total_steps += steps
+        print('offset %d: seed %d, %d inputs, %d steps, %d balls left, winner %s' % (recording.offset, recording.seed, recording.count, steps, len(balls), rules.who_won))
+    elapsed = time.perf_counter() - start
+    if not args.scan and elapsed > 0:
+        print('%d games, %.0f steps/s (%.0fx real time)' % (len(recordings), total_steps / elapsed, total_steps / elapsed / physics.PHYSICS_RATE))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+import random
+
+import physics
+from physics import WHITE_COLOR, BLACK_COLOR, BALL_COLORS
+from physics import YELLOW_COLOR, BLUE_COLOR, RED_COLOR, PURPLE_COLOR, ORANGE_COLOR, GREEN_COLOR, BROWN_COLOR
+from physics import YELLOW_STRIPED_COLOR, BLUE_STRIPED_COLOR, RED_STRIPED_COLOR, PURPLE_STRIPED_COLOR, ORANGE_STRIPED_COLOR, GREEN_STRIPED_COLOR, BROWN_STRIPED_COLOR
+
+# ------------------------------------------------------------
+# GLOBAL CONSTANTS -------------------------------------------
+# ------------------------------------------------------------
+# The 8-ball rules. This module doesn't use Pygame: Rules.check_rules returns the foul and the game shows it.
+
+# Fouls (the same names as the images shown in the rules box).
+ILLEGAL_BALL_POCKETED = 'illegal_ball_pocketed'
+NO_BALLS_HIT = 'no_balls_hit'
+ILLEGAL_BALL_HIT_FIRST = 'illegal_ball_hit_first'
+
+# Ball groups ('solid' and 'striped' are also the names of the images that show a player's group).
+CUE = 'cue'
+SOLID = 'solid'
+STRIPED = 'striped'
+EIGHT = 'eight'
+
+# The number printed on every ball. The numbers are the balls' IDs: they don't change when a ball is pocketed or the cue ball comes back.
+BALL_NUMBERS = {
+    WHITE_COLOR: 0, YELLOW_COLOR: 1, BLUE_COLOR: 2, RED_COLOR: 3, PURPLE_COLOR: 4, ORANGE_COLOR: 5, GREEN_COLOR: 6, BROWN_COLOR: 7, BLACK_COLOR: 8,
+    YELLOW_STRIPED_COLOR: 9, BLUE_STRIPED_COLOR: 10, RED_STRIPED_COLOR: 11, PURPLE_STRIPED_COLOR: 12, ORANGE_STRIPED_COLOR: 13, GREEN_STRIPED_COLOR: 14, BROWN_STRIPED_COLOR: 15,
+}
+
+# The group of every ball number.
+GROUPS = (CUE,) + (SOLID,) * 7 + (EIGHT,) + (STRIPED,) * 7
+
+# The other player's group.
+OPPONENT_GROUPS = {SOLID: STRIPED, STRIPED: SOLID}
+
+# Find the group of a ball.
+def ball_group(ball):
+    return GROUPS[BALL_NUMBERS[ball.color]]
+
+# ------------------------------------------------------------
+# CLASS RULES ------------------------------------------------
+# ------------------------------------------------------------
+
+# The rules keep count of the balls of every group on the table. The counts are updated from the pocketed balls once per turn,
+# so the fouls are found with a few lookups instead of scanning the table. Everything that depends on the kind of game
+# (8-ball) is in the GROUPS and OPPONENT_GROUPS tables and in legal_groups(), so another game only has to change those.
+class Rules(object):
+    # Initialize a class instance. ball_class is used to create a new cue ball when it's pocketed.
+    def __init__(self, ball_class=physics.Ball):
+        self.ball_class = ball_class # Class of the balls on the table.
+        self.is_cue_ball_selected = False # If it's True, the cue ball is selected.
+        self.is_cue_ball_moveable = True # If it's True, the cue ball can be moved.
+        self.is_cue_ball_moved = False # If it's True, the cue ball has been moved.
+        self.is_cue_ball_thrown = False # If it's True, the cue ball has been thrown.
+        self.player = None # The player whose turn it is.
+        self.balls_pocketed = [] # Record which balls were pocketed this turn.
+        self.colors = (None, None) # Set the colors for both players.
+        self.shots = 1 # Record how many shots the player has left.
+        self.hits = [] # Detect which ball was hit first by the cue ball.
+        self.who_won = None # Shows who won the game.
+        self.remaining = {} # Number of balls of every group on the table.
+        self.pocketed = {} # Number of balls of every group pocketed this turn.
+        self.active = None # The physics.ActiveSet of the table, if the game keeps one (are_balls_moving doesn't scan the balls then).
+        self.count_balls(BALL_COLORS)
+        self.choose_first_player()
+
+    # Randomly choose which player goes first.
+    def choose_first_player(self):
+        self.player = random.choice([1, 2])
+
+    # Count the balls of every group from the colors of the balls on the table (used to start from a position other than the rack).
+    def count_balls(self, colors):
+        self.remaining = dict.fromkeys((CUE, SOLID, STRIPED, EIGHT), 0)
+        for color in colors:
+            self.remaining[GROUPS[BALL_NUMBERS[tuple(color)]]] += 1
+
+    # Take the balls pocketed this turn off the counts.
+    def count_pocketed(self):
+        self.pocketed = dict.fromkeys((CUE, SOLID, STRIPED, EIGHT), 0)
+        for ball in self.balls_pocketed:
+            group = ball_group(ball)
+            self.pocketed[group] += 1
+            self.remaining[group] -= 1
+
+    # The group of the player whose turn it is (None while the table is open).
+    def own_group(self):
+        return self.colors[self.player - 1]
+
+    # The groups the player may hit first: the own group, the eight ball once the own group is cleared, or both groups while the table is open.
+    def legal_groups(self):
+        group = self.own_group()
+        if group is None:
+            return (SOLID, STRIPED)
+        if self.remaining[group] == 0:
+            return (EIGHT,)
+        return (group,)
+
+    # Check the game rules after the player made a move. Returns the foul (ILLEGAL_BALL_POCKETED, NO_BALLS_HIT or ILLEGAL_BALL_HIT_FIRST) or None.
+    # If the game is over, who_won is set.
+    def check_rules(self, balls):
+        foul = None
+        if not self.are_balls_moving(balls) and self.is_cue_ball_thrown: # No balls are moving and the cue ball has been thrown.
+            self.is_cue_ball_thrown = False
+            self.count_pocketed()
+            
+            if self.is_illegal_ball_pocketed(balls) and self.who_won == None: # An illegal ball has been pocketed.
+                foul = ILLEGAL_BALL_POCKETED
+                self.shots = 2 # The next player has 2 shots because the rules were broken.
+                self.change_player() # Change the player.
+
+            elif len(self.hits) == 0 and self.who_won == None: # No balls were hit.
+                foul = NO_BALLS_HIT
+                self.shots = 2
+                self.change_player()
+                
+            elif self.is_illegal_ball_hit_first() and self.who_won == None: # An illegal ball has been hit first.
+                foul = ILLEGAL_BALL_HIT_FIRST
+                self.shots = 2
+                self.change_player()
+
+            elif self.who_won == None: # No rules were broken.
+                if len(self.balls_pocketed) == 0: # No balls were pocketed.
+                    if self.shots == 1:
+                        self.change_player()
+                    else:
+                        self.shots -= 1
+
+                else: # Some balls were pocketed.
+                    if not self.are_balls_left():
+                        self.end_game(True) # The player won.
+                    else:
+                        if self.colors == (None, None):
+                            self.set_colors() # Set the colors if no colors are set yet.
+
+            self.is_cue_ball_moveable = True
+            self.balls_pocketed = []
+            self.hits = []
+        return foul
+                                  
+    def are_balls_moving(self, balls):
+        return physics.are_balls_moving(balls, self.active)
+
+    def is_illegal_ball_pocketed(self, balls):
+        if self.pocketed[EIGHT]: # The eight ball was pocketed.
+            if len(self.balls_pocketed) > 1: # Some other ball was pocketed as well.
+                self.end_game(False) # The player lost.
+            elif EIGHT not in self.legal_groups(): # The player's balls are still on the table (or the table is open).
+                self.end_game(False)
+            elif self.is_illegal_ball_hit_first():
+                self.end_game(False)
+            else:
+                self.end_game(True) # The player won.
+
+        elif self.pocketed[CUE]: # The cue ball was pocketed.
+            balls.insert(0, self.ball_class(WHITE_COLOR)) # "Get" the cue ball out of the pocket.
+            balls[0].place() # Place it at its starting position.
+            self.remaining[CUE] += 1
+            return True
+
+        elif self.pocketed.get(OPPONENT_GROUPS.get(self.own_group()), 0): # Wrong color was pocketed.
+            return True
+
+        return False
+
+    def is_illegal_ball_hit_first(self):
+        group = ball_group(self.hits[0])
+        if group == EIGHT:
+            return EIGHT not in self.legal_groups()
+        return group == OPPONENT_GROUPS.get(self.own_group())
+            
+    def change_player(self):
+        if self.player == 1:
+            self.player = 2
+        else:
+            self.player = 1
+
+    def are_balls_left(self):
+        return self.pocketed[EIGHT] == 0
+
+    def set_colors(self):
+        group = ball_group(self.balls_pocketed[0])
+        if self.player == 1:
+            self.colors = (group, OPPONENT_GROUPS[group])
+        else:
+            self.colors = (OPPONENT_GROUPS[group], group)
+
+    def end_game(self, is_won):
+        if is_won:
+            if self.player == 1:
+                self.who_won = 1
+            else:
+                self.who_won = 2
+        else:
+            if self.player == 1:
+                self.who_won = 2
+            else:
+                self.who_won = 1
@@ -0,0 +1,353 @@
+import argparse
+import asyncio
+import heapq
+import json
+import math
+import random
+import time
+
+import physics
+import recording
+import rules as game_rules
+import simulation
+from physics import BALL_RADIUS, PHYSICS_RATE
+from spatial import SpatialHash
+
+# ------------------------------------------------------------
+# GLOBAL CONSTANTS -------------------------------------------
+# ------------------------------------------------------------
+# A game server: many tables without a display in one process, stepped cooperatively by asyncio.
+# Clients send one JSON object per line and get one JSON object per line back:
+#   {"cmd": "new"}                                          -> {"table": 1}
+#   {"cmd": "shoot", "table": 1, "angle": 0.1, "speed": 30} -> {"ok": true}, and when the balls stop:
+#                                                              {"event": "done", "table": 1, "steps": 412, "foul": null, "player": 2, "who_won": null, "balls_left": 15}
+#   {"cmd": "state", "table": 1}                            -> {"table": 1, "player": 1, "colors": [null, null], "shots": 1, "who_won": null, "is_moving": false, "balls": [[color, x, y], ...]}
+#   {"cmd": "close", "table": 1}                            -> {"ok": true}
+# A command that can't be done gets {"error": reason} (one of the *_ERROR constants).
+
+HOST = '127.0.0.1'
+PORT = 8765
+
+# Only the tables with moving balls are scheduled. A table that is further behind than this (in seconds) skips the time
+# it couldn't simulate (it runs in slow motion instead of falling further behind), and while the scheduler is that far behind,
+# new shots are refused with BUSY_ERROR, so that the tables which are already running can catch up.
+MAX_LAG = 0.1
+
+# The scheduler lets the connections run after this many physics steps, even if more tables are due.
+STEPS_PER_YIELD = 50
+
+# Errors.
+BAD_REQUEST_ERROR = 'bad_request'
+UNKNOWN_COMMAND_ERROR = 'unknown_command'
+UNKNOWN_TABLE_ERROR = 'unknown_table'
+BALLS_MOVING_ERROR = 'balls_moving'
+GAME_OVER_ERROR = 'game_over'
+BUSY_ERROR = 'busy'
+
+# Load test: table counts, seconds per count, and the real-time factor a count has to reach to be sustained.
+LOAD_TEST_TABLES = (1, 10, 25, 50, 100, 200)
+LOAD_TEST_DURATION = 5.0
+SUSTAINED_FACTOR = 0.99
+
+# ------------------------------------------------------------
+# CLASS TABLE ------------------------------------------------
+# ------------------------------------------------------------
+
+# One game: the balls, the rules and the physics state. Nothing in it is shared with other tables.
+class Table(object):
+    # Initialize a class instance with the balls at their starting positions.
+    def __init__(self, table_id):
+        self.id = table_id # The table's number.
+        self.balls = physics.rack() # The balls on the table.
+        self.rules = game_rules.Rules() # The state of the game.
+        self.rules.active = physics.ActiveSet() # The resting balls sleep, so a table costs nothing between shots.
+        self.grid = SpatialHash(2 * BALL_RADIUS) # Broad phase of the collision detection.
+        self.steps = 0 # Physics steps of the current shot.
+        self.shot_start = None # When the current shot was made (loop time).
+        self.owner = None # Called with the result when the current shot is over.
+
+    # Check if a shot can be made now. Returns an error or None.
+    def shot_error(self):
+        if self.rules.who_won is not None:
+            return GAME_OVER_ERROR
+        if self.rules.is_cue_ball_thrown: # The rules clear it when the balls have stopped.
+            return BALLS_MOVING_ERROR
+        return None
+
+    # Shoot the cue ball (the same input as the computer player's shots in a recording).
+    def shoot(self, angle, speed):
+        recording.apply_input(recording.SHOT, angle, max(0.0, min(speed, simulation.MAX_SHOT_SPEED)), self.balls, self.rules)
+        self.rules.active.wake(self.balls[0])
+        self.steps = 0
+
+    # Run one physics step and check the rules. Returns the result of the shot when it's over, otherwise None.
+    def tick(self):
+        physics.step(self.balls, self.grid, self.rules.balls_pocketed, self.rules.hits, self.rules.is_cue_ball_moveable, self.rules.active)
+        self.steps += 1
+        foul = self.rules.check_rules(self.balls)
+        if self.rules.is_cue_ball_thrown:
+            return None
+        return {'event': 'done', 'table': self.id, 'steps': self.steps, 'foul': foul, 'player': self.rules.player, 'who_won': self.rules.who_won, 'balls_left': len(self.balls)}
+
+    # The state sent to the clients.
+    def state(self):
+        return {'table': self.id, 'player': self.rules.player, 'colors': list(self.rules.colors), 'shots': self.rules.shots, 'who_won': self.rules.who_won,
+                'is_moving': self.rules.is_cue_ball_thrown, 'balls': [[list(ball.color), ball.pos[0], ball.pos[1]] for ball in self.balls]}
+
+# ------------------------------------------------------------
+# CLASS SERVER -----------------------------------------------
+# ------------------------------------------------------------
+
+class Server(object):
+    # Initialize a class instance.
+    def __init__(self, rate=PHYSICS_RATE, max_lag=MAX_LAG):
+        self.rate = rate # Physics steps per second of every table.
+        self.max_lag = max_lag # See MAX_LAG.
+        self.tables = {} # The tables by number.
+        self.next_id = 1 # Number of the next new table.
+        self.schedule = [] # Heap of (time of the next step, table number) of the tables whose balls are moving.
+        self.lag = 0.0 # How late the last step was run (in seconds).
+        self.steps = 0 # Physics steps run.
+        self.shots = 0 # Shots finished.
+        self.active_time = 0.0 # Seconds of wall time the finished shots were running.
+        self.server = None # The asyncio server.
+        self.scheduler = None # The task which steps the tables.
+        self.connections = {} # The tasks serving the open connections, by writer.
+
+    # Start listening on a TCP port (0 picks a free one), or on a Unix socket if path is given.
+    async def start(self, host=HOST, port=PORT, path=None):
+        if path:
+            self.server = await asyncio.start_unix_server(self.handle_client, path)
+        else:
+            self.server = await asyncio.start_server(self.handle_client, host, port)
+        self.scheduler = asyncio.ensure_future(self.run_tables())
+
+    # The port the server listens on.
+    def port(self):
+        return self.server.sockets[0].getsockname()[1]
+
+    # Stop listening and stepping the tables, and close the connections.
+    async def close(self):
+        self.scheduler.cancel()
+        self.server.close()
+        tasks = list(self.connections.values())
+        for writer in list(self.connections):
+            writer.close()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.server.wait_closed()
+
+    # Create a new table. Returns its number.
+    def new_table(self):
+        table = Table(self.next_id)
+        self.tables[table.id] = table
+        self.next_id += 1
+        return table.id
+
+    # Shoot on a table and schedule it. owner is called with the result when the shot is over. Returns an error or None.
+    def shoot(self, table, angle, speed, owner=None):
+        error = table.shot_error()
+        if error is None and self.schedule and self.lag > self.max_lag:
+            error = BUSY_ERROR
+        if error is not None:
+            return error
+        table.shoot(angle, speed)
+        table.owner = owner
+        table.shot_start = asyncio.get_running_loop().time()
+        heapq.heappush(self.schedule, (table.shot_start, table.id))
+        return None
+
+    # Step the due tables, each at its own rate, forever. The tables that aren't scheduled (their balls are at rest) cost nothing.
+    async def run_tables(self):
+        loop = asyncio.get_running_loop()
+        interval = 1.0 / self.rate
+        steps = 0
+        while True:
+            if not self.schedule:
+                await asyncio.sleep(interval)
+                continue
+            (due, table_id) = self.schedule[0]
+            now = loop.time()
+            if due > now:
+                await asyncio.sleep(due - now)
+                continue
+            heapq.heappop(self.schedule)
+            table = self.tables.get(table_id)
+            if table is None: # The table has been closed.
+                continue
+            self.lag = now - due
+            result = table.tick()
+            self.steps += 1
+            if result is None:
+                heapq.heappush(self.schedule, (max(due + interval, now - self.max_lag), table_id)) # Skip the time a table couldn't simulate.
+            else:
+                self.shots += 1
+                self.active_time += now - table.shot_start
+                if table.owner is not None:
+                    table.owner(result)
+            steps += 1
+            if steps % STEPS_PER_YIELD == 0:
+                await asyncio.sleep(0) # Let the connections run.
+
+    # Run one command. send(message) writes a message to the client (used for the end of a shot). Returns the reply.
+    def handle_command(self, command, send):
+        if not isinstance(command, dict):
+            return {'error': BAD_REQUEST_ERROR}
+        name = command.get('cmd')
+        if name == 'new':
+            return {'table': self.new_table()}
+        if name not in ('shoot', 'state', 'close'):
+            return {'error': UNKNOWN_COMMAND_ERROR}
+        table_id = command.get('table')
+        table = self.tables.get(table_id) if type(table_id) is int else None # Not a list (unhashable) or true (equal to 1).
+        if table is None:
+            return {'error': UNKNOWN_TABLE_ERROR}
+        if name == 'state':
+            return table.state()
+        if name == 'close':
+            del self.tables[table.id]
+            return {'ok': True}
+        try:
+            (angle, speed) = (float(command['angle']), float(command['speed']))
+        except (KeyError, TypeError, ValueError):
+            return {'error': BAD_REQUEST_ERROR}
+        if not (math.isfinite(angle) and math.isfinite(speed)):
+            return {'error': BAD_REQUEST_ERROR}
+        error = self.shoot(table, angle, speed, send)
+        return {'error': error} if error else {'ok': True}
+
+    # Serve a connection: one command at a time. The next command is only read when the replies have been sent
+    # (drain() waits while the client doesn't read), so a slow client only slows itself down.
+    async def handle_client(self, reader, writer):
+        def send(message):
+            if not writer.is_closing():
+                writer.write((json.dumps(message) + '\n').encode())
+        self.connections[writer] = asyncio.current_task()
+        try:
+            async for line in reader:
+                try:
+                    command = json.loads(line)
+                except ValueError:
+                    command = None
+                send(self.handle_command(command, send))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.connections.pop(writer, None)
+            writer.close()
+
+# ------------------------------------------------------------
+# CLIENT -----------------------------------------------------
+# ------------------------------------------------------------
+
+class Client(object):
+    # Initialize a class instance from an open connection.
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    # Connect to a server.
+    @classmethod
+    async def connect(cls, host=HOST, port=PORT, path=None):
+        if path:
+            return cls(*(await asyncio.open_unix_connection(path)))
+        return cls(*(await asyncio.open_connection(host, port)))
+
+    # Send a command and return the next message.
+    async def request(self, **command):
+        self.writer.write((json.dumps(command) + '\n').encode())
+        await self.writer.drain()
+        return await self.receive()
+
+    # Wait for the next message.
+    async def receive(self):
+        return json.loads(await self.reader.readline())
+
+    # Close the connection.
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+# ------------------------------------------------------------
+# LOAD TEST --------------------------------------------------
+# ------------------------------------------------------------
+
+# A player who shoots a random shot as soon as the last one is over, and starts a new table when a game is over. Counts the refused shots.
+async def play(port, stop_time, rng, refused):
+    loop = asyncio.get_running_loop()
+    client = await Client.connect(port=port)
+    table = (await client.request(cmd='new'))['table']
+    while loop.time() < stop_time:
+        reply = await client.request(cmd='shoot', table=table, angle=rng.uniform(-math.pi, math.pi), speed=rng.uniform(1, simulation.MAX_SHOT_SPEED))
+        if 'error' in reply:
+            refused[0] += 1
+            await asyncio.sleep(1.0 / PHYSICS_RATE)
+            continue
+        result = await client.receive()
+        if result['who_won'] is not None:
+            table = (await client.request(cmd='new'))['table']
+    await client.close()
+
+# Run a server with count busy tables (and their players, in the same process) for duration seconds.
+# Returns the real-time factor (steps run / steps the running shots needed), the shots per second, the refused shots and the average lag.
+async def measure(count, duration, seed=0):
+    server = Server()
+    await server.start(port=0)
+    loop = asyncio.get_running_loop()
+    rng = random.Random(seed)
+    refused = [0]
+    start = loop.time()
+    players = [asyncio.ensure_future(play(server.port(), start + duration, random.Random(rng.random()), refused)) for _ in range(count)]
+    lags = []
+    while loop.time() < start + duration:
+        await asyncio.sleep(0.05)
+        lags.append(server.lag)
+    now = loop.time()
+    active_time = server.active_time + sum(now - table.shot_start for table in server.tables.values() if table.rules.is_cue_ball_thrown)
+    factor = server.steps / (active_time * server.rate) if active_time else 1.0
+    for player in players:
+        player.cancel()
+    await asyncio.gather(*players, return_exceptions=True)
+    await server.close()
+    return (factor, server.shots / duration, refused[0], sum(lags) / max(len(lags), 1))
+
+# Print how well one process keeps up with more and more busy tables.
+async def load_test(counts=LOAD_TEST_TABLES, duration=LOAD_TEST_DURATION):
+    print('%8s %14s %10s %10s %10s' % ('tables', 'real time', 'shots/s', 'refused', 'lag (ms)'))
+    sustained = 0
+    for count in counts:
+        (factor, shots_per_second, refused, lag) = await measure(count, duration)
+        print('%8d %13.1f%% %10.1f %10d %10.1f' % (count, factor * 100, shots_per_second, refused, lag * 1000))
+        if factor >= SUSTAINED_FACTOR and refused == 0:
+            sustained = count
+    print('one process sustains %d busy tables at %d steps/s' % (sustained, PHYSICS_RATE))
+
+# ------------------------------------------------------------
+# MAIN FUNCTION ----------------------------------------------
+# ------------------------------------------------------------
+
+async def serve(host, port, path):
+    server = Server()
+    await server.start(host, port, path)
+    print('serving on %s' % (path or '%s:%d' % (host, server.port())))
+    await asyncio.Event().wait() # Until the process is stopped.
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run many pool tables without a display in one process.')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--unix', metavar='PATH', help='listen on a Unix socket instead of a TCP port')
+    parser.add_argument('--load-test', type=int, nargs='*', metavar='TABLES', help='measure how many busy tables one process keeps up with instead of serving')
+    parser.add_argument('--duration', type=float, default=LOAD_TEST_DURATION, help='seconds per table count in the load test')
+    args = parser.parse_args(argv)
+
+    if args.load_test is not None:
+        asyncio.run(load_test(args.load_test or LOAD_TEST_TABLES, args.duration))
+        return
+    try:
+        asyncio.run(serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+import argparse
+import collections
+import json
+import math
+import random
+import sys
+import time
+
+import physics
+from physics import BALL_RADIUS, WHITE_COLOR
+from spatial import SpatialHash
+
+# ------------------------------------------------------------
+# GLOBAL CONSTANTS -------------------------------------------
+# ------------------------------------------------------------
+
+# A shot is stopped after this many physics steps even if some balls are still moving.
+MAX_STEPS = 100000
+
+# The strongest shot the player can make with the mouse (speed = distance * 0.1 in Ball.move_cue_ball).
+MAX_SHOT_SPEED = 60
+
+# Shot cache: shots are simulated once per (table, angle, speed) and kept for this many shots, the least recently used one is forgotten first.
+CACHE_SIZE = 4096
+
+# The shots of the cache are quantized like the mouse makes them (Ball.move_cue_ball): the speed is a tenth of the distance
+# to the mouse, so it moves in steps of 0.1, and 4096 angles per turn are about a pixel apart at the longest distance.
+# The ball positions are quantized to 1/32 pixel.
+CACHE_ANGLES = 4096
+CACHE_SPEED_STEP = 0.1
+CACHE_POSITION_SCALE = 32
+
+# ------------------------------------------------------------
+# CLASS SHOT RESULT ------------------------------------------
+# ------------------------------------------------------------
+
+class ShotResult(object):
+    # Initialize a class instance.
+    def __init__(self, balls, balls_pocketed, first_hit, steps):
+        self.balls = balls # Balls left on the table.
+        self.balls_pocketed = balls_pocketed # Balls pocketed during the shot, in the order they were pocketed.
+        self.first_hit = first_hit # The ball that was hit first by the cue ball (None if no ball was hit).
+        self.steps = steps # How many physics steps it took for the balls to stop.
+
+    # Convert the result to a dictionary (used for the JSON output).
+    def to_dict(self):
+        return {
+            'balls': [ball_to_dict(ball) for ball in self.balls],
+            'balls_pocketed': [list(ball.color) for ball in self.balls_pocketed],
+            'first_hit': None if self.first_hit is None else list(self.first_hit.color),
+            'steps': self.steps,
+        }
+
+# ------------------------------------------------------------
+# SIMULATION FUNCTIONS ---------------------------------------
+# ------------------------------------------------------------
+
+# Make a copy of the balls, so that the simulation doesn't change the caller's table.
+def copy_balls(balls):
+    copies = []
+    for ball in balls:
+        copy = physics.Ball(tuple(ball.color))
+        copy.pos = list(ball.pos)
+        copy.angle = ball.angle
+        copy.speed = ball.speed
+        copies.append(copy)
+    return copies
+
+# Shoot the cue ball with the given angle and speed and run the simulation until all the balls stop. No display is needed.
+def simulate_shot(balls, angle, speed, max_steps=MAX_STEPS):
+    balls = copy_balls(balls)
+    cue_balls = [ball for ball in balls if ball.color == WHITE_COLOR]
+    if len(cue_balls) != 1:
+        raise ValueError('the table must have exactly one cue ball')
+    (cue_balls[0].angle, cue_balls[0].speed) = (angle, speed)
+
+    grid = SpatialHash(2 * BALL_RADIUS)
+    active = physics.ActiveSet()
+    balls_pocketed = []
+    hits = []
+    steps = 0
+    while physics.are_balls_moving(balls, active) and steps < max_steps:
+        physics.step(balls, grid, balls_pocketed, hits, active=active)
+        steps += 1
+
+    return ShotResult(balls, balls_pocketed, hits[0] if hits else None, steps)
+
+# ------------------------------------------------------------
+# CLASS SHOT CACHE -------------------------------------------
+# ------------------------------------------------------------
+
+# Quantize a shot. Returns (angle step, speed step).
+def quantize_shot(angle, speed):
+    return (int(round(angle % (2 * math.pi) * CACHE_ANGLES / (2 * math.pi))) % CACHE_ANGLES, int(round(speed / CACHE_SPEED_STEP)))
+
+# The key of a shot in the cache: the quantized position of every ball (by color) and the quantized shot.
+def shot_key(balls, angle, speed):
+    table = tuple((tuple(ball.color), int(round(ball.pos[0] * CACHE_POSITION_SCALE)), int(round(ball.pos[1] * CACHE_POSITION_SCALE))) for ball in balls)
+    return (table,) + quantize_shot(angle, speed)
+
+# The shots of a quantized key: the one that is simulated for every shot with that key, so that the result doesn't depend on which one came first.
+def cached_shot(angle, speed):
+    (angle_step, speed_step) = quantize_shot(angle, speed)
+    return (angle_step * 2 * math.pi / CACHE_ANGLES, speed_step * CACHE_SPEED_STEP)
+
+# The results of the shots made from the same tables again and again (the computer player tries the same shots many times).
+# evaluate(balls, angle, speed, *args) is called for the shots that aren't in the cache, the extra arguments are part of the key.
+# The results are shared by everyone who asks for the same shot, so they must not be changed.
+class ShotCache(object):
+    # Initialize a class instance.
+    def __init__(self, size=CACHE_SIZE, evaluate=simulate_shot):
+        self.size = size # Maximum number of results kept.
+        self.evaluate = evaluate
+        self.results = collections.OrderedDict() # The results by key, the least recently used one first.
+        self.hits = 0 # Shots found in the cache.
+        self.misses = 0 # Shots that had to be evaluated.
+        self.evictions = 0 # Results forgotten to make room for new ones.
+
+    # Return the result of a shot (the shot actually evaluated is the quantized one, see cached_shot()).
+    def shot(self, balls, angle, speed, *args):
+        key = shot_key(balls, angle, speed) + args
+        result = self.results.get(key)
+        if result is not None:
+            self.results.move_to_end(key)
+            self.hits += 1
+            return result
+        self.misses += 1
+        result = self.evaluate(balls, *(cached_shot(angle, speed) + args))
+        self.results[key] = result
+        if len(self.results) > self.size:
+            self.results.popitem(last=False)
+            self.evictions += 1
+        return result
+
+    # Forget every result (the statistics are kept).
+    def clear(self):
+        self.results.clear()
+
+    # The share of the shots that were found in the cache.
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / float(lookups) if lookups else 0.0
+
+    # The statistics as a line of text.
+    def report(self):
+        return '%d hits, %d misses (%.1f%% hits), %d evictions, %d/%d results' % (self.hits, self.misses, 100 * self.hit_rate(), self.evictions, len(self.results), self.size)
+
+# ------------------------------------------------------------
+# FILE FORMAT ------------------------------------------------
+# ------------------------------------------------------------
+# The shots file has one JSON object per line: {"angle": 0.1, "speed": 30, "balls": [{"color": [255, 255, 255], "pos": [262.5, 275]}, ...]}.
+# If "balls" is left out, the shot is made from the starting position.
+
+# Convert a ball to a dictionary.
+def ball_to_dict(ball):
+    return {'color': list(ball.color), 'pos': list(ball.pos)}
+
+# Create a ball from a dictionary.
+def ball_from_dict(data):
+    ball = physics.Ball(tuple(data['color']))
+    ball.pos = [float(data['pos'][0]), float(data['pos'][1])]
+    return ball
+
+# Read the shots from a file. Returns a list of (balls, angle, speed).
+def read_shots(file):
+    shots = []
+    for line in file:
+        if line.strip():
+            data = json.loads(line)
+            if 'balls' in data:
+                balls = [ball_from_dict(ball) for ball in data['balls']]
+            else:
+                balls = physics.rack()
+            shots.append((balls, float(data['angle']), float(data['speed'])))
+    return shots
+
+# Create random shots from the starting position.
+def random_shots(count, seed=0):
+    rng = random.Random(seed)
+    balls = physics.rack()
+    return [(balls, rng.uniform(-math.pi, math.pi), rng.uniform(1, MAX_SHOT_SPEED)) for _ in range(count)]
+
+# Simulate all the shots with the given simulation function (or the shot method of a ShotCache). Returns the results and the number of shots per second.
+# If simulate_all is given, it's called once with the whole list of shots instead (like vectorized.simulate_shots).
+def run_batch(shots, simulate=simulate_shot, simulate_all=None):
+    start = time.perf_counter()
+    if simulate_all is not None:
+        results = simulate_all(shots)
+    else:
+        results = [simulate(balls, angle, speed) for (balls, angle, speed) in shots]
+    elapsed = time.perf_counter() - start
+    return (results, len(shots) / elapsed if elapsed > 0 else float('inf'))
+
+# ------------------------------------------------------------
+# MAIN FUNCTION ----------------------------------------------
+# ------------------------------------------------------------
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Simulate pool shots without a display.')
+    parser.add_argument('shots', nargs='?', help='file with one JSON shot per line ("-" for stdin)')
+    parser.add_argument('-o', '--output', help='write one JSON result per line to this file')
+    parser.add_argument('--random', type=int, metavar='N', help='simulate N random shots from the starting position instead of reading a file')
+    parser.add_argument('--seed', type=int, default=0, help='seed for --random')
+    parser.add_argument('--engine', choices=('step', 'event', 'vector'), default='step', help='step: physics.step every frame, event: jump from event to event (event_driven.py), vector: many tables at once with NumPy (vectorized.py)')
+    parser.add_argument('--cache', type=int, metavar='SIZE', help='simulate every quantized shot once, keeping up to SIZE results (see ShotCache)')
+    args = parser.parse_args(argv)
+
+    simulate = simulate_shot
+    simulate_all = None
+    if args.engine == 'event':
+        import event_driven # Imported here because event_driven.py imports this module.
+        simulate = event_driven.simulate_shot
+    elif args.engine == 'vector':
+        import vectorized # Imported here because it imports NumPy.
+        simulate = vectorized.simulate_shot
+        simulate_all = vectorized.simulate_shots
+
+    if args.random is not None:
+        shots = random_shots(args.random, args.seed)
+    elif args.shots == '-':
+        shots = read_shots(sys.stdin)
+    elif args.shots:
+        with open(args.shots) as file:
+            shots = read_shots(file)
+    else:
+        parser.error('give a shots file or --random N')
+
+    cache = None
+    if args.cache is not None:
+        cache = ShotCache(args.cache, simulate)
+        simulate = cache.shot
+        simulate_all = None # The cache is asked one shot at a time.
+
+    (results, shots_per_second) = run_batch(shots, simulate, simulate_all)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            for result in results:
+                file.write(json.dumps(result.to_dict()) + '\n')
+
+    steps = sum(result.steps for result in results)
+    print('%d shots, %d steps, %.1f shots/s' % (len(results), steps, shots_per_second))
+    if cache is not None:
+        print('cache: ' + cache.report())
+
+if __name__ == '__main__':
+    main()
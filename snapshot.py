@@ -0,0 +1,242 @@
+import argparse
+import asyncio
+import math
+import random
+import struct
+import time
+
+import physics
+import server
+import simulation
+from physics import PHYSICS_RATE
+from rules import BALL_NUMBERS, SOLID, STRIPED
+
+# ------------------------------------------------------------
+# GLOBAL CONSTANTS -------------------------------------------
+# ------------------------------------------------------------
+# Table snapshots for spectators and remote players, sent at the physics rate. A keyframe has every ball, a delta frame only
+# the balls whose (quantized) state changed since the last frame, so a table at rest costs a header per step.
+# The balls are identified by their numbers (rules.BALL_NUMBERS), which don't change when balls are pocketed.
+#
+# Frame format (little-endian): a header (kind, step, player, colors, shots, who won, flags, a bit per ball number on the table,
+# number of ball records) followed by the ball records (number, x, y, angle, speed), all quantized to 16 bits.
+# On a stream every frame is preceded by its length.
+
+HEADER = struct.Struct('<BIBBBBBHB')
+BALL = struct.Struct('<BHHHh')
+LENGTH = struct.Struct('<H')
+
+# Frame kinds.
+KEYFRAME = 0
+DELTA = 1
+
+# Flags.
+THROWN_FLAG = 1 # The cue ball has been thrown.
+MOVEABLE_FLAG = 2 # The cue ball can be moved.
+
+# The colors of the players (rules.colors) and their codes.
+COLOR_CODES = {(None, None): 0, (SOLID, STRIPED): 1, (STRIPED, SOLID): 2}
+CODE_COLORS = dict((code, colors) for (colors, code) in COLOR_CODES.items())
+
+# The color of every ball number.
+NUMBER_COLORS = dict((number, color) for (color, number) in BALL_NUMBERS.items())
+
+# Quantization: 1/32 pixel (the table is 1050 pixels wide), 1/65536 turn, 1/64 pixel per step: up to 512 either way (a collision
+# can leave a negative speed). The strongest shot the mouse can make is a tenth of the window's diagonal (Ball.move_cue_ball), about 121,
+# and a collision gives a ball at most the sum of both speeds.
+POSITION_SCALE = 32
+ANGLE_SCALE = 65536 / (2 * math.pi)
+SPEED_SCALE = 64
+MAX_VALUE = 65535
+MAX_SPEED_VALUE = 32767
+
+# A keyframe is sent once per second, so a spectator who joins late waits at most a second.
+KEYFRAME_INTERVAL = PHYSICS_RATE
+
+# Loopback test: shots played and the pause between them (in steps, while the next player aims).
+TEST_SHOTS = 20
+TEST_PAUSE = 2 * PHYSICS_RATE
+
+# Quantize the state of a ball. Returns (x, y, angle, speed).
+def quantize(ball):
+    speed = int(round(ball.speed * SPEED_SCALE))
+    if not -MAX_SPEED_VALUE <= speed <= MAX_SPEED_VALUE:
+        raise ValueError('speed %g is out of the snapshot range' % ball.speed)
+    return (max(0, min(int(round(ball.pos[0] * POSITION_SCALE)), MAX_VALUE)), max(0, min(int(round(ball.pos[1] * POSITION_SCALE)), MAX_VALUE)),
+            int(round((ball.angle % (2 * math.pi)) * ANGLE_SCALE)) & MAX_VALUE, speed)
+
+# ------------------------------------------------------------
+# CLASS ENCODER ----------------------------------------------
+# ------------------------------------------------------------
+
+class Encoder(object):
+    # Initialize a class instance. The first frame is a keyframe.
+    def __init__(self, keyframe_interval=KEYFRAME_INTERVAL):
+        self.keyframe_interval = keyframe_interval # Frames from one keyframe to the next.
+        self.frames = 0 # Frames encoded.
+        self.sent = {} # The quantized state of every ball in the last frame, by number.
+
+    # Make the next frame from the balls and the rules after physics step number step.
+    def encode(self, step, balls, rules):
+        is_keyframe = self.frames % self.keyframe_interval == 0
+        self.frames += 1
+        (sent, state, records, present) = (self.sent, {}, [], 0)
+        for ball in balls:
+            number = BALL_NUMBERS[ball.color]
+            values = quantize(ball)
+            state[number] = values
+            present |= 1 << number
+            if is_keyframe or sent.get(number) != values:
+                records.append(BALL.pack(number, *values))
+        self.sent = state
+        flags = (THROWN_FLAG if rules.is_cue_ball_thrown else 0) | (MOVEABLE_FLAG if rules.is_cue_ball_moveable else 0)
+        header = HEADER.pack(KEYFRAME if is_keyframe else DELTA, step, rules.player, COLOR_CODES[tuple(rules.colors)], rules.shots, rules.who_won or 0, flags, present, len(records))
+        return header + b''.join(records)
+
+# ------------------------------------------------------------
+# CLASS DECODER ----------------------------------------------
+# ------------------------------------------------------------
+
+class Decoder(object):
+    # Initialize a class instance. Nothing is known until the first keyframe.
+    def __init__(self):
+        self.state = None # The quantized state of every ball on the table, by number (None until the first keyframe).
+        self.step = None # The physics step of the last frame.
+        self.player = None # The rules fields of the last frame.
+        self.colors = (None, None)
+        self.shots = 1
+        self.who_won = None
+        self.is_cue_ball_thrown = False
+        self.is_cue_ball_moveable = True
+
+    # Apply a frame. Returns False if it's a delta frame and no keyframe has been seen yet (the frame is skipped).
+    def decode(self, frame):
+        (kind, step, player, colors, shots, who_won, flags, present, count) = HEADER.unpack_from(frame)
+        if len(frame) != HEADER.size + count * BALL.size:
+            raise ValueError('snapshot of %d bytes with %d balls' % (len(frame), count))
+        if kind == DELTA and self.state is None:
+            return False
+        state = {} if kind == KEYFRAME else dict((number, values) for (number, values) in self.state.items() if present >> number & 1) # Forget the pocketed balls.
+        for (number, x, y, angle, speed) in BALL.iter_unpack(memoryview(frame)[HEADER.size:]):
+            state[number] = (x, y, angle, speed)
+        self.state = state
+        (self.step, self.player, self.colors, self.shots, self.who_won) = (step, player, CODE_COLORS[colors], shots, who_won or None)
+        self.is_cue_ball_thrown = bool(flags & THROWN_FLAG)
+        self.is_cue_ball_moveable = bool(flags & MOVEABLE_FLAG)
+        return True
+
+    # Create balls from the last frame (the cue ball first, then by number), e.g. to draw the table.
+    def balls(self, ball_class=physics.Ball):
+        balls = []
+        for number in sorted(self.state or ()):
+            (x, y, angle, speed) = self.state[number]
+            ball = ball_class(NUMBER_COLORS[number])
+            ball.pos = [x / float(POSITION_SCALE), y / float(POSITION_SCALE)]
+            ball.angle = angle / ANGLE_SCALE
+            ball.speed = speed / float(SPEED_SCALE)
+            balls.append(ball)
+        return balls
+
+# ------------------------------------------------------------
+# LOOPBACK TEST ----------------------------------------------
+# ------------------------------------------------------------
+
+class Statistics(object):
+    # Initialize a class instance.
+    def __init__(self):
+        self.frames = 0 # Frames sent.
+        self.bytes = 0 # Bytes sent (with the length prefixes).
+        self.keyframe_bytes = 0 # Bytes that would have been sent with a keyframe every step.
+        self.encode_time = 0.0 # Seconds spent encoding.
+        self.decode_time = 0.0 # Seconds spent decoding.
+        self.mismatches = 0 # Frames after which the client's state wasn't the server's.
+        self.expected = [] # The server's quantized state after every frame, for the client to compare.
+
+# Play random shots on a table and send a frame after every physics step (as fast as possible, the rates are per simulated second).
+async def send_frames(writer, statistics, shots, pause, seed):
+    rng = random.Random(seed)
+    table = server.Table(1)
+    (encoder, full) = (Encoder(), Encoder(1))
+    (step, waiting) = (0, 0)
+    while shots or table.rules.is_cue_ball_thrown:
+        if table.rules.is_cue_ball_thrown:
+            table.tick()
+        elif waiting < pause:
+            waiting += 1
+        else:
+            if table.rules.who_won is not None:
+                table = server.Table(1)
+            table.shoot(rng.uniform(-math.pi, math.pi), rng.uniform(1, simulation.MAX_SHOT_SPEED))
+            (shots, waiting) = (shots - 1, 0)
+        step += 1
+
+        start = time.perf_counter()
+        frame = encoder.encode(step, table.balls, table.rules)
+        statistics.encode_time += time.perf_counter() - start
+        statistics.keyframe_bytes += LENGTH.size + len(full.encode(step, table.balls, table.rules))
+        statistics.expected.append(dict(encoder.sent))
+        writer.write(LENGTH.pack(len(frame)) + frame)
+        statistics.frames += 1
+        statistics.bytes += LENGTH.size + len(frame)
+        await writer.drain()
+
+# Receive and decode the frames, and compare the result with the server's state.
+async def receive_frames(reader, statistics):
+    decoder = Decoder()
+    frames = 0
+    while True:
+        try:
+            (size,) = LENGTH.unpack(await reader.readexactly(LENGTH.size))
+            frame = await reader.readexactly(size)
+        except asyncio.IncompleteReadError:
+            return
+        start = time.perf_counter()
+        decoder.decode(frame)
+        statistics.decode_time += time.perf_counter() - start
+        if decoder.state != statistics.expected[frames]:
+            statistics.mismatches += 1
+        frames += 1
+
+# Stream a game over a loopback connection and measure the bandwidth and the cost of the snapshots.
+async def loopback(shots=TEST_SHOTS, pause=TEST_PAUSE, seed=0):
+    statistics = Statistics()
+    done = asyncio.get_running_loop().create_future()
+    async def serve(reader, writer):
+        try:
+            await send_frames(writer, statistics, shots, pause, seed)
+            done.set_result(None)
+        except Exception as error:
+            done.set_exception(error) # Raised by loopback() once the client has seen the connection close.
+        finally:
+            writer.close()
+    server = await asyncio.start_server(serve, '127.0.0.1', 0)
+    (reader, writer) = await asyncio.open_connection('127.0.0.1', server.sockets[0].getsockname()[1])
+    await receive_frames(reader, statistics)
+    await done
+    writer.close()
+    server.close()
+    await server.wait_closed()
+    return statistics
+
+# ------------------------------------------------------------
+# MAIN FUNCTION ----------------------------------------------
+# ------------------------------------------------------------
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Stream a game over a loopback connection and measure the snapshots.')
+    parser.add_argument('--shots', type=int, default=TEST_SHOTS)
+    parser.add_argument('--pause', type=int, default=TEST_PAUSE, help='physics steps between the shots')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    statistics = asyncio.run(loopback(args.shots, args.pause, args.seed))
+    seconds = statistics.frames / float(PHYSICS_RATE)
+    print('%d frames (%.1f s of play), a keyframe every %d frames' % (statistics.frames, seconds, KEYFRAME_INTERVAL))
+    print('%-24s %10.0f bytes/s' % ('delta frames', statistics.bytes / seconds))
+    print('%-24s %10.0f bytes/s' % ('keyframes only', statistics.keyframe_bytes / seconds))
+    print('%-24s %10.2f us/snapshot' % ('encode', statistics.encode_time / statistics.frames * 1e6))
+    print('%-24s %10.2f us/snapshot' % ('decode', statistics.decode_time / statistics.frames * 1e6))
+    print('%-24s %10d' % ('mismatched frames', statistics.mismatches))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+# ------------------------------------------------------------
+# CLASS SPATIAL HASH -----------------------------------------
+# ------------------------------------------------------------
+
+# A uniform grid stored in a dictionary: every cell holds the items whose position falls inside it.
+# With the cell size set to 2 * BALL_RADIUS, two balls can only touch if they are in the same or in neighbouring cells,
+# so the collision check only has to look at a few candidates instead of every other ball.
+class SpatialHash(object):
+    # Initialize a class instance.
+    def __init__(self, cell_size):
+        self.cell_size = cell_size # Width and height of a cell.
+        self.cells = {} # Maps a cell (column, row) to the list of items inside it.
+        self.item_cells = {} # Maps an item to its cell.
+        self.order = {} # Maps an item to the order in which it was inserted.
+
+    # Find the cell which contains a position.
+    def cell(self, pos):
+        return (int(pos[0] // self.cell_size), int(pos[1] // self.cell_size))
+
+    # Remove all the items.
+    def clear(self):
+        self.cells.clear()
+        self.item_cells.clear()
+        self.order.clear()
+
+    # Add an item at the given position.
+    def insert(self, item, pos):
+        cell = self.cell(pos)
+        self.cells.setdefault(cell, []).append(item)
+        self.item_cells[item] = cell
+        self.order[item] = len(self.order)
+
+    # Clear the grid and insert (item, pos) pairs in order.
+    def build(self, items):
+        self.clear()
+        for (item, pos) in items:
+            self.insert(item, pos)
+
+    # Move an item to its new position. Nothing happens if it's still in the same cell.
+    def update(self, item, pos):
+        cell = self.cell(pos)
+        old_cell = self.item_cells[item]
+        if cell != old_cell:
+            self.cells[old_cell].remove(item)
+            self.cells.setdefault(cell, []).append(item)
+            self.item_cells[item] = cell
+
+    # Remove an item.
+    def remove(self, item):
+        self.cells[self.item_cells.pop(item)].remove(item)
+        del self.order[item]
+
+    # Return the items in the cells within radius of a position, in insertion order.
+    # If after is given, only the items inserted after it are returned (like balls[i + 1:] in a pair loop).
+    def nearby(self, pos, radius, after=None):
+        (x1, y1) = self.cell((pos[0] - radius, pos[1] - radius))
+        (x2, y2) = self.cell((pos[0] + radius, pos[1] + radius))
+        first = -1 if after is None else self.order[after]
+        found = []
+        for x in range(x1, x2 + 1):
+            for y in range(y1, y2 + 1):
+                for item in self.cells.get((x, y), ()):
+                    if self.order[item] > first:
+                        found.append(item)
+        found.sort(key=self.order.get)
+        return found
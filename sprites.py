@@ -0,0 +1,58 @@
+import pygame
+
+# ------------------------------------------------------------
+# GLOBAL CONSTANTS -------------------------------------------
+# ------------------------------------------------------------
+# Ball sprites: every kind of circle is drawn once, and the balls are then copied to the screen with one Surface.blits call
+# per frame instead of one pygame.draw.circle call per ball. A sprite is blitted at (x - radius, y - radius) for a circle centered at (x, y).
+# This module imports Pygame, so the games only import it when their window is opened.
+
+# The circles are drawn this many times larger and scaled down, which smooths their edges (anti-aliasing).
+SUPERSAMPLING = 4
+
+# The transparent color of the circles without anti-aliasing (no ball has it).
+COLORKEY = (255, 0, 255)
+
+# Draw a circle (a ring if width is set) on a transparent surface of the same size as the area pygame.draw.circle covers.
+def render_circle(color, radius, width=0):
+    size = 2 * radius * SUPERSAMPLING
+    surface = pygame.Surface((size, size), pygame.SRCALPHA)
+    pygame.draw.circle(surface, color, (size // 2, size // 2), radius * SUPERSAMPLING, width * SUPERSAMPLING)
+    return pygame.transform.smoothscale(surface, (2 * radius, 2 * radius))
+
+# Draw a circle with hard edges on a surface with a transparent color. Blitting it copies the pixels (compressed runs of them)
+# instead of blending every pixel, so it's about twice as fast as an anti-aliased circle.
+def render_hard_circle(color, radius, width=0):
+    surface = pygame.Surface((2 * radius, 2 * radius))
+    surface.fill(COLORKEY)
+    pygame.draw.circle(surface, color, (radius, radius), radius, width)
+    surface.set_colorkey(COLORKEY, pygame.RLEACCEL)
+    return surface
+
+# ------------------------------------------------------------
+# CLASS SPRITE CACHE -----------------------------------------
+# ------------------------------------------------------------
+
+# The images of the circles of one radius by color. An image is drawn the first time its color is looked up,
+# after that sprites[color] is a plain dictionary lookup (the draw loops do one per ball).
+class SpriteCache(dict):
+    # Initialize a class instance. ring_width(color) is the ring width of a color (0 or None for a filled circle).
+    def __init__(self, radius, ring_width=None, is_antialiased=True):
+        dict.__init__(self)
+        self.radius = radius # Radius of the circles.
+        self.ring_width = ring_width
+        self.is_antialiased = is_antialiased # If it's False, the circles have hard edges and are blitted faster.
+
+    # Draw the image of a color that hasn't been looked up before.
+    def __missing__(self, color):
+        width = self.ring_width(color) if self.ring_width else 0
+        if self.is_antialiased:
+            sprite = render_circle(color, self.radius, width)
+            if pygame.display.get_surface() is not None:
+                sprite = sprite.convert_alpha() # The pixel format of the screen, so it isn't converted on every blit.
+        else:
+            sprite = render_hard_circle(color, self.radius, width)
+            if pygame.display.get_surface() is not None:
+                sprite = sprite.convert()
+        self[color] = sprite
+        return sprite
@@ -0,0 +1,102 @@
+import asyncio
+import math
+import os
+
+# The tests run without a window (this has to be set before Pygame is imported).
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import pytest
+
+import benchmark
+import particles
+import physics
+import recording
+import simulation
+import snapshot
+from spatial import SpatialHash
+
+# ------------------------------------------------------------
+# HELPERS ----------------------------------------------------
+# ------------------------------------------------------------
+
+# The state of a list of balls, to compare two simulations exactly.
+def pool_state(balls):
+    return [(ball.color, ball.pos[0], ball.pos[1], ball.angle, ball.speed) for ball in balls]
+
+def particle_state(balls):
+    return [(ball.color, ball.x, ball.y, ball.angle, ball.speed) for ball in balls]
+
+# ------------------------------------------------------------
+# TESTS ------------------------------------------------------
+# ------------------------------------------------------------
+
+# The spatial hash finds the same collisions in the same order as the pair loop.
+def test_grid_matches_pair_loop():
+    with benchmark.saved_particle_globals():
+        naive = benchmark.particle_scene(100, seed=1)
+        gridded = benchmark.particle_scene(100, seed=1) # The same scene again, the globals it sets are the same too.
+        grid = SpatialHash(2 * particles.BALL_RADIUS)
+        for _ in range(50):
+            particles.update_balls(naive)
+            particles.update_balls(gridded, grid)
+        assert particle_state(gridded) == particle_state(naive)
+
+# Skipping the sleeping balls doesn't change a shot, from the break or in a late game.
+@pytest.mark.parametrize('scene', [physics.rack, benchmark.late_game_scene])
+def test_active_set_matches_all_awake(scene):
+    for (angle, speed) in ((0.0, 40), (2.5, 15), (-1.0, 60)):
+        (awake, active) = (scene(), scene())
+        assert benchmark.run_shot(active, angle, speed, True) == benchmark.run_shot(awake, angle, speed, False)
+        assert pool_state(active) == pool_state(awake)
+
+# A recorded game replays the same way every time.
+def test_replay_is_deterministic(tmp_path):
+    path = str(tmp_path / 'game.rec')
+    recorder = recording.Recorder(path, 1234)
+    recorder.write(0, recording.SHOT, 0.1, 35)
+    recorder.write(900, recording.SHOT, 2.0, 20)
+    recorder.close()
+
+    assert recording.read(path).count == 2
+    (balls1, rules1, steps1) = recording.replay(recording.read(path))
+    (balls2, rules2, steps2) = recording.replay(recording.read(path))
+    assert steps1 == steps2
+    assert pool_state(balls1) == pool_state(balls2)
+    assert [ball.color for ball in rules1.balls_pocketed] == [ball.color for ball in rules2.balls_pocketed]
+
+# The pixel renderer draws the same pixels as pygame.draw.circle.
+@pytest.mark.parametrize('radius', [0, 1, 5, 12, 20])
+def test_pixel_renderer_matches_circles(radius):
+    pixels = pytest.importorskip('pixels')
+    if pixels.np is None:
+        pytest.skip('the pixel renderer needs NumPy')
+    assert pixels.compare_with_circles(radius, count=50) == 0
+
+# The client decodes exactly the state the server sent.
+def test_snapshot_round_trip():
+    statistics = asyncio.run(snapshot.loopback(shots=2))
+    assert statistics.frames > 0
+    assert statistics.mismatches == 0
+
+# A shot asked again (or any shot with the same quantized key) comes from the cache.
+def test_shot_cache_hits():
+    cache = simulation.ShotCache(16)
+    balls = physics.rack()
+    (angle, speed) = simulation.cached_shot(0.2, 30) # In the middle of its quantization step.
+    first = cache.shot(balls, angle, speed)
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert cache.shot(balls, angle, speed) is first
+    assert cache.shot(balls, angle + math.pi / simulation.CACHE_ANGLES / 4, speed + 0.01) is first
+    assert (cache.hits, cache.misses) == (2, 1)
+    cache.shot(balls, angle + 1, speed)
+    assert cache.misses == 2
+
+# Whole shots with the vector engine end like the step engine's.
+def test_vector_engine_matches_step_engine():
+    vectorized = pytest.importorskip('vectorized')
+    if vectorized.np is None:
+        pytest.skip('the vector engine needs NumPy')
+    (worst, different) = vectorized.compare_shots(count=12, seed=3)
+    assert different == 0
+    assert worst <= vectorized.TOLERANCE
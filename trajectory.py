@@ -0,0 +1,169 @@
+import json
+import os
+import queue
+import threading
+
+try:
+    import numpy as np
+except ImportError: # NumPy is optional, the games don't need it.
+    np = None
+
+# ------------------------------------------------------------
+# GLOBAL CONSTANTS -------------------------------------------
+# ------------------------------------------------------------
+# Trajectory recording: the position, angle and speed of every ball in every frame, written to NumPy files.
+# The frames go into a ring of preallocated chunks; full chunks are saved by a background thread, so recording a frame
+# only copies numbers into an existing array.
+
+# The recorded values. Every chunk file holds one array of shape (len(COLUMNS), frames, balls).
+COLUMNS = ('x', 'y', 'angle', 'speed')
+
+# Frames per chunk file.
+CHUNK_FRAMES = 1024
+
+# Number of chunks in the ring. If all of them are waiting to be saved, frames are dropped (and counted) instead of waiting.
+RING_CHUNKS = 4
+
+# Description of the recording, written when it's closed.
+META_FILE = 'meta.json'
+
+# ------------------------------------------------------------
+# CLASS TRAJECTORY RECORDER ----------------------------------
+# ------------------------------------------------------------
+
+# Balls are stored in the column given by slot(ball). By default every new ball gets the next free column,
+# a ball which leaves the table (pocketed or destroyed) keeps its column and its values are NaN from then on.
+class TrajectoryRecorder(object):
+    # Initialize a class instance and start the thread which saves the chunks.
+    def __init__(self, directory, max_balls, slot=None, chunk_frames=CHUNK_FRAMES, ring_chunks=RING_CHUNKS, compressed=False):
+        if np is None:
+            raise ImportError('TrajectoryRecorder requires NumPy')
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory # Where the chunk files are saved.
+        self.max_balls = max_balls # Number of ball columns (balls with a larger slot are not recorded).
+        self.slot = slot or self.next_slot # Maps a ball to its column.
+        self.slots = {} # Columns given out by next_slot().
+        self.chunk_frames = chunk_frames # Frames per chunk.
+        self.compressed = compressed # If it's True, the chunks are saved as compressed .npz files (which can't be memory-mapped).
+        self.ring = np.full((ring_chunks, len(COLUMNS), chunk_frames, max_balls), np.nan) # The preallocated chunks.
+        self.free_chunks = queue.Queue() # Chunks which can be filled.
+        for i in range(1, ring_chunks):
+            self.free_chunks.put(i)
+        self.full_chunks = queue.Queue() # (chunk, number, frames) waiting to be saved, None stops the thread.
+        self.chunk = 0 # The chunk being filled (None if all chunks are waiting to be saved).
+        self.row = 0 # The next frame in the chunk.
+        self.chunk_number = 0 # Number of the chunk being filled, counted from the start of the recording.
+        self.frames = 0 # Number of frames recorded (the dropped frames are left out, so the frames after a drop move up).
+        self.dropped_frames = 0 # Number of frames dropped because the saving thread was behind.
+        self.thread = threading.Thread(target=self.save_chunks, daemon=True)
+        self.thread.start()
+
+    # Give a ball the next free column.
+    def next_slot(self, ball):
+        return self.slots.setdefault(ball, len(self.slots))
+
+    # Record one frame. The balls which aren't in the list are stored as NaN.
+    def record(self, balls):
+        if self.chunk is None: # Wait for a free chunk without blocking the game.
+            try:
+                self.chunk = self.free_chunks.get_nowait()
+            except queue.Empty:
+                self.dropped_frames += 1
+                return
+        frame = self.ring[self.chunk, :, self.row]
+        frame.fill(np.nan)
+        for ball in balls:
+            slot = self.slot(ball)
+            if slot < self.max_balls:
+                frame[:, slot] = ball_state(ball)
+        self.row += 1
+        self.frames += 1
+        if self.row == self.chunk_frames:
+            self.flush()
+
+    # Send the chunk being filled to the saving thread.
+    def flush(self):
+        if self.chunk is None or self.row == 0:
+            return
+        self.full_chunks.put((self.chunk, self.chunk_number, self.row))
+        self.chunk_number += 1
+        self.row = 0
+        try:
+            self.chunk = self.free_chunks.get_nowait()
+        except queue.Empty:
+            self.chunk = None
+
+    # Save the full chunks (runs on the background thread).
+    def save_chunks(self):
+        while True:
+            item = self.full_chunks.get()
+            if item is None:
+                return
+            (chunk, number, frames) = item
+            data = self.ring[chunk, :, :frames]
+            if self.compressed:
+                np.savez_compressed(os.path.join(self.directory, 'chunk_%06d.npz' % number), **dict(zip(COLUMNS, data)))
+            else:
+                np.save(os.path.join(self.directory, 'chunk_%06d.npy' % number), data)
+            self.free_chunks.put(chunk)
+
+    # Save the last frames, wait for the thread and write the description of the recording.
+    def close(self):
+        self.flush()
+        self.full_chunks.put(None)
+        self.thread.join()
+        with open(os.path.join(self.directory, META_FILE), 'w') as file:
+            json.dump({'columns': COLUMNS, 'chunk_frames': self.chunk_frames, 'max_balls': self.max_balls, 'frames': self.frames,
+                       'dropped_frames': self.dropped_frames, 'compressed': self.compressed}, file)
+
+# Get the recorded values of a ball: pool.py's balls have pos, particles.py's balls have x and y.
+def ball_state(ball):
+    if hasattr(ball, 'pos'):
+        return (ball.pos[0], ball.pos[1], ball.angle, ball.speed)
+    return (ball.x, ball.y, ball.angle, ball.speed)
+
+# Create a slot function which gives every ball the column of its color (for pool.py, where the colors are unique).
+def color_slots(colors):
+    slots = dict((color, i) for (i, color) in enumerate(colors))
+    return lambda ball: slots.get(tuple(ball.color), len(slots))
+
+# ------------------------------------------------------------
+# CLASS TRAJECTORY -------------------------------------------
+# ------------------------------------------------------------
+
+class Trajectory(object):
+    # Initialize a class instance from a directory written by TrajectoryRecorder. No chunk is read yet.
+    def __init__(self, directory):
+        if np is None:
+            raise ImportError('Trajectory requires NumPy')
+        with open(os.path.join(directory, META_FILE)) as file:
+            meta = json.load(file)
+        self.directory = directory # Where the chunk files are.
+        self.chunk_frames = meta['chunk_frames'] # Frames per chunk.
+        self.max_balls = meta['max_balls'] # Number of ball columns.
+        self.frames = meta['frames'] # Number of recorded frames.
+        self.compressed = meta['compressed'] # If it's True, the chunks are .npz files.
+
+    # Number of frames.
+    def __len__(self):
+        return self.frames
+
+    # Open a chunk. Uncompressed chunks are memory-mapped, so only the sliced frames are read from the disk.
+    def load_chunk(self, number):
+        if self.compressed:
+            with np.load(os.path.join(self.directory, 'chunk_%06d.npz' % number)) as data:
+                return np.stack([data[column] for column in COLUMNS])
+        return np.load(os.path.join(self.directory, 'chunk_%06d.npy' % number), mmap_mode='r')
+
+    # Read the frames from start to stop (not included). Returns a dictionary of arrays of shape (frames, balls), one per column.
+    def slice(self, start, stop):
+        (start, stop) = (max(start, 0), min(stop, self.frames))
+        parts = []
+        frame = start
+        while frame < stop:
+            (number, row) = divmod(frame, self.chunk_frames)
+            rows = min(stop - frame, self.chunk_frames - row)
+            parts.append(self.load_chunk(number)[:, row:row + rows])
+            frame += rows
+        data = np.concatenate(parts, axis=1) if parts else np.empty((len(COLUMNS), 0, self.max_balls))
+        return dict(zip(COLUMNS, data))
@@ -0,0 +1,241 @@
+import math
+
+try:
+    import numpy as np
+except ImportError: # NumPy is optional, the regular engine in pool.py doesn't need it.
+    np = None
+
+import physics
+import simulation
+from physics import BALL_RADIUS, WHITE_COLOR, POOL_TABLE_SIZE, POOL_TABLE_POCKET_RADIUS, DRAG, ELASTICITY, SPEED_THRESHOLD, MAX_SUBSTEP_DISTANCE
+from physics import POCKET_CENTERS, POCKET_CAPTURE_RADIUS_SQUARED, POCKET_REGION_LEFT, POCKET_REGION_RIGHT, POCKET_REGION_TOP
+from spatial import SpatialHash
+
+# ------------------------------------------------------------
+# GLOBAL CONSTANTS -------------------------------------------
+# ------------------------------------------------------------
+
+# Largest difference allowed between the final ball positions of this engine and simulation.simulate_shot for the same shot (see compare_shots()).
+# The pocketed balls, the first ball hit and the number of steps must be the same.
+TOLERANCE = 1e-9
+
+# Cushion limits for the ball centers.
+MIN_X = 2 * POOL_TABLE_POCKET_RADIUS + BALL_RADIUS
+MAX_X = POOL_TABLE_SIZE[0] - 2 * POOL_TABLE_POCKET_RADIUS - BALL_RADIUS
+MIN_Y = 2 * POOL_TABLE_POCKET_RADIUS + BALL_RADIUS
+MAX_Y = POOL_TABLE_SIZE[1] - 2 * POOL_TABLE_POCKET_RADIUS - BALL_RADIUS
+
+# Two balls closer than this during a substep send their table to physics.substep(). It's a bit more than touching distance,
+# so that the rounding of the squared distances here can't miss a collision which math.hypot in collide() would find.
+CONTACT_DISTANCE_SQUARED = (2 * BALL_RADIUS + 1e-6) ** 2
+
+# How many shots simulate_shots() puts in the arrays at once.
+BATCH_SIZE = 256
+
+# ------------------------------------------------------------
+# CLASS VECTOR TABLES ----------------------------------------
+# ------------------------------------------------------------
+
+# A structure-of-arrays copy of many tables: row t of the x, y, angle, speed and on_table arrays holds the balls of table t
+# (the tables with fewer balls are padded with balls that aren't on the table).
+# The steps are split into substeps like physics.step() does, and a substep moves, pockets and bounces the balls of every table with a few array operations.
+# The collisions of a substep depend on the order in which the balls are handled, so a table whose balls could touch during the substep
+# does that substep with physics.substep() instead. The results are the same as simulation.simulate_shot() (see compare_shots()),
+# and only the substeps with a collision cost one Python call per ball.
+class VectorTables(object):
+    # Initialize a class instance from lists of Ball objects (one list per table). The Ball objects are updated by write_back().
+    def __init__(self, tables, is_cue_ball_moveable=False):
+        if np is None:
+            raise ImportError('VectorTables requires NumPy')
+        self.tables = [list(balls) for balls in tables] # The Ball objects of every table, also used for the substeps with collisions.
+        shape = (len(self.tables), max([len(balls) for balls in self.tables] + [0]))
+        self.x = np.zeros(shape) # Balls' x positions.
+        self.y = np.zeros(shape) # Balls' y positions.
+        self.angle = np.zeros(shape) # Balls' movement angles.
+        self.speed = np.zeros(shape) # Balls' movement speeds.
+        self.on_table = np.zeros(shape, dtype=bool) # If it's False, the ball has been pocketed (or it's padding).
+        self.is_cue = np.zeros(shape, dtype=bool) # Marks the cue balls.
+        for (t, balls) in enumerate(self.tables):
+            for (k, ball) in enumerate(balls):
+                (self.x[t, k], self.y[t, k], self.angle[t, k], self.speed[t, k]) = (ball.pos[0], ball.pos[1], ball.angle, ball.speed)
+                (self.on_table[t, k], self.is_cue[t, k]) = (True, ball.color == WHITE_COLOR)
+        self.is_cue_ball_moveable = is_cue_ball_moveable # If it's True, the cue ball is clamped to the cushions instead of bouncing.
+        self.later = np.triu(np.ones((shape[1], shape[1]), dtype=bool), 1) # later[i, j] is True if j > i: ball i is only collided with these balls.
+        self.drag = [1.0] # DRAG ** (1.0 / n) for n substeps, computed with Python floats like Ball.move does.
+        self.grid = SpatialHash(2 * BALL_RADIUS) # Used for the substeps with collisions.
+        self.balls_pocketed = [[] for _ in self.tables] # The pocketed balls of every table, in the order they were pocketed.
+        self.hits = [[] for _ in self.tables] # The ball hit first by the cue ball on every table.
+        self.moving = np.ones(len(self.tables), dtype=bool) # Tables with a ball that moved in the last substep (like ActiveSet.is_moving).
+        self.steps = np.zeros(len(self.tables), dtype=int) # Number of steps made on every table.
+
+    # Advance every moving table by one step, split into substeps like physics.step() does.
+    def step(self):
+        rows = np.flatnonzero(self.moving)
+        if len(rows) == 0:
+            return
+        fastest = np.where(self.on_table[rows], np.abs(self.speed[rows]), 0).max(axis=1)
+        counts = np.maximum(1, np.ceil(fastest / MAX_SUBSTEP_DISTANCE)).astype(int)
+        while len(self.drag) <= counts.max():
+            self.drag.append(DRAG ** (1.0 / len(self.drag)))
+        self.steps[rows] += 1
+        for k in range(counts.max()):
+            # Every table makes its own number of substeps. Once nothing moves on a table, the rest of its substeps wouldn't change anything.
+            selected = (counts > k) & self.moving[rows]
+            if selected.any():
+                self.substep(rows[selected], counts[selected])
+
+    # Move the balls of the given tables by 1 / counts of a step: move, pocket, bounce and collide.
+    def substep(self, rows, counts):
+        (x0, y0, angle, speed, on_table) = (self.x[rows], self.y[rows], self.angle[rows], self.speed[rows], self.on_table[rows])
+
+        # Ball.move.
+        speed = np.where(speed < SPEED_THRESHOLD, 0.0, speed) # If the speed is low enough, set it to 0.
+        fraction = (1.0 / counts)[:, None]
+        x = np.where(on_table, x0 + np.cos(angle) * speed * fraction, x0)
+        y = np.where(on_table, y0 + np.sin(angle) * speed * fraction, y0)
+        speed = np.where(on_table, speed * np.array(self.drag)[counts][:, None], self.speed[rows]) # Apply air resistance.
+
+        # Ball.is_pocketed, then Ball.bounce for the balls left.
+        pocket = (x >= POCKET_REGION_LEFT).astype(int) + (x > POCKET_REGION_RIGHT) + 3 * (y >= POCKET_REGION_TOP)
+        centers = np.array(POCKET_CENTERS)
+        pocketed = on_table & ((x - centers[pocket, 0]) ** 2 + (y - centers[pocket, 1]) ** 2 < POCKET_CAPTURE_RADIUS_SQUARED)
+        (x, y, angle, speed) = self.bounce(x, y, angle, speed, on_table & ~pocketed, self.is_cue[rows])
+
+        # physics.substep() collides a ball with the balls after it, which haven't moved yet. If none of them is close enough, nothing collides.
+        (dx, dy) = (x[:, :, None] - x0[:, None, :], y[:, :, None] - y0[:, None, :])
+        near = (dx * dx + dy * dy <= CONTACT_DISTANCE_SQUARED) & on_table[:, :, None] & on_table[:, None, :] & self.later
+        contact = near.any(axis=(1, 2))
+
+        done = ~contact
+        (rows_done, pocketed) = (rows[done], pocketed[done])
+        (self.x[rows_done], self.y[rows_done], self.angle[rows_done], self.speed[rows_done]) = (x[done], y[done], angle[done], speed[done])
+        self.on_table[rows_done] &= ~pocketed
+        for (r, k) in zip(*np.nonzero(pocketed)):
+            self.balls_pocketed[rows_done[r]].append(self.tables[rows_done[r]][k])
+        moved = self.on_table[rows_done] & ((speed[done] != 0) | (x[done] != x0[done]) | (y[done] != y0[done]))
+        self.moving[rows_done] = moved.any(axis=1)
+
+        for (t, count) in zip(rows[contact], counts[contact]):
+            self.collide_substep(t, 1.0 / count)
+
+    # Bounce the given balls off the cushions (Ball.bounce). Returns the new (x, y, angle, speed).
+    def bounce(self, x, y, angle, speed, on_table, is_cue):
+        clamp = is_cue & self.is_cue_ball_moveable # The cue ball is clamped instead of bounced while it's being moved by the mouse.
+
+        right = on_table & (x >= MAX_X)
+        left = on_table & ~right & (x <= MIN_X)
+        x = np.where(right & clamp, MAX_X, np.where(left & clamp, MIN_X, x))
+        x = np.where(right & ~clamp, 2 * MAX_X - x, np.where(left & ~clamp, 2 * MIN_X - x, x))
+        bounced = (right | left) & ~clamp
+        angle = np.where(bounced, math.pi - angle, angle)
+        speed = np.where(bounced, speed * ELASTICITY, speed)
+
+        bottom = on_table & (y >= MAX_Y)
+        top = on_table & ~bottom & (y <= MIN_Y)
+        y = np.where(bottom & clamp, MAX_Y, np.where(top & clamp, MIN_Y, y))
+        y = np.where(bottom & ~clamp, 2 * MAX_Y - y, np.where(top & ~clamp, 2 * MIN_Y - y, y))
+        bounced = (bottom | top) & ~clamp
+        angle = np.where(bounced, -angle, angle)
+        speed = np.where(bounced, speed * ELASTICITY, speed)
+        return (x, y, angle, speed)
+
+    # Do a substep of table t with physics.substep(), on its Ball objects.
+    def collide_substep(self, t, fraction):
+        indices = np.flatnonzero(self.on_table[t])
+        balls = [self.tables[t][k] for k in indices]
+        starts = []
+        for (k, ball) in zip(indices, balls):
+            (ball.pos, ball.angle, ball.speed) = ([float(self.x[t, k]), float(self.y[t, k])], float(self.angle[t, k]), float(self.speed[t, k]))
+            starts.append(tuple(ball.pos))
+
+        balls_pocketed = []
+        physics.substep(balls, self.grid, balls_pocketed, self.hits[t], self.is_cue_ball_moveable, fraction)
+        self.balls_pocketed[t].extend(balls_pocketed)
+
+        self.moving[t] = False
+        for (k, ball, start) in zip(indices, balls, starts):
+            (self.x[t, k], self.y[t, k], self.angle[t, k], self.speed[t, k]) = (ball.pos[0], ball.pos[1], ball.angle, ball.speed)
+            if ball in balls_pocketed:
+                self.on_table[t, k] = False
+            elif ball.speed != 0 or tuple(ball.pos) != start:
+                self.moving[t] = True
+
+    # Step until every table stops (or has made max_steps steps).
+    def run_to_rest(self, max_steps=simulation.MAX_STEPS):
+        while True:
+            self.moving &= self.steps < max_steps
+            if not self.moving.any():
+                break
+            self.step()
+
+    # Copy the results back into the Ball objects.
+    def write_back(self):
+        for (t, balls) in enumerate(self.tables):
+            for (k, ball) in enumerate(balls):
+                ball.pos = [float(self.x[t, k]), float(self.y[t, k])]
+                ball.angle = float(self.angle[t, k])
+                ball.speed = float(self.speed[t, k])
+
+    # The results of every table, like simulation.simulate_shot returns them.
+    def results(self):
+        results = []
+        for (t, balls) in enumerate(self.tables):
+            left = [ball for (k, ball) in enumerate(balls) if self.on_table[t, k]]
+            first_hit = self.hits[t][0] if self.hits[t] else None
+            results.append(simulation.ShotResult(left, self.balls_pocketed[t], first_hit, int(self.steps[t])))
+        return results
+
+# ------------------------------------------------------------
+# SIMULATION FUNCTIONS ---------------------------------------
+# ------------------------------------------------------------
+
+# Same as simulation.simulate_shot for a list of (balls, angle, speed) shots, simulated BATCH_SIZE at a time. Returns the results in the same order.
+def simulate_shots(shots, max_steps=simulation.MAX_STEPS):
+    results = []
+    for start in range(0, len(shots), BATCH_SIZE):
+        tables = []
+        for (balls, angle, speed) in shots[start:start + BATCH_SIZE]:
+            balls = simulation.copy_balls(balls)
+            cue_balls = [ball for ball in balls if ball.color == WHITE_COLOR]
+            if len(cue_balls) != 1:
+                raise ValueError('the table must have exactly one cue ball')
+            (cue_balls[0].angle, cue_balls[0].speed) = (angle, speed)
+            tables.append(balls)
+
+        batch = VectorTables(tables)
+        batch.run_to_rest(max_steps)
+        batch.write_back()
+        results.extend(batch.results())
+    return results
+
+# Same as simulation.simulate_shot, but with the balls in a VectorTables. A single table gains nothing from the arrays, use simulate_shots() for many shots.
+def simulate_shot(balls, angle, speed, max_steps=simulation.MAX_STEPS):
+    return simulate_shots([(balls, angle, speed)], max_steps)[0]
+
+# ------------------------------------------------------------
+# REFERENCE CHECK --------------------------------------------
+# ------------------------------------------------------------
+
+# What has to be the same in the results of both engines: the balls left and pocketed (by color), the first ball hit and the number of steps.
+def summary(result):
+    first_hit = None if result.first_hit is None else result.first_hit.color
+    return ([ball.color for ball in result.balls], [ball.color for ball in result.balls_pocketed], first_hit, result.steps)
+
+# Simulate random shots with this engine and with simulation.simulate_shot.
+# Returns (largest difference of the final positions, number of shots with other balls left or pocketed, another first hit or another number of steps).
+def compare_shots(count=100, seed=0):
+    shots = simulation.random_shots(count, seed)
+    worst = 0.0
+    different = 0
+    for ((balls, angle, speed), result) in zip(shots, simulate_shots(shots)):
+        expected = simulation.simulate_shot(balls, angle, speed)
+        if summary(result) != summary(expected):
+            different += 1
+            continue
+        for (ball, other) in zip(result.balls, expected.balls):
+            worst = max(worst, abs(ball.pos[0] - other.pos[0]), abs(ball.pos[1] - other.pos[1]))
+    return (worst, different)
+
+if __name__ == '__main__':
+    (worst, different) = compare_shots()
+    print('Largest position difference from simulation.simulate_shot: %g px (tolerance %g), %d shots with other results' % (worst, TOLERANCE, different))